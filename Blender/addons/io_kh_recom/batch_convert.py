@@ -0,0 +1,351 @@
+# Converts every .AZF, .MDL and .GSD file under an extract directory to .blend
+# files using background Blender processes.
+#
+# Sample usage (from the Blender/addons directory):
+#
+#   python -m io_kh_recom.batch_convert C:\path\to\extract C:\path\to\output
+#       --blender C:\path\to\blender.exe -j 8
+#
+# Each input is imported in its own Blender process, so a crash while
+# importing one file does not affect the others. Outputs that are newer than
+# their input and the texture archives and gimmick models it reads, and that
+# were converted with the same options, are skipped. A per-file report is
+# written to report.json in the output directory.
+
+import argparse
+import concurrent.futures
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import decode_gsd
+from . import textures
+
+SUPPORTED_EXTENSIONS = ('.azf', '.gsd', '.mdl')
+
+# Options passed on to the Blender worker as flags of the same name.
+WORKER_OPTIONS = ('no_skybox', 'shadow_models', 'texture_cache', 'scene_cache',
+                  'asset_catalog', 'collection_instances', 'weld_vertices')
+# Worker options that change the converted file. The caches and the catalog
+# only change how the inputs are read.
+OUTPUT_OPTIONS = ('no_skybox', 'shadow_models', 'collection_instances',
+                  'weld_vertices')
+
+_PACKAGE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Runs inside Blender to import a single file.
+_WORKER_SOURCE = f'''
+import sys
+sys.path.insert(0, {os.path.dirname(_PACKAGE_DIRECTORY)!r})
+from {os.path.basename(_PACKAGE_DIRECTORY)} import batch_convert
+batch_convert.convert_in_blender()
+'''
+
+
+def find_input_files(input_directory):
+  input_files = []
+  for dirpath, _, filenames in os.walk(input_directory):
+    for filename in filenames:
+      if os.path.splitext(filename)[1].lower() in SUPPORTED_EXTENSIONS:
+        input_files.append(os.path.join(dirpath, filename))
+  return sorted(input_files)
+
+
+def get_output_path(input_path, input_directory, output_directory):
+  relpath = os.path.relpath(input_path, input_directory)
+  return os.path.join(output_directory, relpath + '.blend')
+
+
+def get_profile_report_path(output_path):
+  return output_path + '.profile.json'
+
+
+# Returns the path of the file that records the options an output was
+# converted with.
+def get_options_path(output_path):
+  return output_path + '.options.json'
+
+
+# Returns the options of parsed arguments that change the converted files.
+def get_output_options(args):
+  return {name: getattr(args, name) for name in OUTPUT_OPTIONS}
+
+
+# Returns the other files that an import of input_path reads: texture archives,
+# and the models of gimmicks placed by GSD files.
+def find_dependencies(input_path):
+  directory = os.path.dirname(input_path)
+  basename, ext = os.path.splitext(os.path.basename(input_path))
+  if ext.lower() != '.gsd':
+    return textures.find_texture_archives(directory, basename, prefixes=('wo',))
+
+  try:
+    gsd = decode_gsd.decode_gsd(input_path)
+  except (decode_gsd.GsdImportError, OSError, ValueError):
+    # The import will fail as well, so there is nothing else to check.
+    return []
+  dependencies = decode_gsd.get_texture_files(gsd)
+  for rsrc_id in sorted({placement.rsrc_id for placement in gsd.placements}):
+    for gimmick_directory in (gsd.directory, gsd.fallback_directory):
+      filepath = os.path.join(gimmick_directory, f'GM{rsrc_id:04d}.mdl')
+      if gimmick_directory and os.path.exists(filepath):
+        dependencies.append(filepath)
+        break
+  return dependencies
+
+
+# Returns True if output_path is newer than its input and dependencies. If
+# options is given, the output must also have been converted with the same
+# options (see get_output_options()).
+def is_up_to_date(input_path, output_path, options=None):
+  if not os.path.exists(output_path):
+    return False
+  if options is not None:
+    try:
+      with open(get_options_path(output_path)) as f:
+        if json.load(f) != options:
+          return False
+    except (OSError, ValueError):
+      return False
+  output_mtime = os.path.getmtime(output_path)
+  return all(
+      os.path.getmtime(path) <= output_mtime
+      for path in [input_path] + find_dependencies(input_path))
+
+
+def _convert_file(args, input_path, output_path):
+  result = {'input': input_path, 'output': output_path}
+  fd, result_path = tempfile.mkstemp(suffix='.json')
+  os.close(fd)
+
+  start_time = time.perf_counter()
+  try:
+    command = [
+        args.blender, '--background', '--factory-startup', '--python-expr',
+        _WORKER_SOURCE, '--', input_path, output_path, result_path
+    ]
+    command += [
+        '--' + name.replace('_', '-')
+        for name in WORKER_OPTIONS
+        if getattr(args, name)
+    ]
+    if args.profile:
+      command += ['--profile-report', get_profile_report_path(output_path)]
+    process = subprocess.run(command,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT,
+                             timeout=args.timeout)
+
+    with open(result_path) as f:
+      contents = f.read()
+    if contents:
+      result.update(json.loads(contents))
+      if result['status'] == 'converted':
+        with open(get_options_path(output_path), 'w') as f:
+          json.dump(get_output_options(args), f)
+    else:
+      result['status'] = 'failed'
+      result['message'] = (f'Blender exited with code {process.returncode}: ' +
+                           process.stdout.decode(errors='replace')[-1000:])
+  except subprocess.TimeoutExpired:
+    result['status'] = 'failed'
+    result['message'] = f'Timed out after {args.timeout} seconds'
+  except OSError as err:
+    # Usually a wrong --blender path.
+    result['status'] = 'failed'
+    result['message'] = f'Cannot run Blender: {err}'
+  finally:
+    os.remove(result_path)
+
+  result['seconds'] = time.perf_counter() - start_time
+  return result
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+      description='Convert KH Re:COM stages and models to .blend files.')
+  parser.add_argument('input_directory')
+  parser.add_argument('output_directory')
+  parser.add_argument('--blender',
+                      default='blender',
+                      help='Path to the Blender executable.')
+  parser.add_argument('-j',
+                      '--jobs',
+                      type=int,
+                      default=os.cpu_count() or 1,
+                      help='Number of files to convert in parallel.')
+  parser.add_argument('--timeout',
+                      type=float,
+                      default=None,
+                      help='Maximum number of seconds per file.')
+  parser.add_argument('--force',
+                      action='store_true',
+                      help='Convert files even if their output is up to date.')
+  parser.add_argument('--no-skybox',
+                      action='store_true',
+                      help='Do not import skybox objects in stages.')
+  parser.add_argument('--shadow-models',
+                      action='store_true',
+                      help='Import models used for shadows.')
+  parser.add_argument('--texture-cache',
+                      action='store_true',
+                      help='Use the decoded texture disk cache.')
+  parser.add_argument('--scene-cache',
+                      action='store_true',
+                      help='Use the decoded mesh and placement disk cache.')
+  parser.add_argument(
+      '--asset-catalog',
+      action='store_true',
+      help='Index the input directory in the asset catalog before converting, '
+      'and resolve textures and gimmicks through it.')
+  parser.add_argument(
+      '--collection-instances',
+      action='store_true',
+      help='Instance repeated stage meshes and gimmicks as collections.')
+  parser.add_argument('--weld-vertices',
+                      action='store_true',
+                      help='Merge identical vertices of imported meshes.')
+  parser.add_argument(
+      '--profile',
+      action='store_true',
+      help='Write a profiling report next to each output .blend file.')
+  args = parser.parse_args(argv)
+
+  if args.asset_catalog:
+    from . import catalog
+    with catalog.AssetCatalog() as asset_catalog:
+      count = asset_catalog.refresh(args.input_directory)
+    print(f'Indexed {count} changed directories in the asset catalog')
+
+  results = []
+  pending = []
+  for input_path in find_input_files(args.input_directory):
+    output_path = get_output_path(input_path, args.input_directory,
+                                  args.output_directory)
+    if not args.force and is_up_to_date(input_path, output_path,
+                                        get_output_options(args)):
+      results.append({
+          'input': input_path,
+          'output': output_path,
+          'status': 'skipped',
+      })
+    else:
+      pending.append((input_path, output_path))
+
+  # Worker threads only wait on Blender processes.
+  with concurrent.futures.ThreadPoolExecutor(max(1, args.jobs)) as executor:
+    futures = [
+        executor.submit(_convert_file, args, input_path, output_path)
+        for input_path, output_path in pending
+    ]
+    for future in concurrent.futures.as_completed(futures):
+      result = future.result()
+      results.append(result)
+      print('[{}] {} ({:.2f}s){}'.format(
+          result['status'], result['input'], result['seconds'],
+          f': {result["message"]}' if result.get('message') else ''))
+
+  results.sort(key=lambda result: result['input'])
+  os.makedirs(args.output_directory, exist_ok=True)
+  report_path = os.path.join(args.output_directory, 'report.json')
+  with open(report_path, 'w') as f:
+    json.dump(results, f, indent=2)
+
+  counts = {}
+  for result in results:
+    counts[result['status']] = counts.get(result['status'], 0) + 1
+  print(', '.join(f'{count} {status}' for status, count in counts.items()))
+  print(f'Report written to {report_path}')
+  return 1 if counts.get('failed') else 0
+
+
+# Entry point for the Blender worker process. Arguments follow "--".
+def convert_in_blender():
+  # pylint: disable=import-error
+  import bpy
+  from . import profiling
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('input_path')
+  parser.add_argument('output_path')
+  parser.add_argument('result_path')
+  parser.add_argument('--no-skybox', action='store_true')
+  parser.add_argument('--shadow-models', action='store_true')
+  parser.add_argument('--texture-cache', action='store_true')
+  parser.add_argument('--scene-cache', action='store_true')
+  parser.add_argument('--asset-catalog', action='store_true')
+  parser.add_argument('--collection-instances', action='store_true')
+  parser.add_argument('--weld-vertices', action='store_true')
+  parser.add_argument('--profile-report')
+  args = parser.parse_args(sys.argv[sys.argv.index('--') + 1:])
+
+  bpy.ops.wm.read_factory_settings(use_empty=True)
+
+  start_time = time.perf_counter()
+  try:
+    with profiling.session(bool(args.profile_report),
+                           os.path.basename(args.input_path),
+                           args.profile_report):
+      status, msg = _import_file(args)
+  except Exception as err:  # pylint: disable=broad-except
+    status, msg = 'CANCELLED', f'{type(err).__name__}: {err}'
+  import_seconds = time.perf_counter() - start_time
+
+  if status == 'FINISHED':
+    os.makedirs(os.path.dirname(os.path.abspath(args.output_path)),
+                exist_ok=True)
+    bpy.ops.wm.save_as_mainfile(filepath=os.path.abspath(args.output_path))
+
+  with open(args.result_path, 'w') as f:
+    json.dump(
+        {
+            'status': 'converted' if status == 'FINISHED' else 'failed',
+            'message': msg,
+            'import_seconds': import_seconds,
+        }, f)
+
+
+def _import_file(args):
+  # pylint: disable=import-error
+  import bpy
+  from . import import_azf
+  from . import import_gsd
+  from . import import_mdl
+
+  ext = os.path.splitext(args.input_path)[1].lower()
+  if ext == '.azf':
+    return import_azf.load(bpy.context,
+                           args.input_path,
+                           import_skybox=not args.no_skybox,
+                           ignore_placeholders=True,
+                           use_vertex_color_materials=True,
+                           use_texture_cache=args.texture_cache,
+                           use_scene_cache=args.scene_cache,
+                           use_asset_catalog=args.asset_catalog,
+                           use_collection_instances=args.collection_instances,
+                           weld_vertices=args.weld_vertices)
+  if ext == '.gsd':
+    return import_gsd.load(bpy.context,
+                           args.input_path,
+                           import_shadow_model=args.shadow_models,
+                           use_vertex_color_materials=True,
+                           use_texture_cache=args.texture_cache,
+                           use_scene_cache=args.scene_cache,
+                           use_asset_catalog=args.asset_catalog,
+                           use_collection_instances=args.collection_instances,
+                           weld_vertices=args.weld_vertices)
+  return import_mdl.load(bpy.context,
+                         args.input_path,
+                         import_shadow_model=args.shadow_models,
+                         use_vertex_color_materials=True,
+                         use_texture_cache=args.texture_cache,
+                         use_scene_cache=args.scene_cache,
+                         use_asset_catalog=args.asset_catalog,
+                         weld_vertices=args.weld_vertices)
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+
+# Writes a cache entry by calling write(f) on a temporary file in the same
+# directory and then moving it into place, so that concurrent imports never
+# read a partially written entry. On errors, the entry is left missing.
+def write_atomic(path, write):
+  fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      write(f)
+    os.replace(tmp_path, path)
+  except OSError:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+
+
+# Removes the least recently used entries of a cache directory until the
+# entries with the given extension fit in max_size bytes. Entries are marked as
+# used by updating their modification time.
+def evict_lru(directory, extension, max_size):
+  entries = []
+  total_size = 0
+  for entry in os.scandir(directory):
+    if not entry.name.endswith(extension):
+      continue
+    try:
+      stat = entry.stat()
+    except OSError:
+      continue
+    entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total_size += stat.st_size
+
+  entries.sort()
+  for _, size, path in entries:
+    if total_size <= max_size:
+      break
+    try:
+      os.remove(path)
+    except OSError:
+      continue
+    total_size -= size
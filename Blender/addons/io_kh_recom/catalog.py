@@ -0,0 +1,310 @@
+# Indexes the models, gimmicks and texture archives of an extracted game in a
+# local SQLite database, so that importers can resolve them without listing
+# directories or reading archive headers.
+#
+# Sample usage (from the Blender/addons directory):
+#
+#   python -m io_kh_recom.catalog C:\path\to\extract
+#   python -m io_kh_recom.catalog --texture wo_sky01
+#
+# Directories are indexed on first use and indexed again when their contents
+# change, so building the catalog up front is optional.
+
+import argparse
+import numpy as np
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+
+from . import readutil
+from . import textures
+
+DEFAULT_CATALOG_PATH = os.path.join(tempfile.gettempdir(), 'io_kh_recom',
+                                    'catalog.sqlite')
+
+# Incremented whenever the schema or the indexed data changes. Catalogs with a
+# different version are rebuilt.
+SCHEMA_VERSION = 1
+
+# Extensions of indexed files.
+MODEL_EXTENSIONS = ('.azf', '.gsd', '.mdl')
+ARCHIVE_EXTENSIONS = ('.rtm', '.vtm')
+
+_GIMMICK_RE = re.compile(r'GM([0-9]{4})\.mdl', re.IGNORECASE)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS directories (
+  path TEXT PRIMARY KEY,
+  mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+  directory TEXT NOT NULL,
+  name TEXT NOT NULL,
+  size INTEGER NOT NULL,
+  mtime_ns INTEGER NOT NULL,
+  rsrc_id INTEGER,
+  PRIMARY KEY (directory, name)
+);
+CREATE INDEX IF NOT EXISTS files_rsrc_id ON files (directory, rsrc_id);
+CREATE TABLE IF NOT EXISTS textures (
+  directory TEXT NOT NULL,
+  archive TEXT NOT NULL,
+  entry_index INTEGER NOT NULL,
+  name TEXT NOT NULL,
+  offset INTEGER NOT NULL,
+  size INTEGER NOT NULL,
+  PRIMARY KEY (directory, archive, entry_index)
+);
+CREATE INDEX IF NOT EXISTS textures_name ON textures (name);
+'''
+
+
+def _normalize_directory(directory):
+  return os.path.normcase(os.path.abspath(directory))
+
+
+# Returns the resource id of a GM####.mdl filename, or None.
+def get_gimmick_id(filename):
+  match = _GIMMICK_RE.fullmatch(filename)
+  return int(match.group(1)) if match else None
+
+
+# SQLite catalog of the files in one or more extracted directory trees. Entries
+# are keyed by absolute directory path. Safe to use from several threads.
+class AssetCatalog:
+  def __init__(self, path=DEFAULT_CATALOG_PATH):
+    self.path = path
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    self._lock = threading.Lock()
+    # Other processes may write to the same catalog during batch conversions.
+    self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+    # {normalized directory -> mtime} checked during this session.
+    self._checked_directories = dict()
+
+    version = self._db.execute('PRAGMA user_version').fetchone()[0]
+    with self._db:
+      if version != SCHEMA_VERSION:
+        for table in ('directories', 'files', 'textures'):
+          self._db.execute(f'DROP TABLE IF EXISTS {table}')
+        self._db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+      self._db.executescript(_SCHEMA)
+
+  def close(self):
+    self._db.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  # Indexes a directory if it is new or its contents have changed since it was
+  # last indexed. Files that were modified in place are indexed again as well.
+  # Returns True if anything was indexed.
+  def refresh_directory(self, directory):
+    key = _normalize_directory(directory)
+    try:
+      mtime_ns = os.stat(directory).st_mtime_ns
+    except OSError:
+      mtime_ns = None
+
+    with self._lock:
+      if self._checked_directories.get(key, -1) == mtime_ns:
+        return False
+      self._checked_directories[key] = mtime_ns
+      with self._db:
+        return self._refresh_directory(directory, key, mtime_ns)
+
+  def _refresh_directory(self, directory, key, mtime_ns):
+    db = self._db
+    if mtime_ns is None:
+      db.execute('DELETE FROM directories WHERE path = ?', (key,))
+      db.execute('DELETE FROM files WHERE directory = ?', (key,))
+      db.execute('DELETE FROM textures WHERE directory = ?', (key,))
+      return True
+
+    # {filename -> (size, mtime)}
+    indexed = {
+        name: (size, file_mtime_ns)
+        for name, size, file_mtime_ns in db.execute(
+            'SELECT name, size, mtime_ns FROM files WHERE directory = ?', (key,))
+    }
+    row = db.execute('SELECT mtime_ns FROM directories WHERE path = ?',
+                     (key,)).fetchone()
+    if row and row[0] == mtime_ns:
+      # No files were added or removed, but archives may have been rewritten.
+      filenames = list(indexed)
+    else:
+      filenames = [
+          filename for filename in os.listdir(directory)
+          if os.path.splitext(filename)[1].lower() in MODEL_EXTENSIONS +
+          ARCHIVE_EXTENSIONS
+      ]
+
+    changed = False
+    for filename in set(indexed) - set(filenames):
+      self._remove_file(key, filename)
+      changed = True
+    for filename in filenames:
+      try:
+        stat = os.stat(os.path.join(directory, filename))
+      except OSError:
+        if filename in indexed:
+          self._remove_file(key, filename)
+          changed = True
+        continue
+      if indexed.get(filename) == (stat.st_size, stat.st_mtime_ns):
+        continue
+      self._remove_file(key, filename)
+      self._add_file(directory, key, filename, stat)
+      changed = True
+
+    db.execute('INSERT OR REPLACE INTO directories VALUES (?, ?)',
+               (key, mtime_ns))
+    return changed
+
+  def _remove_file(self, key, filename):
+    self._db.execute('DELETE FROM files WHERE directory = ? AND name = ?',
+                     (key, filename))
+    self._db.execute('DELETE FROM textures WHERE directory = ? AND archive = ?',
+                     (key, filename))
+
+  def _add_file(self, directory, key, filename, stat):
+    self._db.execute('INSERT INTO files VALUES (?, ?, ?, ?, ?)',
+                     (key, filename, stat.st_size, stat.st_mtime_ns,
+                      get_gimmick_id(filename)))
+    if os.path.splitext(filename)[1].lower() not in ARCHIVE_EXTENSIONS:
+      return
+    try:
+      with textures.open_texture_archive(os.path.join(directory,
+                                                      filename)) as f:
+        rsrc_index = readutil.read_rsrc_index(f)
+    except (OSError, ValueError) as err:
+      print(f'Cannot index {filename}: {err}')
+      return
+    self._db.executemany(
+        'INSERT INTO textures VALUES (?, ?, ?, ?, ?, ?)',
+        ((key, filename, i, name, offs, size)
+         for i, (name, offs, size) in enumerate(rsrc_index)))
+
+  # Indexes every directory under root. Returns the number of directories that
+  # were indexed again.
+  def refresh(self, root):
+    count = 0
+    for directory, _, _ in os.walk(root):
+      count += self.refresh_directory(directory)
+    return count
+
+  # Returns the names of indexed files in a directory.
+  def list_directory(self, directory):
+    self.refresh_directory(directory)
+    with self._lock:
+      return [
+          name for name, in self._db.execute(
+              'SELECT name FROM files WHERE directory = ? ORDER BY name',
+              (_normalize_directory(directory),))
+      ]
+
+  # Returns the path to the GM####.mdl file of a gimmick resource id in a
+  # directory, or None if there is none.
+  def find_gimmick(self, directory, rsrc_id):
+    self.refresh_directory(directory)
+    with self._lock:
+      row = self._db.execute(
+          'SELECT name FROM files WHERE directory = ? AND rsrc_id = ?',
+          (_normalize_directory(directory), rsrc_id)).fetchone()
+    return os.path.join(directory, row[0]) if row else None
+
+  # Returns the RsrcIndex of an archive from the catalog, without reading the
+  # archive, or None if the archive is not indexed.
+  def get_rsrc_index(self, filepath):
+    directory, filename = os.path.split(filepath)
+    key = _normalize_directory(directory)
+    try:
+      stat = os.stat(filepath)
+    except OSError:
+      return None
+    with self._lock:
+      row = self._db.execute(
+          'SELECT size, mtime_ns FROM files WHERE directory = ? AND name = ?',
+          (key, filename)).fetchone()
+      # Archives that were rewritten in place do not change the directory.
+      if row != (stat.st_size, stat.st_mtime_ns):
+        self._checked_directories.pop(key, None)
+    self.refresh_directory(directory)
+    with self._lock:
+      rows = self._db.execute(
+          'SELECT name, offset, size FROM textures '
+          'WHERE directory = ? AND archive = ? ORDER BY entry_index',
+          (key, filename)).fetchall()
+    if not rows:
+      return None
+    names, offsets, sizes = zip(*rows)
+    return readutil.RsrcIndex(
+        np.array([name.encode('ascii') for name in names], dtype='S20'),
+        np.array(offsets, dtype=np.int64), np.array(sizes, dtype=np.int64))
+
+  # Returns every indexed location of a texture as a list of TextureEntry.
+  def find_textures(self, texture_name):
+    names = [texture_name]
+    if texture_name[-4:] != '.tm2':
+      names.append(f'{texture_name}.tm2')
+    with self._lock:
+      rows = self._db.execute(
+          'SELECT directory, archive, offset, size FROM textures '
+          f'WHERE name IN ({", ".join("?" * len(names))}) '
+          'ORDER BY directory, archive', names).fetchall()
+    return [
+        textures.TextureEntry(os.path.join(directory, archive), offs, size)
+        for directory, archive, offs, size in rows
+    ]
+
+
+_default_catalog = None
+_default_catalog_lock = threading.Lock()
+
+
+# Returns the catalog at DEFAULT_CATALOG_PATH, shared by all imports in this
+# process.
+def get_default_catalog():
+  global _default_catalog
+  with _default_catalog_lock:
+    if not _default_catalog:
+      _default_catalog = AssetCatalog()
+    return _default_catalog
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+      description='Index an extracted KH Re:COM directory tree.')
+  parser.add_argument('roots',
+                      nargs='*',
+                      help='Extracted directories to index or refresh.')
+  parser.add_argument('--catalog',
+                      default=DEFAULT_CATALOG_PATH,
+                      help='Path to the catalog database.')
+  parser.add_argument('--texture',
+                      action='append',
+                      default=[],
+                      help='Print the archives that contain a texture.')
+  args = parser.parse_args(argv)
+
+  with AssetCatalog(args.catalog) as catalog:
+    for root in args.roots:
+      count = catalog.refresh(root)
+      print(f'Indexed {count} changed directories under {root}')
+    for texture_name in args.texture:
+      entries = catalog.find_textures(texture_name)
+      if not entries:
+        print(f'Texture not found: {texture_name}')
+      for entry in entries:
+        print(f'{texture_name}: {entry.filepath} '
+              f'(offset {hex(entry.offset)}, size {hex(entry.size)})')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,138 @@
+import collections
+import numpy as np
+import os
+
+from . import mesh_decoder
+from . import readutil
+from . import transforms
+
+
+class AzfImportError(Exception):
+  pass
+
+
+InstanceData = collections.namedtuple(
+    'InstanceData', ['name', 'mesh_index', 'transform', 'is_skybox'])
+
+# Layout of a 0x40 byte instance table entry. Rotations are in tenths of a
+# degree.
+INSTANCE_DTYPE = np.dtype({
+    'names': ['mesh_index', 'rot', 'pos', 'scale'],
+    'formats': ['<u2', ('<i2', 3), ('<f4', 3), ('<f4', 3)],
+    'offsets': [0x0, 0x8, 0x10, 0x20],
+    'itemsize': 0x40
+})
+
+
+# Selects a subset of stage instances to import. Instances are kept if they
+# match every criterion that is set:
+#   skybox_only: Keep only skybox instances.
+#   mesh_indices: Collection of mesh indices to keep, or None for all meshes.
+#   bounds: Tuple of world-space (min, max) corners, or None. An instance is
+#     kept if its origin lies within the box.
+class InstanceFilter:
+  def __init__(self, skybox_only=False, mesh_indices=None, bounds=None):
+    self.skybox_only = skybox_only
+    self.mesh_indices = mesh_indices
+    self.bounds = bounds
+
+  # Returns a boolean mask of the instances to keep.
+  def select(self, mesh_indices, world_transforms, is_skybox):
+    keep = np.ones(len(mesh_indices), dtype=bool)
+    if self.skybox_only:
+      keep &= is_skybox
+    if self.mesh_indices is not None:
+      keep &= np.isin(mesh_indices, list(self.mesh_indices))
+    if self.bounds is not None:
+      bounds_min, bounds_max = np.asarray(self.bounds, dtype=np.float64)
+      origins = world_transforms[:, :3, 3]
+      keep &= np.all((origins >= bounds_min) & (origins <= bounds_max), axis=1)
+    return keep
+
+
+# Parses a list of indices and inclusive ranges such as "0-3, 7".
+def parse_index_list(text):
+  indices = set()
+  for part in text.replace(' ', '').split(','):
+    if not part:
+      continue
+    try:
+      if '-' in part:
+        first, last = part.split('-', 1)
+        indices.update(range(int(first), int(last) + 1))
+      else:
+        indices.add(int(part))
+    except ValueError:
+      raise AzfImportError(f'Invalid mesh index list "{text}"') from None
+  return indices
+
+
+class StageData:
+  def __init__(self, basename):
+    self.basename = basename
+    # {mesh index -> ModelData}, or None for skipped meshes.
+    self.meshes = dict()
+    self.instances = []
+
+
+# Decodes a stage and every mesh referenced by its instances. If instance_filter
+# is given, only the selected instances and the meshes they reference are
+# decoded. Identical vertices are merged if weld_vertices is set.
+def decode_azf(filepath,
+               import_skybox=True,
+               ignore_placeholders=False,
+               instance_filter=None,
+               weld_vertices=False):
+  basename = os.path.splitext(os.path.basename(filepath))[0]
+  stage = StageData(basename)
+
+  with readutil.BinaryFileReader(filepath) as f:
+    readutil.maybe_skip_ps4_header(f)
+
+    instance_table_header_offs = f.read_uint32()
+    if instance_table_header_offs == 0 or instance_table_header_offs >= f.filesize:
+      raise AzfImportError(
+          f'Invalid instance sector offset {hex(instance_table_header_offs)}')
+
+    mesh_count = (instance_table_header_offs - 0x4) // 0x4
+    mesh_offs_table = f.read_nuint32(mesh_count)
+
+    f.seek(instance_table_header_offs)
+    instance_count, skybox_count = f.read_nuint16(2)
+    instance_table_offs = instance_table_header_offs + f.read_uint32()
+
+    f.seek(instance_table_offs)
+    instance_table = f.read_array(INSTANCE_DTYPE, instance_count)
+    world_transforms = transforms.compose_transforms(
+        instance_table['pos'], np.radians(instance_table['rot'] / 10),
+        instance_table['scale'])
+
+    instance_indices = np.arange(instance_count)
+    keep = np.ones(instance_count, dtype=bool)
+    if not import_skybox:
+      keep &= instance_indices >= skybox_count
+    if instance_filter:
+      keep &= instance_filter.select(instance_table['mesh_index'],
+                                     world_transforms,
+                                     instance_indices < skybox_count)
+
+    for i, mesh_index, transform in zip(
+        instance_indices[keep].tolist(),
+        instance_table['mesh_index'][keep].tolist(), world_transforms[keep]):
+      is_skybox = i < skybox_count
+      name = f'{basename}{"-sky" if is_skybox else ""}'
+      name += f'_i{i if is_skybox else i - skybox_count}'
+      name += f'_m{mesh_index}'
+      stage.instances.append(
+          InstanceData(name, mesh_index, transform, is_skybox))
+
+      # Meshes are named after the first instance that references them.
+      if mesh_index not in stage.meshes:
+        decoder = mesh_decoder.MeshDecoder(
+            skip_textureless_meshes=ignore_placeholders,
+            weld_vertices=weld_vertices)
+        stage.meshes[mesh_index] = decoder.decode(f,
+                                                  mesh_offs_table[mesh_index],
+                                                  name)
+
+  return stage
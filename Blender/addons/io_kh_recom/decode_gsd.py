@@ -0,0 +1,131 @@
+import collections
+import numpy as np
+import os
+import re
+
+from . import readutil
+from . import textures
+from . import transforms
+
+
+class GsdImportError(Exception):
+  pass
+
+
+GimmickPlacement = collections.namedtuple(
+    'GimmickPlacement', ['rsrc_id', 'unique_id', 'transform'])
+
+
+class GsdData:
+  def __init__(self, directory):
+    self.directory = directory
+    self.fallback_directory = ''
+    self.placements = []
+
+
+# Decodes the gimmick placements of a GSD file.
+def decode_gsd(filepath):
+  gsd = GsdData(os.path.dirname(filepath))
+
+  gdirname = os.path.basename(os.path.split(gsd.directory)[0])
+  gdirnum_re = re.search('g([0-9]+).DAT', gdirname, re.IGNORECASE)
+  if gdirnum_re:
+    fallback_dir_num = int(gdirnum_re.group(1)) + 1100
+    gsd.fallback_directory = os.path.join(
+        os.path.dirname(os.path.dirname(gsd.directory)), 'g014.DAT',
+        str(fallback_dir_num))
+
+  with readutil.BinaryFileReader(filepath) as f:
+    gsd_files = readutil.read_rsrc_index(f)
+    if len(gsd_files) == 0:
+      raise GsdImportError('Rsrc header is empty')
+    _, file_offs, _ = gsd_files[0]
+
+    f.seek(file_offs)
+    if f.read_string(4) != "@OSD":
+      raise GsdImportError(f'Expected magic "@OSD" at offset {hex(file_offs)}')
+    version = f.read_uint32()
+    if version != 0x4:
+      raise GsdImportError(f'Unexpected OSD version {version}')
+
+    formation_offset_table = f.read_nuint32(0x20)
+    for fm_offs in formation_offset_table:
+      if fm_offs == 0:
+        break
+      f.seek(file_offs + fm_offs)
+      # Read groups for category index 2 only for gimmicks (out of 4 category slots)
+      f.skip(0x80)  # Skip 0x10 uint32 offsets * 2 categories
+      group_offset_table = f.read_nuint32(0x10)
+      for gp_offs in group_offset_table:
+        if gp_offs == 0:
+          break
+        f.seek(file_offs + gp_offs + 0x4)
+        obj_count = f.read_uint32()
+        obj_table_offset = file_offs + f.read_uint32()
+        gsd.placements += _decode_object_group(f, obj_table_offset, obj_count)
+
+  return gsd
+
+
+# Object entries vary in size, so their fields are gathered first and all
+# transforms are computed together.
+def _decode_object_group(f, obj_table_offset, obj_count):
+  positions = []
+  rotations = []
+  ids = []
+  f.seek(obj_table_offset)
+  for _ in range(obj_count):
+    position = f.read_nfloat32(3)
+    positions.append((position[0], position[1] + f.read_float32(), position[2]))
+    rotation_euler = [0.0, f.read_float32(), 0.0]
+    rsrc_type = f.read_uint16()
+    rsrc_id = f.read_uint16()
+    flags = f.read_uint32()
+    f.skip(8)
+    unique_id = f.read_uint32()
+    if (flags & 0x2) > 0:
+      rotation_euler[0] = f.read_float32()
+      rotation_euler[2] = f.read_float32()
+    rotations.append(rotation_euler)
+    ids.append((rsrc_id, unique_id))
+
+  # Transform objects in world space.
+  world_transforms = transforms.compose_transforms(positions,
+                                                   np.radians(rotations))
+  return [
+      GimmickPlacement(rsrc_id, unique_id, transform)
+      for (rsrc_id, unique_id), transform in zip(ids, world_transforms)
+  ]
+
+
+# Returns the path to the model for a gimmick resource id, or None if the model
+# cannot be found. Models are looked up in an AssetCatalog if one is given.
+def find_gimmick_file(gsd, rsrc_id, catalog=None):
+  gm_filename = f'GM{rsrc_id:04d}.mdl'
+  # Fall back to secondary directory (only works when importing straight from extracted path).
+  for directory in (gsd.directory, gsd.fallback_directory):
+    if not directory:
+      continue
+    if catalog:
+      filepath = catalog.find_gimmick(directory, rsrc_id)
+      if filepath:
+        return filepath
+    else:
+      filepath = os.path.join(directory, gm_filename)
+      if os.path.exists(filepath):
+        return filepath
+  print(f'Resource not found: {gm_filename}')
+  return None
+
+
+# Returns texture archives for gimmicks and shared world textures. Directory
+# listings are shared with other imports if a TextureIndex is given.
+def get_texture_files(gsd, texture_index=None):
+  find_archives = (texture_index.find_archives
+                   if texture_index else textures.find_texture_archives)
+  texture_files = []
+  for directory in (gsd.directory, gsd.fallback_directory):
+    if directory and os.path.isdir(directory):
+      # TODO: Limit to seen resources only
+      texture_files += find_archives(directory, prefixes=('gm', 'wo'))
+  return texture_files
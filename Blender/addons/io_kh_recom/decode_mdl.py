@@ -0,0 +1,78 @@
+import collections
+import numpy as np
+import os
+
+from . import mesh_decoder
+from . import readutil
+
+# MDL files hold at most this many models.
+MAX_MODEL_COUNT = 0x100
+
+# A model in the directory of an MDL file. Models without textures are assumed
+# to be shadow models. This could be more accurately determined by checking
+# the render mode in at least one VIF packet.
+MdlEntry = collections.namedtuple('MdlEntry',
+                                  ['index', 'name', 'header', 'is_shadow'])
+
+
+class MdlData:
+  def __init__(self, basename):
+    self.basename = basename
+    self.armature = None
+    self.models = []
+
+
+# Reads the model offset table and the header of each model, without decoding
+# any bones or vertices.
+def read_mdl_directory(f, basename):
+  readutil.maybe_skip_ps4_header(f)
+  f.seek(0)
+  max_count = min(MAX_MODEL_COUNT, (f.filesize - f.tell()) // 4)
+  model_offsets = f.read_array('<u4', max_count)
+  # The table ends at the first zero offset.
+  zero_offsets = np.flatnonzero(model_offsets == 0)
+  if len(zero_offsets):
+    model_offsets = model_offsets[:zero_offsets[0]]
+
+  entries = []
+  for i, model_offs in enumerate(model_offsets.tolist()):
+    header = mesh_decoder.read_model_header(f, model_offs)
+    is_shadow = header.texture_count == 0
+    name = f'{basename}_{i}{"_shadow" if is_shadow else ""}'
+    entries.append(MdlEntry(i, name, header, is_shadow))
+  return entries
+
+
+# Returns the directory of an MDL file as a list of MdlEntry.
+def list_mdl_models(filepath):
+  basename = os.path.splitext(os.path.basename(filepath))[0]
+  with readutil.BinaryFileReader(filepath) as f:
+    return read_mdl_directory(f, basename)
+
+
+# Decodes the models of an MDL file. If model_indices is given, only those
+# models are decoded. Otherwise, all models are decoded, except for shadow
+# models unless import_shadow_model is set. Identical vertices are merged if
+# weld_vertices is set.
+def decode_mdl(filepath,
+               import_shadow_model=False,
+               model_indices=None,
+               weld_vertices=False):
+  basename = os.path.splitext(os.path.basename(filepath))[0]
+  mdl = MdlData(basename)
+  decoder = mesh_decoder.MeshDecoder(weld_vertices=weld_vertices)
+
+  with readutil.BinaryFileReader(filepath) as f:
+    for entry in read_mdl_directory(f, basename):
+      if model_indices is not None:
+        if entry.index not in model_indices:
+          continue
+      elif entry.is_shadow and not import_shadow_model:
+        continue
+
+      model = decoder.decode(f, entry.header.offset, entry.name, entry.header)
+      if model:
+        mdl.models.append(model)
+
+  mdl.armature = decoder.armature
+  return mdl
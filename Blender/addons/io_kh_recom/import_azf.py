@@ -3,129 +3,224 @@
 if "bpy" in locals():
   # pylint: disable=used-before-assignment
   import importlib
+  if "decode_azf" in locals():
+    importlib.reload(decode_azf)
+  if "import_job" in locals():
+    importlib.reload(import_job)
+  if "lod" in locals():
+    importlib.reload(lod)
   if "materials" in locals():
     importlib.reload(materials)
   if "mesh_parser" in locals():
     importlib.reload(mesh_parser)
-  if "readutil" in locals():
-    importlib.reload(readutil)
+  if "profiling" in locals():
+    importlib.reload(profiling)
+  if "scene_cache" in locals():
+    importlib.reload(scene_cache)
 
 import bpy
 import collections
-import os
-import math
 import mathutils
+import os
 
+from . import decode_azf
+from . import import_job
+from . import lod
 from . import materials
 from . import mesh_parser
-from . import readutil
-
-Options = collections.namedtuple(
-    'Options',
-    ['IMPORT_SKYBOX', 'IGNORE_PLACEHOLDERS', 'USE_VERTEX_COLOR_MATERIALS'])
-WORLD_TRANSFORM = mathutils.Matrix.Rotation(math.radians(90.0), 4, 'X')
+from . import profiling
+from . import scene_cache
 
+Options = collections.namedtuple('Options', [
+    'IMPORT_SKYBOX', 'IGNORE_PLACEHOLDERS', 'USE_VERTEX_COLOR_MATERIALS',
+    'USE_TEXTURE_CACHE', 'USE_COLLECTION_INSTANCES', 'INSTANCE_FILTER',
+    'USE_LOD_PROXIES', 'LOD_RATIO', 'LOD_TRIANGLE_BUDGET', 'WELD_VERTICES',
+    'USE_SCENE_CACHE', 'USE_ASSET_CATALOG'
+])
 
-class AzfImportError(Exception):
-  pass
+AzfImportError = decode_azf.AzfImportError
+# Exceptions that cancel an import with a message.
+IMPORT_ERRORS = (AzfImportError, mesh_parser.MeshImportError,
+                 materials.ImageImportError)
 
 
 class AzfParser:
-  def __init__(self, options):
+  def __init__(self, options, mat_manager=None):
     self.options = options
-    self.mat_manager = materials.MaterialManager(options)
+    if mat_manager:
+      self.mat_manager = mat_manager
+    else:
+      self.mat_manager = materials.MaterialManager(options)
+    self.scene_cache = None
+    if options.USE_SCENE_CACHE:
+      self.scene_cache = scene_cache.SceneCache()
+    # {mesh index -> proxy ModelData}
+    self.proxies = dict()
 
   def parse_map(self, filepath):
-    basename = os.path.splitext(os.path.basename(filepath))[0]
-    f = readutil.BinaryFileReader(filepath)
-    readutil.maybe_skip_ps4_header(f)
-
-    instance_table_header_offs = f.read_uint32()
-    if instance_table_header_offs == 0 or instance_table_header_offs >= f.filesize:
-      raise AzfImportError(
-          f'Invalid instance sector offset {hex(instance_table_header_offs)}')
-
-    mesh_count = (instance_table_header_offs - 0x4) // 0x4
-    mesh_offs_table = f.read_nuint32(mesh_count)
-    mesh_lut = [[]] * mesh_count
-
-    f.seek(instance_table_header_offs)
-    instance_count, skybox_count = f.read_nuint16(2)
-    instance_table_offs = instance_table_header_offs + f.read_uint32()
-    for i in range(instance_count):
-      if i < skybox_count and not self.options.IMPORT_SKYBOX:
-        continue
-      f.seek(instance_table_offs + i * 0x40)
-      mesh_index = f.read_uint16()
-      f.skip(6)
-      rot = [math.radians(v / 10) for v in f.read_nint16(3)]
-      f.skip(2)
-      pos = f.read_nfloat32(4)
-      scale = f.read_nfloat32(4)
-
-      rotation_matrix = mathutils.Euler(rot).to_matrix()
-      rotation_matrix.resize_4x4()
-      translation_matrix = mathutils.Matrix()
-      translation_matrix[0][3] = pos[0]
-      translation_matrix[1][3] = pos[1]
-      translation_matrix[2][3] = pos[2]
-      scale_matrix = mathutils.Matrix()
-      scale_matrix[0][0] = scale[0]
-      scale_matrix[1][1] = scale[1]
-      scale_matrix[2][2] = scale[2]
-
-      transform = (
-          WORLD_TRANSFORM @ translation_matrix @ rotation_matrix @ scale_matrix)
-
-      mesh_basename = f'{basename}{"-sky" if i < skybox_count else ""}'
-      mesh_basename += f'_i{i if i < skybox_count else i - skybox_count}'
-      mesh_basename += f'_m{mesh_index}'
-      if mesh_lut[mesh_index]:
-        objects = mesh_lut[mesh_index]
+    stage = self.decode_map(filepath)
+    with profiling.phase('build'):
+      self.build_map(stage)
+
+  # Decodes a stage, or loads it from the scene cache, and computes LOD proxies.
+  # Does not access Blender data.
+  def decode_map(self, filepath):
+    decode = (self.scene_cache.decode_azf
+              if self.scene_cache else decode_azf.decode_azf)
+    with profiling.phase('decode'):
+      stage = decode(filepath, self.options.IMPORT_SKYBOX,
+                     self.options.IGNORE_PLACEHOLDERS,
+                     self.options.INSTANCE_FILTER, self.options.WELD_VERTICES)
+
+    self.proxies = dict()
+    if self.options.USE_LOD_PROXIES:
+      with profiling.phase('lod'):
+        for mesh_index in lod.select_proxy_meshes(
+            stage, self.options.LOD_RATIO, self.options.LOD_TRIANGLE_BUDGET):
+          self.proxies[mesh_index] = lod.decimate_model(
+              stage.meshes[mesh_index], self.options.LOD_RATIO)
+    return stage
+
+  # Creates Blender objects for a decoded stage.
+  def build_map(self, stage):
+    for _ in self.iter_build_map(stage):
+      pass
+
+  # Same as build_map(), but yields a tuple of the form (done, total) after
+  # each instance.
+  def iter_build_map(self, stage):
+    if self.options.USE_COLLECTION_INSTANCES:
+      yield from self._iter_build_instanced_map(stage)
+      return
+
+    # {mesh index -> [Objects]}
+    mesh_lut = dict()
+    for i, instance in enumerate(stage.instances):
+      if instance.mesh_index in mesh_lut:
+        objects = mesh_lut[instance.mesh_index]
         for obj in objects:
           obj_new = obj.copy()
-          obj_new.name = f'{mesh_basename}_' + '_'.join(obj.name.split('_')[3:])
+          obj_new.name = f'{instance.name}_' + '_'.join(obj.name.split('_')[3:])
           bpy.context.scene.collection.objects.link(obj_new)
       else:
-        parser = mesh_parser.MeshParser(
-            self.mat_manager,
-            skip_armature_creation=True,
-            skip_textureless_meshes=self.options.IGNORE_PLACEHOLDERS)
-        objects, _ = mesh_lut[mesh_index], _ = parser.parse(
-            f, mesh_offs_table[mesh_index], mesh_basename)
-
+        objects = []
+        model = stage.meshes[instance.mesh_index]
+        if model:
+          builder = mesh_parser.MeshBuilder(self.mat_manager,
+                                            skip_armature_creation=True)
+          objects, _ = builder.build(model,
+                                     self.proxies.get(instance.mesh_index))
+        mesh_lut[instance.mesh_index] = objects
+
+      transform = mathutils.Matrix(instance.transform.tolist())
       for obj in objects:
         obj.matrix_local = transform
+      yield i + 1, len(stage.instances)
+
+  # Creates one source collection per unique mesh, and an instancing empty per
+  # placement.
+  def _iter_build_instanced_map(self, stage):
+    sources = mesh_parser.new_source_collection(f'{stage.basename}_meshes')
+    # {mesh index -> Collection}
+    mesh_collections = dict()
+    for i, instance in enumerate(stage.instances):
+      if instance.mesh_index not in mesh_collections:
+        collection = None
+        model = stage.meshes[instance.mesh_index]
+        if model and model.submeshes:
+          collection = bpy.data.collections.new(
+              f'{stage.basename}_m{instance.mesh_index}')
+          sources.children.link(collection)
+          builder = mesh_parser.MeshBuilder(self.mat_manager,
+                                            skip_armature_creation=True,
+                                            collection=collection)
+          builder.build(model, self.proxies.get(instance.mesh_index))
+        mesh_collections[instance.mesh_index] = collection
+
+      collection = mesh_collections[instance.mesh_index]
+      if collection:
+        mesh_parser.new_collection_instance(
+            instance.name, collection,
+            mathutils.Matrix(instance.transform.tolist()))
+      yield i + 1, len(stage.instances)
+
+    mesh_parser.exclude_source_collection(sources)
 
   def parse_textures(self, texture_paths):
-    self.mat_manager.load_textures(texture_paths)
-
-
-def load(context,
-         filepath,
-         *,
-         import_skybox=False,
-         ignore_placeholders=False,
-         use_vertex_color_materials=False):
-  options = Options(import_skybox, ignore_placeholders,
-                    use_vertex_color_materials)
-
-  azf_dirname = os.path.dirname(filepath).lower()
-  azf_basename = os.path.splitext(os.path.basename(filepath))[0].lower()
-  texture_files = []
-  for filename in os.listdir(os.path.dirname(filepath)):
-    basename, ext = os.path.splitext(filename)
-    if ext.lower() not in ('.rtm', '.vtm'):
-      continue
-    if basename.lower() == azf_basename or basename[:2].lower() == 'wo':
-      texture_files.append(os.path.join(azf_dirname, filename))
-
+    for _ in self.iter_parse_textures(texture_paths):
+      pass
+
+  # Same as parse_textures(), but yields a tuple of the form (done, total)
+  # after each texture.
+  def iter_parse_textures(self, texture_paths):
+    with profiling.phase('textures'):
+      yield from self.mat_manager.iter_load_textures(texture_paths)
+
+
+class AzfImportJob(import_job.ImportJob):
+  errors = IMPORT_ERRORS
+
+  def __init__(self, filepath, options, mat_manager=None):
+    self.filepath = filepath
+    self.parser = AzfParser(options, mat_manager)
+    self.stage = None
+
+  def decode(self):
+    self.stage = self.parser.decode_map(self.filepath)
+
+  def iter_build(self):
+    with profiling.phase('build'):
+      for done, total in self.parser.iter_build_map(self.stage):
+        yield 'Building stage', done, total
+
+    azf_basename = os.path.splitext(os.path.basename(self.filepath))[0]
+    texture_index = self.parser.mat_manager.texture_index
+    texture_files = texture_index.find_archives(
+        os.path.dirname(self.filepath),
+        basename=azf_basename,
+        prefixes=('wo',))
+    for done, total in self.parser.iter_parse_textures(texture_files):
+      yield 'Loading textures', done, total
+
+
+# Returns an AzfImportJob for the given import options. Raises one of
+# IMPORT_ERRORS if the options are invalid. Imports that share a MaterialManager
+# reuse its materials and textures.
+def make_job(filepath,
+             *,
+             mat_manager=None,
+             import_skybox=False,
+             ignore_placeholders=False,
+             use_vertex_color_materials=False,
+             use_texture_cache=False,
+             use_collection_instances=False,
+             skybox_only=False,
+             mesh_indices='',
+             use_bounds=False,
+             bounds_min=(0.0, 0.0, 0.0),
+             bounds_max=(0.0, 0.0, 0.0),
+             use_lod_proxies=False,
+             lod_ratio=lod.DEFAULT_LOD_RATIO,
+             lod_triangle_budget=lod.DEFAULT_TRIANGLE_BUDGET,
+             weld_vertices=False,
+             use_scene_cache=False,
+             use_asset_catalog=False):
+  instance_filter = decode_azf.InstanceFilter(
+      skybox_only=skybox_only,
+      mesh_indices=(decode_azf.parse_index_list(mesh_indices)
+                    if mesh_indices.strip() else None),
+      bounds=(bounds_min, bounds_max) if use_bounds else None)
+  options = Options(import_skybox or skybox_only, ignore_placeholders,
+                    use_vertex_color_materials, use_texture_cache,
+                    use_collection_instances, instance_filter, use_lod_proxies,
+                    lod_ratio, lod_triangle_budget, weld_vertices,
+                    use_scene_cache, use_asset_catalog)
+  return AzfImportJob(filepath, options, mat_manager)
+
+
+def load(context, filepath, **kwargs):
   try:
-    parser = AzfParser(options)
-    parser.parse_map(filepath)
-    parser.parse_textures(texture_files)
-  except (AzfImportError, mesh_parser.MeshImportError,
-          materials.ImageImportError) as err:
+    job = make_job(filepath, **kwargs)
+  except IMPORT_ERRORS as err:
     return 'CANCELLED', str(err)
-
-  return 'FINISHED', ''
\ No newline at end of file
+  return job.run()
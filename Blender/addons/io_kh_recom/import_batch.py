@@ -0,0 +1,126 @@
+# pylint: disable=import-error
+
+if "bpy" in locals():
+  # pylint: disable=undefined-variable
+  import importlib
+  if "import_azf" in locals():
+    importlib.reload(import_azf)
+  if "import_gsd" in locals():
+    importlib.reload(import_gsd)
+  if "import_job" in locals():
+    importlib.reload(import_job)
+  if "import_mdl" in locals():
+    importlib.reload(import_mdl)
+  if "materials" in locals():
+    importlib.reload(materials)
+
+import bpy  # pylint: disable=unused-import
+import os
+
+from . import import_azf
+from . import import_gsd
+from . import import_job
+from . import import_mdl
+from . import materials
+
+# Exceptions that cancel an import with a message.
+IMPORT_ERRORS = tuple(
+    dict.fromkeys(import_azf.IMPORT_ERRORS + import_gsd.IMPORT_ERRORS +
+                  import_mdl.IMPORT_ERRORS))
+# Stages are imported first so that gimmicks and models find the world
+# textures that are already loaded.
+EXTENSIONS = ('.azf', '.gsd', '.mdl')
+
+
+# Returns the files in a directory that can be imported, in import order.
+def find_import_files(directory):
+  return sort_import_files(
+      os.path.join(directory, filename)
+      for filename in sorted(os.listdir(directory)))
+
+
+# Returns filepaths sorted by import order. Unsupported files are dropped.
+def sort_import_files(filepaths):
+  def get_order(filepath):
+    return EXTENSIONS.index(os.path.splitext(filepath)[1].lower())
+
+  return sorted(
+      (filepath for filepath in filepaths
+       if os.path.splitext(filepath)[1].lower() in EXTENSIONS),
+      key=get_order)
+
+
+# Imports several AZF, GSD and MDL files through one MaterialManager, so that
+# materials, texture archive headers and decoded textures that are shared
+# between files are only created once.
+class BatchImportJob(import_job.ImportJob):
+  errors = IMPORT_ERRORS
+
+  def __init__(self, jobs):
+    self.jobs = jobs
+
+  def decode(self):
+    for job in self.jobs:
+      self.check_cancelled()
+      job.decode()
+
+  def cancel(self):
+    super().cancel()
+    for job in self.jobs:
+      job.cancel()
+
+  def iter_build(self):
+    for i, job in enumerate(self.jobs):
+      prefix = f'{os.path.basename(job.filepath)} ({i + 1}/{len(self.jobs)})'
+      for label, done, total in job.iter_build():
+        yield f'{prefix}: {label}', done, total
+
+
+def make_job(*,
+             filepaths,
+             import_skybox=False,
+             ignore_placeholders=False,
+             import_shadow_model=False,
+             use_vertex_color_materials=False,
+             use_texture_cache=False,
+             use_collection_instances=False,
+             weld_vertices=False,
+             use_scene_cache=False,
+             use_asset_catalog=False):
+  mat_manager = materials.MaterialManager(
+      import_mdl.Options(import_shadow_model, use_vertex_color_materials,
+                         use_texture_cache, use_collection_instances,
+                         weld_vertices, use_scene_cache, use_asset_catalog))
+  shared_options = dict(mat_manager=mat_manager,
+                        use_vertex_color_materials=use_vertex_color_materials,
+                        use_texture_cache=use_texture_cache,
+                        weld_vertices=weld_vertices,
+                        use_scene_cache=use_scene_cache,
+                        use_asset_catalog=use_asset_catalog)
+
+  jobs = []
+  for filepath in sort_import_files(filepaths):
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext == '.azf':
+      jobs.append(
+          import_azf.make_job(filepath,
+                              import_skybox=import_skybox,
+                              ignore_placeholders=ignore_placeholders,
+                              use_collection_instances=use_collection_instances,
+                              **shared_options))
+    elif ext == '.gsd':
+      jobs.append(
+          import_gsd.make_job(filepath,
+                              import_shadow_model=import_shadow_model,
+                              use_collection_instances=use_collection_instances,
+                              **shared_options))
+    else:
+      jobs.append(
+          import_mdl.make_job(filepath,
+                              import_shadow_model=import_shadow_model,
+                              **shared_options))
+  return BatchImportJob(jobs)
+
+
+def load(context, **kwargs):
+  return make_job(**kwargs).run()
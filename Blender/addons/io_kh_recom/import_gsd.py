@@ -3,179 +3,214 @@
 if "bpy" in locals():
   # pylint: disable=used-before-assignment
   import importlib
+  if "decode_gsd" in locals():
+    importlib.reload(decode_gsd)
+  if "import_job" in locals():
+    importlib.reload(import_job)
   if "import_mdl" in locals():
     importlib.reload(import_mdl)
   if "materials" in locals():
     importlib.reload(materials)
-  if "readutil" in locals():
-    importlib.reload(readutil)
+  if "model_cache" in locals():
+    importlib.reload(model_cache)
+  if "profiling" in locals():
+    importlib.reload(profiling)
+  if "scene_cache" in locals():
+    importlib.reload(scene_cache)
 
 import bpy
-import collections
-import math
 import mathutils
 import os
-import re
 
+from . import decode_gsd
+from . import import_job
 from . import import_mdl
 from . import materials
 from . import mesh_parser
-from . import readutil
+from . import model_cache
+from . import profiling
+from . import scene_cache
 
-WORLD_TRANSFORM = mathutils.Matrix.Rotation(math.radians(90.0), 4, 'X')
-
-
-class GsdImportError(Exception):
-  pass
+GsdImportError = decode_gsd.GsdImportError
+# Exceptions that cancel an import with a message.
+IMPORT_ERRORS = (GsdImportError, mesh_parser.MeshImportError,
+                 materials.ImageImportError)
 
 
 class GsdParser:
-  def __init__(self, options):
+  def __init__(self, options, mat_manager=None):
     self.options = options
-    self.mat_manager = materials.MaterialManager(options)
+    if mat_manager:
+      self.mat_manager = mat_manager
+    else:
+      self.mat_manager = materials.MaterialManager(options)
+    self.scene_cache = None
+    if options.USE_SCENE_CACHE:
+      self.scene_cache = scene_cache.SceneCache()
 
     # {Rsrc id -> [Objects]}
     self.rsrc_obj_map = dict()
-    self.directory = ''
-    self.fallback_directory = ''
+    # {Rsrc id -> Collection}
+    self.rsrc_collection_map = dict()
+    # {Rsrc id -> MdlData, or None if the gimmick model was not found}
+    self.gimmick_mdls = dict()
+    self.gsd = None
 
   def parse(self, filepath):
-    f = readutil.BinaryFileReader(filepath)
-    self.directory = os.path.dirname(filepath)
-
-    gdirname = os.path.basename(os.path.split(self.directory)[0])
-    gdirnum_re = re.search('g([0-9]+).DAT', gdirname, re.IGNORECASE)
-    if gdirnum_re:
-      fallback_dir_num = int(gdirnum_re.group(1)) + 1100
-      self.fallback_directory = os.path.join(
-          self.directory, f'..\\..\\g014.DAT\\{fallback_dir_num}')
-
-    gsd_files = readutil.read_rsrc_header(f)
-    if len(gsd_files) == 0:
-      raise GsdImportError('Rsrc header is empty')
-    _, file_offs, _ = gsd_files[0]
-
-    f.seek(file_offs)
-    if f.read_string(4) != "@OSD":
-      raise GsdImportError(f'Expected magic "@OSD" at offset {hex(file_offs)}')
-    version = f.read_uint32()
-    if version != 0x4:
-      raise GsdImportError(f'Unexpected OSD version {version}')
-
-    formation_offset_table = f.read_nuint32(0x20)
-    for fm_offs in formation_offset_table:
-      if fm_offs == 0:
-        break
-      f.seek(file_offs + fm_offs)
-      # Read groups for category index 2 only for gimmicks (out of 4 category slots)
-      f.skip(0x80)  # Skip 0x10 uint32 offsets * 2 categories
-      group_offset_table = f.read_nuint32(0x10)
-      for gp_offs in group_offset_table:
-        if gp_offs == 0:
-          break
-        f.seek(file_offs + gp_offs + 0x4)
-        obj_count = f.read_uint32()
-        obj_table_offset = file_offs + f.read_uint32()
-        self.parse_object_group(f, obj_table_offset, obj_count)
-
-  def parse_object_group(self, f, obj_table_offset, obj_count):
-    f.seek(obj_table_offset)
-    for _ in range(obj_count):
-      position = f.read_nfloat32(3)
-      position = (position[0], position[1] + f.read_float32(), position[2])
-      rotation_euler = [0.0, math.radians(f.read_float32()), 0.0]
-      rsrc_type = f.read_uint16()
-      rsrc_id = f.read_uint16()
-      flags = f.read_uint32()
-      f.skip(8)
-      unique_id = f.read_uint32()
-      if (flags & 0x2) > 0:
-        rotation_euler[0] = math.radians(f.read_float32())
-        rotation_euler[2] = math.radians(f.read_float32())
-
-      # Transform object in world space.
-      rotation_matrix = mathutils.Euler(rotation_euler).to_matrix()
-      rotation_matrix.resize_4x4()
-      translation_matrix = mathutils.Matrix()
-      translation_matrix[0][3] = position[0]
-      translation_matrix[1][3] = position[1]
-      translation_matrix[2][3] = position[2]
-      transform = (WORLD_TRANSFORM @ translation_matrix @ rotation_matrix)
-
-      objects = []
-      if rsrc_id not in self.rsrc_obj_map:
-        print(f'*** {rsrc_id}')
-        armature_obj = self.load_gimmick_objects(rsrc_id)
-        if armature_obj:
-          objects = [armature_obj] + [child for child in armature_obj.children]
-        self.rsrc_obj_map[rsrc_id] = objects
+    self.decode(filepath)
+    with profiling.phase('gimmicks'):
+      self._place_gimmicks(filepath)
+
+  # Decodes a GSD file and the MDL files of its gimmicks. Gimmick models are
+  # looked up in the model cache, but kept by the parser until they are built,
+  # so that evictions from the cache never decode them again on the main thread.
+  # Does not access Blender data. check_cancelled is called before each gimmick
+  # model is decoded, if given.
+  def decode(self, filepath, check_cancelled=None):
+    with profiling.phase('decode'):
+      self.gsd = decode_gsd.decode_gsd(filepath)
+      self.gimmick_mdls = dict()
+      for rsrc_id in dict.fromkeys(p.rsrc_id for p in self.gsd.placements):
+        if check_cancelled:
+          check_cancelled()
+        gimmick_path = decode_gsd.find_gimmick_file(
+            self.gsd, rsrc_id, self.mat_manager.texture_index.catalog)
+        self.gimmick_mdls[rsrc_id] = None
+        if gimmick_path:
+          self.gimmick_mdls[rsrc_id] = model_cache.default_cache.decode_mdl(
+              gimmick_path, self.options.IMPORT_SHADOW_MODEL, None,
+              self.options.WELD_VERTICES, self.scene_cache)
+
+  def _place_gimmicks(self, filepath):
+    for _ in self.iter_place_gimmicks(filepath):
+      pass
+
+  # Same as _place_gimmicks(), but yields a tuple of the form (done, total)
+  # after each placement.
+  def iter_place_gimmicks(self, filepath):
+    placements = self.gsd.placements
+    if self.options.USE_COLLECTION_INSTANCES:
+      basename = os.path.splitext(os.path.basename(filepath))[0]
+      sources = mesh_parser.new_source_collection(f'{basename}_gimmicks')
+      for i, placement in enumerate(placements):
+        self.place_gimmick_instance(placement, sources)
+        yield i + 1, len(placements)
+      mesh_parser.exclude_source_collection(sources)
+    else:
+      for i, placement in enumerate(placements):
+        self.place_gimmick(placement)
+        yield i + 1, len(placements)
+
+  # Instances one source collection per gimmick instead of copying its
+  # armature and meshes for each placement.
+  def place_gimmick_instance(self, placement, sources):
+    if placement.rsrc_id not in self.rsrc_collection_map:
+      collection = bpy.data.collections.new(f'GM{placement.rsrc_id:04d}')
+      sources.children.link(collection)
+      armature_obj = self.load_gimmick_objects(placement.rsrc_id, collection)
+      if armature_obj:
+        # The instancing empty carries the full world transform.
+        armature_obj.matrix_local = mathutils.Matrix.Identity(4)
       else:
-        base_objects = self.rsrc_obj_map[rsrc_id]
-        for i, obj in enumerate(base_objects):
-          obj_new = obj.copy()
-          obj_new.name = obj.name[:obj.name.rfind('_')]
-          bpy.context.scene.collection.objects.link(obj_new)
-          objects.append(obj_new)
-          if i > 0:
-            # Parent mesh to new armature. The armature is always the first object in the list.
-            obj_new.parent = objects[0]
-            obj_new.modifiers['Armature'].object = objects[0]
-
-      for obj in objects:
-        obj.name += f'_{unique_id}'
-        if obj.type == 'ARMATURE':
-          obj.matrix_local = transform
-
-  def load_gimmick_objects(self, rsrc_id):
-    gm_filename = f'GM{rsrc_id:04d}.mdl'
-    filepath = os.path.join(self.directory, gm_filename)
-    if not os.path.exists(filepath):
-      # Fall back to secondary directory (only works when importing straight from extracted path).
-      found = False
-      if self.fallback_directory:
-        filepath = os.path.join(self.fallback_directory, gm_filename)
-        found = os.path.exists(filepath)
-      if not found:
-        # TODO: Warn if some resources are missing.
-        print(f'Resource not found: {filepath}')
-        return []
-
-    mdl_parser = import_mdl.MdlParser(self.options, self.mat_manager)
-    return mdl_parser.parse_model(filepath)
+        sources.children.unlink(collection)
+        bpy.data.collections.remove(collection)
+        collection = None
+      self.rsrc_collection_map[placement.rsrc_id] = collection
+
+    collection = self.rsrc_collection_map[placement.rsrc_id]
+    if collection:
+      mesh_parser.new_collection_instance(
+          f'{collection.name}_{placement.unique_id}', collection,
+          mathutils.Matrix(placement.transform.tolist()))
+
+  def place_gimmick(self, placement):
+    objects = []
+    if placement.rsrc_id not in self.rsrc_obj_map:
+      armature_obj = self.load_gimmick_objects(placement.rsrc_id)
+      if armature_obj:
+        objects = [armature_obj] + [child for child in armature_obj.children]
+      self.rsrc_obj_map[placement.rsrc_id] = objects
+    else:
+      base_objects = self.rsrc_obj_map[placement.rsrc_id]
+      for i, obj in enumerate(base_objects):
+        obj_new = obj.copy()
+        obj_new.name = obj.name[:obj.name.rfind('_')]
+        bpy.context.scene.collection.objects.link(obj_new)
+        objects.append(obj_new)
+        if i > 0:
+          # Parent mesh to new armature. The armature is always the first object in the list.
+          obj_new.parent = objects[0]
+          obj_new.modifiers['Armature'].object = objects[0]
+
+    transform = mathutils.Matrix(placement.transform.tolist())
+    for obj in objects:
+      obj.name += f'_{placement.unique_id}'
+      if obj.type == 'ARMATURE':
+        obj.matrix_local = transform
+
+  def load_gimmick_objects(self, rsrc_id, collection=None):
+    mdl = self.gimmick_mdls.get(rsrc_id)
+    if not mdl:
+      # TODO: Warn if some resources are missing.
+      return []
+
+    mdl_parser = import_mdl.MdlParser(self.options, self.mat_manager,
+                                      collection)
+    with profiling.phase('build'):
+      return mdl_parser.build_model(mdl)
 
   def parse_textures(self):
-    if not self.directory:
+    for _ in self.iter_parse_textures():
+      pass
+
+  # Same as parse_textures(), but yields a tuple of the form (done, total)
+  # after each texture.
+  def iter_parse_textures(self):
+    if not self.gsd or not self.gsd.directory:
       return
-    texture_files = self.get_texture_files(self.directory)
-    if self.fallback_directory:
-      texture_files += self.get_texture_files(self.fallback_directory)
-    self.mat_manager.load_textures(texture_files)
-
-  def get_texture_files(self, directory):
-    texture_files = []
-    for filename in os.listdir(directory):
-      basename, ext = os.path.splitext(filename)
-      if ext.lower() not in ('.rtm', '.vtm'):
-        continue
-      # TODO: Limit to seen resources only
-      if basename.lower()[:2] in ('gm', 'wo'):
-        texture_files.append(os.path.join(directory, filename))
-    return texture_files
-
-
-def load(context,
-         filepath,
-         *,
-         import_shadow_model=False,
-         use_vertex_color_materials=False):
-  options = import_mdl.Options(import_shadow_model, use_vertex_color_materials)
-
-  try:
-    parser = GsdParser(options)
-    parser.parse(filepath)
-    parser.parse_textures()
-  except (GsdImportError, mesh_parser.MeshImportError,
-          materials.ImageImportError) as err:
-    return 'CANCELLED', str(err)
-
-  return 'FINISHED', ''
\ No newline at end of file
+    with profiling.phase('textures'):
+      yield from self.mat_manager.iter_load_textures(
+          decode_gsd.get_texture_files(self.gsd,
+                                       self.mat_manager.texture_index))
+
+
+class GsdImportJob(import_job.ImportJob):
+  errors = IMPORT_ERRORS
+
+  def __init__(self, filepath, options, mat_manager=None):
+    self.filepath = filepath
+    self.parser = GsdParser(options, mat_manager)
+
+  def decode(self):
+    self.parser.decode(self.filepath, self.check_cancelled)
+
+  def iter_build(self):
+    with profiling.phase('gimmicks'):
+      for done, total in self.parser.iter_place_gimmicks(self.filepath):
+        yield 'Placing gimmicks', done, total
+
+    for done, total in self.parser.iter_parse_textures():
+      yield 'Loading textures', done, total
+
+
+# Returns a GsdImportJob for the given import options. Imports that share a
+# MaterialManager reuse its materials and textures.
+def make_job(filepath,
+             *,
+             mat_manager=None,
+             import_shadow_model=False,
+             use_vertex_color_materials=False,
+             use_texture_cache=False,
+             use_collection_instances=False,
+             weld_vertices=False,
+             use_scene_cache=False,
+             use_asset_catalog=False):
+  options = import_mdl.Options(import_shadow_model, use_vertex_color_materials,
+                               use_texture_cache, use_collection_instances,
+                               weld_vertices, use_scene_cache,
+                               use_asset_catalog)
+  return GsdImportJob(filepath, options, mat_manager)
+
+
+def load(context, filepath, **kwargs):
+  return make_job(filepath, **kwargs).run()
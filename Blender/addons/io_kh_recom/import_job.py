@@ -0,0 +1,42 @@
+# Raised by ImportJob.check_cancelled() once an import was cancelled.
+class ImportCancelled(Exception):
+  pass
+
+
+# An import split into a decoding step, which does not touch Blender data and
+# may run on a worker thread, and a build step that creates Blender data on the
+# main thread in small increments.
+class ImportJob:
+  # Exceptions that cancel the import with a message instead of propagating.
+  errors = ()
+  # Set by cancel(), possibly from another thread.
+  cancelled = False
+
+  # Reads and decodes all files. Must not access Blender data.
+  def decode(self):
+    raise NotImplementedError
+
+  # Creates Blender data from the decoded files. Yields tuples of the form
+  # (description, done, total) after each step.
+  def iter_build(self):
+    raise NotImplementedError
+
+  # Asks a running decode() to stop before it reads the next file.
+  def cancel(self):
+    self.cancelled = True
+
+  # Raises ImportCancelled if cancel() was called. Called by decode() between
+  # files.
+  def check_cancelled(self):
+    if self.cancelled:
+      raise ImportCancelled('Import cancelled')
+
+  # Runs the whole import. Returns a tuple of the form (status, message).
+  def run(self):
+    try:
+      self.decode()
+      for _ in self.iter_build():
+        pass
+    except self.errors as err:
+      return 'CANCELLED', str(err)
+    return 'FINISHED', ''
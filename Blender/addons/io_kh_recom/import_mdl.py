@@ -3,109 +3,147 @@
 if "bpy" in locals():
   # pylint: disable=used-before-assignment
   import importlib
+  if "decode_mdl" in locals():
+    importlib.reload(decode_mdl)
+  if "import_job" in locals():
+    importlib.reload(import_job)
   if "materials" in locals():
     importlib.reload(materials)
   if "mesh_parser" in locals():
     importlib.reload(mesh_parser)
-  if "readutil" in locals():
-    importlib.reload(readutil)
+  if "model_cache" in locals():
+    importlib.reload(model_cache)
+  if "profiling" in locals():
+    importlib.reload(profiling)
+  if "scene_cache" in locals():
+    importlib.reload(scene_cache)
 
 import bpy
 import collections
 import os
-import math
-import mathutils
 
+from . import decode_mdl
+from . import import_job
 from . import materials
 from . import mesh_parser
-from . import readutil
+from . import model_cache
+from . import profiling
+from . import scene_cache
 
-Options = collections.namedtuple(
-    'Options', ['IMPORT_SHADOW_MODEL', 'USE_VERTEX_COLOR_MATERIALS'])
-WORLD_TRANSFORM = mathutils.Matrix.Rotation(math.radians(90.0), 4, 'X')
-
-
-class ModelParser:
-  def __init__(self, mat_manager, options):
-    self.mat_manager = mat_manager
-    self.options = options
-    self.armature = None
-
-  def parse(self, f, model_offs, model_basename):
-    f.seek(model_offs + 0xC)
-    # Assume that models with no textures are shadow models. This could be more
-    # accurately determined by checking the render mode in at least one VIF
-    # packet.
-    texture_count = f.read_uint32()
-    if texture_count == 0:
-      if not self.options.IMPORT_SHADOW_MODEL:
-        return []
-      model_basename += '_shadow'
-
-    parser = mesh_parser.MeshParser(
-        self.mat_manager,
-        armature=self.armature,
-        skip_textureless_meshes=(not self.options.IMPORT_SHADOW_MODEL))
-    objects, self.armature = parser.parse(f, model_offs, model_basename)
-
-    for obj in objects:
-      obj.parent = self.armature.armature_obj
-      modifier = obj.modifiers.new(type='ARMATURE', name='Armature')
-      modifier.object = self.armature.armature_obj
-      obj.select_set(state=True)
+Options = collections.namedtuple('Options', [
+    'IMPORT_SHADOW_MODEL', 'USE_VERTEX_COLOR_MATERIALS', 'USE_TEXTURE_CACHE',
+    'USE_COLLECTION_INSTANCES', 'WELD_VERTICES', 'USE_SCENE_CACHE',
+    'USE_ASSET_CATALOG'
+])
+# Exceptions that cancel an import with a message.
+IMPORT_ERRORS = (mesh_parser.MeshImportError, materials.ImageImportError)
 
 
 class MdlParser:
-  def __init__(self, options, mat_manager=None):
+  def __init__(self, options, mat_manager=None, collection=None):
     self.options = options
+    self.collection = collection
     if mat_manager:
       self.mat_manager = mat_manager
     else:
       self.mat_manager = materials.MaterialManager(options)
-
-  def parse_model(self, filepath):
-    basename = os.path.splitext(os.path.basename(filepath))[0]
-    f = readutil.BinaryFileReader(filepath)
-    readutil.maybe_skip_ps4_header(f)
-
-    model_parser = ModelParser(self.mat_manager, self.options)
-    for i in range(0x100):
-      f.seek(i * 4)
-      model_offs = f.read_uint32()
-      if not model_offs:
-        break
-      model_basename = '{}_{}'.format(basename, i)
-      model_parser.parse(f, model_offs, model_basename)
-
-    if model_parser.armature:
-      return model_parser.armature.armature_obj
+    self.scene_cache = None
+    if options.USE_SCENE_CACHE:
+      self.scene_cache = scene_cache.SceneCache()
+
+  # Decoded files are shared through the process-wide model cache, so importing
+  # the same file again only rebuilds Blender objects. With USE_SCENE_CACHE,
+  # files are also kept in the scene cache on disk. If model_indices is
+  # given, only those models are decoded (see decode_mdl.list_mdl_models()).
+  def parse_model(self, filepath, model_indices=None):
+    mdl = self.decode_model(filepath, model_indices)
+    with profiling.phase('build'):
+      return self.build_model(mdl)
+
+  # Decodes an MDL file. Does not access Blender data.
+  def decode_model(self, filepath, model_indices=None):
+    with profiling.phase('decode'):
+      return model_cache.default_cache.decode_mdl(
+          filepath, self.options.IMPORT_SHADOW_MODEL, model_indices,
+          self.options.WELD_VERTICES, self.scene_cache)
+
+  # Creates Blender objects for a decoded MDL file. Returns the armature object.
+  def build_model(self, mdl):
+    armature_obj = None
+    for armature_obj, _, _ in self.iter_build_model(mdl):
+      pass
+    return armature_obj
+
+  # Same as build_model(), but yields a tuple of the form
+  # (armature object, done, total) after each model.
+  def iter_build_model(self, mdl):
+    builder = mesh_parser.MeshBuilder(self.mat_manager,
+                                      collection=self.collection)
+    armature_obj = None
+    for i, model in enumerate(mdl.models):
+      objects, armature = builder.build(model)
+      armature_obj = armature.armature_obj
+
+      for obj in objects:
+        obj.parent = armature_obj
+        modifier = obj.modifiers.new(type='ARMATURE', name='Armature')
+        modifier.object = armature_obj
+        obj.select_set(state=True)
+      yield armature_obj, i + 1, len(mdl.models)
 
   def parse_textures(self, texture_paths):
-    self.mat_manager.load_textures(texture_paths)
-
-
-def load(context,
-         filepath,
-         *,
-         import_shadow_model=False,
-         use_vertex_color_materials=False):
-  options = Options(import_shadow_model, use_vertex_color_materials)
-
-  mdl_dirname = os.path.dirname(filepath).lower()
-  mdl_basename = os.path.splitext(os.path.basename(filepath))[0].lower()
-  texture_files = []
-  for filename in os.listdir(os.path.dirname(filepath)):
-    basename, ext = os.path.splitext(filename)
-    if ext.lower() not in ('.rtm', '.vtm'):
-      continue
-    if basename.lower() == mdl_basename or basename[:2].lower() == 'wo':
-      texture_files.append(os.path.join(mdl_dirname, filename))
-
-  try:
-    parser = MdlParser(options)
-    parser.parse_model(filepath)
-    parser.parse_textures(texture_files)
-  except (mesh_parser.MeshImportError, materials.ImageImportError) as err:
-    return 'CANCELLED', str(err)
-
-  return 'FINISHED', ''
\ No newline at end of file
+    for _ in self.iter_parse_textures(texture_paths):
+      pass
+
+  # Same as parse_textures(), but yields a tuple of the form (done, total)
+  # after each texture.
+  def iter_parse_textures(self, texture_paths):
+    with profiling.phase('textures'):
+      yield from self.mat_manager.iter_load_textures(texture_paths)
+
+
+class MdlImportJob(import_job.ImportJob):
+  errors = IMPORT_ERRORS
+
+  def __init__(self, filepath, options, mat_manager=None):
+    self.filepath = filepath
+    self.parser = MdlParser(options, mat_manager)
+    self.mdl = None
+
+  def decode(self):
+    self.mdl = self.parser.decode_model(self.filepath)
+
+  def iter_build(self):
+    with profiling.phase('build'):
+      for _, done, total in self.parser.iter_build_model(self.mdl):
+        yield 'Building models', done, total
+
+    mdl_basename = os.path.splitext(os.path.basename(self.filepath))[0]
+    texture_index = self.parser.mat_manager.texture_index
+    texture_files = texture_index.find_archives(
+        os.path.dirname(self.filepath),
+        basename=mdl_basename,
+        prefixes=('wo',))
+    for done, total in self.parser.iter_parse_textures(texture_files):
+      yield 'Loading textures', done, total
+
+
+# Returns an MdlImportJob for the given import options. Imports that share a
+# MaterialManager reuse its materials and textures.
+def make_job(filepath,
+             *,
+             mat_manager=None,
+             import_shadow_model=False,
+             use_vertex_color_materials=False,
+             use_texture_cache=False,
+             weld_vertices=False,
+             use_scene_cache=False,
+             use_asset_catalog=False):
+  options = Options(import_shadow_model, use_vertex_color_materials,
+                    use_texture_cache, False, weld_vertices, use_scene_cache,
+                    use_asset_catalog)
+  return MdlImportJob(filepath, options, mat_manager)
+
+
+def load(context, filepath, **kwargs):
+  return make_job(filepath, **kwargs).run()
@@ -0,0 +1,120 @@
+import numpy as np
+
+from . import mesh_decoder
+
+DEFAULT_LOD_RATIO = 0.25
+DEFAULT_TRIANGLE_BUDGET = 1000000
+
+
+# Returns a decimated copy of a submesh by clustering vertices on a uniform
+# grid. The grid is sized so that roughly ratio * vertex count cells are
+# occupied. Positions are averaged per cell; other attributes and bone
+# influences are taken from the first vertex of each cell.
+def decimate_submesh(submesh, ratio=DEFAULT_LOD_RATIO):
+  proxy = mesh_decoder.SubmeshData(f'{submesh.name}_proxy',
+                                   submesh.texture_index,
+                                   submesh.is_translucent,
+                                   submesh.invert_normals)
+  proxy.has_uv = submesh.has_uv
+  proxy.has_vcol = submesh.has_vcol
+
+  vtx = submesh.vtx
+  target_count = max(3, int(len(vtx) * ratio))
+  if len(vtx) <= target_count or not len(submesh.tri):
+    proxy.vtx, proxy.vn, proxy.uv, proxy.vcol = (submesh.vtx, submesh.vn,
+                                                 submesh.uv, submesh.vcol)
+    proxy.tri, proxy.influences = submesh.tri, submesh.influences
+    proxy.vertex_count = len(vtx)
+    return proxy
+
+  bounds_min = vtx.min(axis=0)
+  extent = np.maximum(vtx.max(axis=0) - bounds_min, 1e-6)
+  # Flat meshes are clustered in 2D, so the cell size is based on the area or
+  # volume spanned by the axes with a significant extent.
+  is_spanned = extent > extent.max() * 1e-3
+  cell_size = (np.prod(extent[is_spanned]) / target_count)**(
+      1 / np.count_nonzero(is_spanned))
+  cells = np.floor((vtx - bounds_min) / cell_size).astype(np.int64)
+
+  _, first_vertex, cluster = np.unique(cells,
+                                       axis=0,
+                                       return_index=True,
+                                       return_inverse=True)
+  cluster = cluster.ravel()
+  cluster_count = len(first_vertex)
+
+  cluster_sizes = np.bincount(cluster, minlength=cluster_count)
+  sums = [
+      np.bincount(cluster, weights=vtx[:, axis], minlength=cluster_count)
+      for axis in range(3)
+  ]
+  proxy.vtx = np.stack(sums, axis=-1) / cluster_sizes[:, None]
+  if submesh.vn is not None:
+    proxy.vn = submesh.vn[first_vertex]
+  if submesh.uv is not None:
+    proxy.uv = submesh.uv[first_vertex]
+  if submesh.vcol is not None:
+    proxy.vcol = submesh.vcol[first_vertex]
+
+  # Drop triangles that collapsed into a cell, and duplicates of the same
+  # triangle with the same winding.
+  tri = cluster[submesh.tri]
+  tri = tri[(tri[:, 0] != tri[:, 1]) & (tri[:, 1] != tri[:, 2]) &
+            (tri[:, 0] != tri[:, 2])]
+  rows = np.arange(len(tri))[:, None]
+  rotation = np.argmin(tri, axis=1)[:, None]
+  canonical = tri[rows, (rotation + np.arange(3)) % 3]
+  _, unique_tris = np.unique(canonical, axis=0, return_index=True)
+  proxy.tri = tri[np.sort(unique_tris)].astype(np.int32)
+
+  # Keep the influences of each representative vertex.
+  influences = submesh.influences
+  is_first = np.zeros(len(vtx), dtype=bool)
+  is_first[first_vertex] = True
+  influences = influences[is_first[influences['vertex_index']]].copy()
+  influences['vertex_index'] = cluster[influences['vertex_index']]
+  proxy.influences = influences
+
+  proxy.vertex_count = cluster_count
+  return proxy
+
+
+# Returns a decimated copy of a model. Submeshes are kept in the same order.
+def decimate_model(model, ratio=DEFAULT_LOD_RATIO):
+  proxy = mesh_decoder.ModelData(model.basename, model.armature,
+                                 model.texture_names)
+  proxy.submeshes = [
+      decimate_submesh(submesh, ratio) for submesh in model.submeshes
+  ]
+  return proxy
+
+
+def get_triangle_count(model):
+  return sum(len(submesh.tri) for submesh in model.submeshes)
+
+
+# Ranks the meshes of a stage by their total triangle count over all of their
+# instances, and returns the indices of the most expensive meshes that must be
+# replaced by proxies for the stage to fit in triangle_budget.
+def select_proxy_meshes(stage,
+                        ratio=DEFAULT_LOD_RATIO,
+                        triangle_budget=DEFAULT_TRIANGLE_BUDGET):
+  instance_counts = dict()
+  for instance in stage.instances:
+    instance_counts[instance.mesh_index] = instance_counts.get(
+        instance.mesh_index, 0) + 1
+
+  costs = {
+      mesh_index: get_triangle_count(model) * instance_counts.get(mesh_index, 0)
+      for mesh_index, model in stage.meshes.items()
+      if model
+  }
+  total = sum(costs.values())
+
+  selected = []
+  for mesh_index in sorted(costs, key=lambda i: costs[i], reverse=True):
+    if total <= triangle_budget or not costs[mesh_index]:
+      break
+    selected.append(mesh_index)
+    total -= costs[mesh_index] * (1 - ratio)
+  return selected
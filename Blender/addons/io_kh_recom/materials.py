@@ -3,16 +3,29 @@
 if "bpy" in locals():
   # pylint: disable=used-before-assignment
   import importlib
-  if "readutil" in locals():
-    importlib.reload(readutil)
+  if "catalog" in locals():
+    importlib.reload(catalog)
+  if "profiling" in locals():
+    importlib.reload(profiling)
+  if "texture_cache" in locals():
+    importlib.reload(texture_cache)
+  if "textures" in locals():
+    importlib.reload(textures)
 
 import bpy
 
-from . import readutil
+from . import catalog
+from . import profiling
+from . import texture_cache
+from . import textures
 
 
-class ImageImportError(Exception):
-  pass
+ImageImportError = textures.ImageImportError
+
+VERTEX_COLOR_NODE_GROUP = 'KH ReCOM Vertex Color'
+# Custom property that identifies node groups created by this add-on, since
+# their names may be taken by other node groups or changed by the user.
+NODE_GROUP_TAG = 'khrecom_node_group'
 
 
 class MaterialManager:
@@ -22,11 +35,18 @@ class MaterialManager:
     # {texture name -> (processed)}
     self._processed_map = dict()
     self._options = options
+    self.texture_index = textures.TextureIndex(
+        catalog.get_default_catalog() if options.USE_ASSET_CATALOG else None)
+    self._texture_cache = None
+    if options.USE_TEXTURE_CACHE:
+      self._texture_cache = texture_cache.TextureCache()
+    self._vertex_color_group = None
 
   def get_material(self, texture_name, use_vertex_color=False):
     if texture_name in self._material_map:
       return self._material_map[texture_name][0]
 
+    profiling.count('materials')
     material = bpy.data.materials.new(name=texture_name)
     material.use_nodes = True
 
@@ -36,124 +56,167 @@ class MaterialManager:
     self._material_map[texture_name] = material, use_vertex_color
     return material
 
+  # Indexes the given archives, then decodes only the textures that have been
+  # requested through get_material().
   def load_textures(self, filepaths):
-    for filepath in filepaths:
-      self._load_texture_archive(filepath)
-
-  def _load_texture_archive(self, filepath):
-    f = readutil.BinaryFileReader(filepath)
-    readutil.maybe_skip_ps4_header(f)
-
-    texture_files = readutil.read_rsrc_header(f)
-    for texture_name, byte_offs, byte_size in texture_files:
-      if texture_name[-4:] == '.tm2':
-        texture_name = texture_name[:-4]
-      self._load_single_texture(f, texture_name, byte_offs, byte_size)
-
-  def _load_single_texture(self, f, texture_name, offs, size):
-    if texture_name not in self._material_map:
-      print(f'Texture is unused: {texture_name}')
-      return
+    for _ in self.iter_load_textures(filepaths):
+      pass
+
+  # Same as load_textures(), but yields a tuple of the form (done, total) after
+  # each texture.
+  def iter_load_textures(self, filepaths):
+    with profiling.phase('index'):
+      self.texture_index.add_archives(filepaths)
+
+    texture_names = [
+        texture_name for texture_name in self._material_map
+        if texture_name not in self._processed_map
+    ]
+    done = 0
+    # (filepath, offset, size, texture name, cache key)
+    jobs = []
+    for texture_name in texture_names:
+      entry = self.texture_index.get(texture_name)
+      if not entry:
+        print(f'Texture not found: {texture_name}')
+        done += 1
+        continue
+
+      if self._texture_cache:
+        with profiling.phase('cache'):
+          cache_key = self._texture_cache.make_key(entry.filepath,
+                                                   texture_name, entry.offset)
+          decoded = self._texture_cache.get(cache_key)
+        if decoded:
+          profiling.count('textures_cached')
+          self._load_single_texture(texture_name, *decoded)
+          done += 1
+          yield done, len(texture_names)
+          continue
+      else:
+        cache_key = None
+      jobs.append((entry.filepath, entry.offset, entry.size, texture_name,
+                   cache_key))
+
+    # Decoding may run in worker processes, but Blender data can only be
+    # created on the main thread.
+    decoded_textures = textures.decode_textures(
+        [job[:4] for job in jobs],
+        executable=getattr(bpy.app, 'binary_path_python', None))
+    try:
+      for job in jobs:
+        with profiling.phase('decode'):
+          texture_name, decoded = next(decoded_textures)
+        done += 1
+        if not decoded:
+          print(f'Not a TIM2 file: {texture_name}')
+          continue
+        profiling.count('textures_decoded')
+        if self._texture_cache:
+          with profiling.phase('cache'):
+            self._texture_cache.put(job[4], *decoded)
+        self._load_single_texture(texture_name, *decoded)
+        yield done, len(texture_names)
+    finally:
+      # Stops worker processes right away if this generator is closed early.
+      decoded_textures.close()
+
+    if self._texture_cache:
+      with profiling.phase('cache'):
+        self._texture_cache.evict()
+
+  def _load_single_texture(self, texture_name, width, height, pixels):
     if texture_name in self._processed_map:
       return
 
-    f.seek(offs)
-    if f.read_uint32() != 0x324D4954:  # "TIM2"
-      print(f'Not a TIM2 file: {texture_name}')
-      return
-    f.skip(2)
-    image_count = f.read_uint16()
-
-    # Parse first image header
-    f.seek(offs + 0x18)
-    image_data_size = f.read_uint32()
-    _, color_count = f.read_nuint16(2)
-    _, mipmap_count, _, image_format = f.read_nuint8(4)
-    width, height = f.read_nuint16(2)
-
-    image_data_offs = offs + 0x10 + image_count * 0x30
-    image_data_offs += (mipmap_count - 1) * 0x10
-    f.seek(image_data_offs)
-    image = f.read_nuint8(image_data_size)
-    clut = [[((col >> (i * 8)) & 0xFF) / f
-             for i, f in zip(range(4), (0xFF, 0xFF, 0xFF, 0x80))]
-            for col in f.read_nuint32(color_count)]
-
-    pixels = [0] * width * height * 4
-    if image_format == 0x5:  # 8-bit indexed
-      for i in range(width * height):
-        p = image[i]
-        # Flip bits 4 and 5
-        p = ((p >> 1) & 0x8) | ((p << 1) & 0x10) | (p & 0xE7)
-        # Pre-flip the image for it to export correctly.
-        dstoffs = ((height - (i // width) - 1) * width + (i % width)) * 4
-        pixels[dstoffs:dstoffs + 4] = clut[p]
-    elif image_format == 0x4:  # 4-bit indexed
-      for i in range(width * height):
-        p = (image[i // 2] >> (4 if i % 2 == 1 else 0)) & 0xF
-        dstoffs = ((height - (i // width) - 1) * width + (i % width)) * 4
-        pixels[dstoffs:dstoffs + 4] = clut[p]
-    else:
-      raise ImageImportError(
-          f'Unhandled image pixel format {image_format} for texture {texture_name}'
-      )
+    with profiling.phase('images'):
+      image = bpy.data.images.new(f'{texture_name}.png',
+                                  width=width,
+                                  height=height)
+      image.pixels.foreach_set(pixels)
+      image.update()
+      profiling.count('texture_pixels', width * height)
 
-    image = bpy.data.images.new(f'{texture_name}.png',
-                                width=width,
-                                height=height)
-    image.pixels = pixels
-    image.update()
+    self._processed_map[texture_name] = True
 
     material, use_vertex_color = self._material_map[texture_name]
+    with profiling.phase('nodes'):
+      self._link_texture(material, image, use_vertex_color)
 
+  def _link_texture(self, material, image, use_vertex_color):
     tex_node = material.node_tree.nodes.new('ShaderNodeTexImage')
     tex_node.image = image
 
-    self._processed_map[texture_name] = True
-
+    bsdf = material.node_tree.nodes['Principled BSDF']
+    bsdf.inputs['Specular'].default_value = 0
     if use_vertex_color and self._options.USE_VERTEX_COLOR_MATERIALS:
-      vcol_node = material.node_tree.nodes.new('ShaderNodeVertexColor')
-
-      # Vertex colors in KH:ReCOM can exceed 1.0. Blender will clamp any vertex
-      # color components over 1.0 (stored internally as 8-bit sRGB). To avoid
-      # losing color information, the importer halves each vertex color. Here
-      # we restore the vertex color back to its original intensity, with the
-      # caveat that Blender may not render certain vertex colors as bright as
-      # they appear in-game.
-      add_node = material.node_tree.nodes.new('ShaderNodeMixRGB')
-      add_node.blend_type = 'ADD'
-      add_node.inputs['Fac'].default_value = 1.0
-      material.node_tree.links.new(add_node.inputs['Color1'],
-                                   vcol_node.outputs['Color'])
-      material.node_tree.links.new(add_node.inputs['Color2'],
-                                   vcol_node.outputs['Color'])
-
-      mult_node = material.node_tree.nodes.new('ShaderNodeMixRGB')
-      mult_node.blend_type = 'MULTIPLY'
-      mult_node.inputs['Fac'].default_value = 1.0
-      material.node_tree.links.new(mult_node.inputs['Color1'],
+      group_node = material.node_tree.nodes.new('ShaderNodeGroup')
+      if not self._vertex_color_group:
+        self._vertex_color_group = get_vertex_color_node_group()
+      group_node.node_tree = self._vertex_color_group
+      material.node_tree.links.new(group_node.inputs['Color'],
                                    tex_node.outputs['Color'])
-      material.node_tree.links.new(mult_node.inputs['Color2'],
-                                   add_node.outputs['Color'])
-
-      alpha_mult_node = material.node_tree.nodes.new('ShaderNodeMath')
-      alpha_mult_node.operation = 'MULTIPLY'
-      material.node_tree.links.new(alpha_mult_node.inputs[0],
+      material.node_tree.links.new(group_node.inputs['Alpha'],
                                    tex_node.outputs['Alpha'])
-      material.node_tree.links.new(alpha_mult_node.inputs[1],
-                                   vcol_node.outputs['Alpha'])
-
-      bsdf = material.node_tree.nodes['Principled BSDF']
-      bsdf.inputs['Specular'].default_value = 0
       material.node_tree.links.new(bsdf.inputs['Base Color'],
-                                   mult_node.outputs['Color'])
+                                   group_node.outputs['Color'])
       material.node_tree.links.new(bsdf.inputs['Alpha'],
-                                   alpha_mult_node.outputs['Value'])
+                                   group_node.outputs['Alpha'])
 
     else:
-      bsdf = material.node_tree.nodes['Principled BSDF']
-      bsdf.inputs['Specular'].default_value = 0
       material.node_tree.links.new(bsdf.inputs['Base Color'],
                                    tex_node.outputs['Color'])
       material.node_tree.links.new(bsdf.inputs['Alpha'],
                                    tex_node.outputs['Alpha'])
+
+
+# Returns the shader node group that multiplies a texture color by twice the
+# vertex color, and the texture alpha by the vertex alpha. The group is created
+# once per .blend file, found again by its NODE_GROUP_TAG, and shared by all
+# materials that use vertex colors.
+def get_vertex_color_node_group():
+  for group in bpy.data.node_groups:
+    if (group.bl_idname == 'ShaderNodeTree' and
+        group.get(NODE_GROUP_TAG) == 'VERTEX_COLOR'):
+      return group
+
+  profiling.count('node_groups')
+  group = bpy.data.node_groups.new(VERTEX_COLOR_NODE_GROUP, 'ShaderNodeTree')
+  group[NODE_GROUP_TAG] = 'VERTEX_COLOR'
+  group.inputs.new('NodeSocketColor', 'Color')
+  group.inputs.new('NodeSocketFloat', 'Alpha')
+  group.outputs.new('NodeSocketColor', 'Color')
+  group.outputs.new('NodeSocketFloat', 'Alpha')
+
+  nodes = group.nodes
+  links = group.links
+  input_node = nodes.new('NodeGroupInput')
+  output_node = nodes.new('NodeGroupOutput')
+  vcol_node = nodes.new('ShaderNodeVertexColor')
+
+  # Vertex colors in KH:ReCOM can exceed 1.0. Blender will clamp any vertex
+  # color components over 1.0 (stored internally as 8-bit sRGB). To avoid
+  # losing color information, the importer halves each vertex color. Here we
+  # restore the vertex color back to its original intensity, with the caveat
+  # that Blender may not render certain vertex colors as bright as they appear
+  # in-game.
+  add_node = nodes.new('ShaderNodeMixRGB')
+  add_node.blend_type = 'ADD'
+  add_node.inputs['Fac'].default_value = 1.0
+  links.new(add_node.inputs['Color1'], vcol_node.outputs['Color'])
+  links.new(add_node.inputs['Color2'], vcol_node.outputs['Color'])
+
+  mult_node = nodes.new('ShaderNodeMixRGB')
+  mult_node.blend_type = 'MULTIPLY'
+  mult_node.inputs['Fac'].default_value = 1.0
+  links.new(mult_node.inputs['Color1'], input_node.outputs['Color'])
+  links.new(mult_node.inputs['Color2'], add_node.outputs['Color'])
+
+  alpha_mult_node = nodes.new('ShaderNodeMath')
+  alpha_mult_node.operation = 'MULTIPLY'
+  links.new(alpha_mult_node.inputs[0], input_node.outputs['Alpha'])
+  links.new(alpha_mult_node.inputs[1], vcol_node.outputs['Alpha'])
+
+  links.new(output_node.inputs['Color'], mult_node.outputs['Color'])
+  links.new(output_node.inputs['Alpha'], alpha_mult_node.outputs['Value'])
+  return group
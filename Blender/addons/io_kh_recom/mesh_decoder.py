@@ -0,0 +1,483 @@
+import collections
+import numpy as np
+
+from . import profiling
+
+
+class MeshImportError(Exception):
+  pass
+
+
+# Describes the layout of a single vertex for a VIF render mode.
+VertexFormat = collections.namedtuple('VertexFormat', [
+    'byte_size', 'has_vnormal', 'has_uv', 'has_vcol', 'has_uint_vcol',
+    'invert_normals'
+])
+
+
+def _make_vertex_format(byte_size,
+                        has_vnormal=False,
+                        has_uv=False,
+                        has_vcol=False,
+                        has_uint_vcol=False,
+                        invert_normals=False):
+  return VertexFormat(byte_size, has_vnormal, has_uv, has_vcol, has_uint_vcol,
+                      invert_normals)
+
+
+# TODO: These are known render modes across .AZF and .MDL files, but their
+# exact distinctions are unknown. The render mode specifies which
+# microsubroutine to run in order to process vertex data and send draw
+# instructions to the GIF.
+_POS = _make_vertex_format(0x20)
+_POS_UV = _make_vertex_format(0x30, has_uv=True)
+_POS_NORMAL = _make_vertex_format(0x30, has_vnormal=True)
+_POS_COLOR_INVERTED = _make_vertex_format(0x30,
+                                          has_vcol=True,
+                                          invert_normals=True)
+_POS_COLOR_UV = _make_vertex_format(0x40, has_uv=True, has_vcol=True)
+_POS_UINT_COLOR_UV = _make_vertex_format(0x40,
+                                         has_uv=True,
+                                         has_vcol=True,
+                                         has_uint_vcol=True)
+_POS_NORMAL_COLOR_UV = _make_vertex_format(0x50,
+                                           has_vnormal=True,
+                                           has_uv=True,
+                                           has_vcol=True)
+
+# {render mode -> VertexFormat}
+VERTEX_FORMATS = {
+    0x10: _POS,
+    0x6: _POS_UV,
+    0x2: _POS_NORMAL,
+    0x4005: _POS_NORMAL,
+    0x4205: _POS_UV,  # Musashi reflective texture?
+    0x4009: _POS_COLOR_INVERTED,  # Musashi inverse hull
+    0x0: _POS_UINT_COLOR_UV,
+    0x5: _POS_UINT_COLOR_UV,
+    0x24: _POS_UINT_COLOR_UV,
+    0x200: _POS_UINT_COLOR_UV,
+    0x406: _POS_COLOR_UV,
+    0x400B: _POS_COLOR_UV,
+    0x406E: _POS_NORMAL_COLOR_UV,  # Musashi stages
+    0x40EE: _POS_NORMAL_COLOR_UV,  # Musashi stages
+}
+
+# Assume max influence of 8 bones, in addition to the first vertex.
+MAX_VERTEX_INFLUENCES = 9
+
+INFLUENCE_DTYPE = np.dtype([('vertex_index', '<i4'), ('bone_index', '<i4'),
+                            ('weight', '<f4')])
+
+_VCOL_SCALE = np.array((256.0, 256.0, 256.0, 128.0))
+
+# {VertexFormat -> numpy.dtype}
+_vertex_dtype_cache = dict()
+
+
+def get_vertex_dtype(vertex_format):
+  dtype = _vertex_dtype_cache.get(vertex_format)
+  if dtype is not None:
+    return dtype
+
+  names = ['flag', 'weight', 'split_index', 'pos', 'bone_index']
+  formats = ['<i2', '<f4', '<i2', ('<f4', 3), '<i2']
+  offsets = [0x0, 0x4, 0x8, 0x10, 0x1E]
+  offs = 0x20
+  if vertex_format.has_vnormal:
+    names.append('vn')
+    formats.append(('<f4', 3))
+    offsets.append(offs)
+    offs += 0x10
+  if vertex_format.has_vcol:
+    names.append('vcol')
+    formats.append(('<u4' if vertex_format.has_uint_vcol else '<f4', 4))
+    offsets.append(offs)
+    offs += 0x10
+  if vertex_format.has_uv:
+    names.append('uv')
+    formats.append(('<f4', 2))
+    offsets.append(offs)
+    offs += 0x10
+
+  dtype = _vertex_dtype_cache[vertex_format] = np.dtype({
+      'names': names,
+      'formats': formats,
+      'offsets': offsets,
+      'itemsize': vertex_format.byte_size
+  })
+  return dtype
+
+
+# Returns the index of the first vertex record of each output vertex. Vertices
+# with multiple bone influences are stored as consecutive records with strictly
+# increasing, positive split indices.
+def group_vertex_influences(split_index, vertex_table_count):
+  split_index = split_index[:vertex_table_count]
+  join = np.zeros(len(split_index), dtype=bool)
+  join[1:] = (split_index[:-1] > 0) & (split_index[1:] > split_index[:-1])
+
+  run_starts = np.flatnonzero(~join)
+  run_ids = np.cumsum(~join) - 1
+  run_pos = np.arange(len(split_index)) - run_starts[run_ids]
+  return np.flatnonzero(run_pos % MAX_VERTEX_INFLUENCES == 0)
+
+
+# Merges vertices of a finalized submesh whose position, normal, color, UV and
+# bone influences are all identical, such as vertices repeated at the ends of
+# adjacent strips. Triangles are remapped to the merged vertices, and
+# triangles that become degenerate are removed. Vertices keep the order of
+# their first occurrence.
+def weld_vertices(submesh):
+  vertex_count = len(submesh.vtx)
+  if not vertex_count:
+    return
+
+  # Pad the influences of each vertex to a fixed width, so that they can be
+  # compared along with the other attributes.
+  influences = submesh.influences
+  vertex_index = influences['vertex_index']
+  run_starts = np.searchsorted(vertex_index, vertex_index, side='left')
+  slot = np.arange(len(influences)) - run_starts
+  bones = np.full((vertex_count, MAX_VERTEX_INFLUENCES), -1, dtype=np.int32)
+  weights = np.zeros((vertex_count, MAX_VERTEX_INFLUENCES), dtype=np.float32)
+  bones[vertex_index, slot] = influences['bone_index']
+  weights[vertex_index, slot] = influences['weight']
+
+  columns = [submesh.vtx, bones, weights]
+  columns += [
+      arr for arr in (submesh.vn, submesh.vcol, submesh.uv) if arr is not None
+  ]
+  keys = np.concatenate([
+      np.ascontiguousarray(arr).view(np.uint8).reshape(vertex_count, -1)
+      for arr in columns
+  ], axis=1)
+  # Compare each row of bytes as a single value.
+  keys = keys.view(np.dtype((np.void, keys.shape[1]))).ravel()
+
+  _, first_vertex, inverse = np.unique(keys,
+                                       return_index=True,
+                                       return_inverse=True)
+  if len(first_vertex) == vertex_count:
+    return
+  order = np.argsort(first_vertex)
+  first_vertex = first_vertex[order]
+  new_index = np.empty(len(order), dtype=np.int64)
+  new_index[order] = np.arange(len(order))
+  remap = new_index[inverse.ravel()]
+
+  for name in ('vtx', 'vn', 'vcol', 'uv'):
+    arr = getattr(submesh, name)
+    if arr is not None:
+      setattr(submesh, name, arr[first_vertex])
+
+  tri = remap[submesh.tri]
+  tri = tri[(tri[:, 0] != tri[:, 1]) & (tri[:, 1] != tri[:, 2]) &
+            (tri[:, 0] != tri[:, 2])]
+  submesh.tri = tri.astype(np.int32)
+
+  is_first = np.zeros(vertex_count, dtype=bool)
+  is_first[first_vertex] = True
+  influences = influences[is_first[vertex_index]].copy()
+  influences['vertex_index'] = remap[influences['vertex_index']]
+  submesh.influences = influences
+  submesh.vertex_count = len(first_vertex)
+
+
+# Groups weights for a single vertex group into batches of the form
+# (vertex indices, weight) for VertexGroup.add(). A vertex may receive several
+# weights for the same bone; the nth weight of each vertex is placed in the nth
+# pass, so that weights are still added to each vertex in their original order.
+def batch_vertex_weights(vertex_indices, weights):
+  order = np.argsort(vertex_indices, kind='stable')
+  sorted_indices = vertex_indices[order]
+  is_run_start = np.concatenate(
+      ([True], sorted_indices[1:] != sorted_indices[:-1]))
+  run_starts = np.flatnonzero(is_run_start)
+  run_ids = np.cumsum(is_run_start) - 1
+  passes = np.empty(len(order), dtype=np.int64)
+  passes[order] = np.arange(len(order)) - run_starts[run_ids]
+
+  for p in range(passes.max() + 1 if len(passes) else 0):
+    pass_indices = vertex_indices[passes == p]
+    pass_weights = weights[passes == p]
+    order = np.argsort(pass_weights, kind='stable')
+    pass_indices = pass_indices[order]
+    pass_weights = pass_weights[order]
+    splits = np.flatnonzero(pass_weights[1:] != pass_weights[:-1]) + 1
+    for batch_indices, batch_weights in zip(np.split(pass_indices, splits),
+                                            np.split(pass_weights, splits)):
+      yield batch_indices.tolist(), float(batch_weights[0])
+
+
+# Returns the matrix that Blender reports for an edit bone after assigning
+# the given matrix. Edit bones do not store scale, so each axis is normalized.
+def _get_edit_bone_matrix(matrix):
+  matrix = matrix.copy()
+  matrix[:3, :3] /= np.linalg.norm(matrix[:3, :3], axis=0)
+  return matrix
+
+
+class ArmatureData:
+  def __init__(self):
+    self.bone_names = []
+    self.parent_indices = []
+    # Global bone matrices as a (bone count, 4, 4) array.
+    self.bone_matrices = np.zeros((0, 4, 4))
+
+
+class SubmeshData:
+  def __init__(self, name, texture_index, is_translucent, invert_normals=False):
+    self.name = name
+    self.texture_index = texture_index
+    self.is_translucent = is_translucent
+    self.invert_normals = invert_normals
+    # Vertex attributes used to choose a material.
+    self.has_uv = False
+    self.has_vcol = False
+
+    # Per-vertex arrays. Attributes that are not present are None.
+    self.vtx = np.zeros((0, 3))
+    self.vn = None
+    self.uv = None
+    self.vcol = None
+    self.tri = np.zeros((0, 3), dtype=np.int32)
+    # (vertex index, bone index, weight) for each bone influence.
+    self.influences = np.zeros(0, dtype=INFLUENCE_DTYPE)
+
+    # Lists of per-packet arrays, merged by finalize().
+    self._chunks = collections.defaultdict(list)
+    self.vertex_count = 0
+
+  def add_vertices(self, vtx, tri, influences, vn=None, vcol=None, uv=None):
+    for name, arr in (('vtx', vtx), ('tri', tri), ('influences', influences),
+                      ('vn', vn), ('vcol', vcol), ('uv', uv)):
+      if arr is not None:
+        self._chunks[name].append(arr)
+    self.vertex_count += len(vtx)
+
+  def finalize(self):
+    for name, chunks in self._chunks.items():
+      setattr(self, name, np.concatenate(chunks))
+    self._chunks.clear()
+
+
+# Offsets in a model header. VIF offsets are 0 if the model has no packets of
+# that kind.
+ModelHeader = collections.namedtuple('ModelHeader', [
+    'offset', 'texture_count', 'texture_table_offs', 'vif_opaque_offs',
+    'vif_translucent_offs'
+])
+
+
+# Reads the header of the model at model_offs. Returned offsets are absolute.
+def read_model_header(f, model_offs):
+  f.seek(model_offs + 0xC)
+  (texture_count, texture_table_offs, vif_opaque_offs,
+   vif_translucent_offs) = f.read_nuint32(4)
+  return ModelHeader(model_offs, texture_count, model_offs + texture_table_offs,
+                     vif_opaque_offs and model_offs + vif_opaque_offs,
+                     vif_translucent_offs and model_offs + vif_translucent_offs)
+
+
+class ModelData:
+  def __init__(self, basename, armature, texture_names):
+    self.basename = basename
+    self.armature = armature
+    self.texture_names = texture_names
+    self.submeshes = []
+
+
+class MeshDecoder:
+  def __init__(self,
+               armature=None,
+               skip_textureless_meshes=False,
+               weld_vertices=False):
+    self.armature = armature
+    self._skip_textureless_meshes = skip_textureless_meshes
+    self._weld_vertices = weld_vertices
+
+  # Returns a ModelData, or None if the model is skipped. The header is read
+  # from the file if it is not given.
+  def decode(self, f, model_offs, basename, header=None):
+    if not header:
+      header = read_model_header(f, model_offs)
+
+    if header.texture_count == 0 and self._skip_textureless_meshes:
+      return None
+
+    with profiling.phase('header'):
+      if not self.armature:
+        self.armature = self._decode_armature(f, model_offs)
+      texture_names = self._decode_texture_table(f, header.texture_table_offs,
+                                                 header.texture_count)
+
+    model = ModelData(basename, self.armature, texture_names)
+    with profiling.phase('vif'):
+      if header.vif_opaque_offs:
+        model.submeshes += self._decode_vif_packets(f, header.vif_opaque_offs,
+                                                    basename, False)
+      if header.vif_translucent_offs:
+        model.submeshes += self._decode_vif_packets(
+            f, header.vif_translucent_offs, basename, True)
+    return model
+
+  def _decode_armature(self, f, model_offs):
+    f.seek(model_offs)
+    bone_count = f.read_uint16()
+    if bone_count <= 0:
+      return None
+    f.skip(2)
+    bone_table_offs = model_offs + f.read_uint32()
+    transform_table_offs = model_offs + f.read_uint32()
+
+    armature = ArmatureData()
+    armature.bone_matrices = np.zeros((bone_count, 4, 4))
+    for i in range(bone_count):
+      f.seek(bone_table_offs + i * 0x14)
+      armature.bone_names.append(f.read_string(0x10))
+      parent_index = f.read_int16()
+      armature.parent_indices.append(parent_index)
+
+      f.seek(transform_table_offs + i * 0x40)
+      local_matrix = np.array(f.read_nfloat32(16)).reshape(4, 4).T
+
+      if parent_index >= 0:
+        global_matrix = _get_edit_bone_matrix(
+            armature.bone_matrices[parent_index]) @ local_matrix
+      else:
+        global_matrix = local_matrix
+      armature.bone_matrices[i] = global_matrix
+
+    return armature
+
+  def _decode_texture_table(self, f, texture_table_offs, texture_table_count):
+    f.seek(texture_table_offs)
+    return [f.read_string(0x20) for i in range(texture_table_count)]
+
+  def _decode_vif_packets(self, f, offs, basename, is_translucent):
+    # {material index -> SubmeshData}
+    submesh_dict = dict()
+    has_uv = has_vcol = False
+    while offs < f.filesize:
+      f.seek(offs)
+      dmatag = f.read_uint32()
+      if dmatag == 0x60000000:  # ret
+        break
+      qwc = dmatag & 0xFF
+
+      # Skip STCYCL and UNPACK commands and go straight to compressed vertex
+      # data since these are not critical for parsing.
+      f.skip(0x10)
+      vertex_table_count, _, vertex_count, _, mode = f.read_nuint16(5)
+
+      vertex_format = VERTEX_FORMATS.get(mode)
+      if not vertex_format:
+        raise MeshImportError('Unrecognized render mode {} at offset {}'.format(
+            hex(mode), hex(offs + 0x1C)))
+      has_uv = vertex_format.has_uv
+      has_vcol = vertex_format.has_vcol
+
+      # Only the first vertex determines the texture to apply.
+      if has_uv and mode != 0x4205:
+        f.seek(offs + vertex_format.byte_size + 0x2C)
+        texture_index = f.read_uint16()
+      else:
+        texture_index = 0
+
+      if texture_index in submesh_dict:
+        submesh = submesh_dict[texture_index]
+      else:
+        submesh = submesh_dict[texture_index] = SubmeshData(
+            '{}_mat{}{}'.format(basename, texture_index,
+                                '_t' if is_translucent else ''), texture_index,
+            is_translucent, vertex_format.invert_normals)
+
+      if vertex_count > 0:
+        self._decode_vertices(f, offs + 0x30, vertex_format, vertex_table_count,
+                              vertex_count, submesh)
+
+      offs += (qwc + 1) * 0x10
+
+    for submesh in submesh_dict.values():
+      submesh.finalize()
+      if self._weld_vertices:
+        weld_vertices(submesh)
+      # Materials are chosen based on the last packet in the list.
+      submesh.has_uv = has_uv
+      submesh.has_vcol = has_vcol
+    return list(submesh_dict.values())
+
+  def _decode_vertices(self, f, v_offs, vertex_format, vertex_table_count,
+                       vertex_count, submesh):
+    dtype = get_vertex_dtype(vertex_format)
+
+    # Vertices that should be added together due to multiple bone influences
+    # are stored as consecutive records.
+    f.seek(v_offs)
+    records = f.read_array(dtype, vertex_table_count)
+    starts = group_vertex_influences(records['split_index'], vertex_table_count)
+    if len(starts) < vertex_count:
+      # Any remaining vertices past the end of the table have one influence.
+      extra_count = vertex_count - len(starts)
+      starts = np.concatenate(
+          (starts,
+           np.arange(vertex_table_count, vertex_table_count + extra_count)))
+      f.seek(v_offs)
+      records = f.read_array(dtype, vertex_table_count + extra_count)
+    if len(starts) > vertex_count:
+      records = records[:starts[vertex_count]]
+    starts = starts[:vertex_count]
+    ends = np.append(starts[1:], len(records))
+    last = ends - 1
+
+    if not self.armature:
+      raise MeshImportError(
+          'Vertex data at offset {} requires bones, but the model has none'.
+          format(hex(v_offs)))
+    bone_index = records['bone_index'].astype(np.int32)
+    bad_bones = np.flatnonzero((bone_index < 0) |
+                               (bone_index >= len(self.armature.bone_names)))
+    if len(bad_bones):
+      i = bad_bones[0]
+      raise MeshImportError('Bad bone index {} at offset {}'.format(
+          bone_index[i], hex(v_offs + i * vertex_format.byte_size)))
+
+    v_start = submesh.vertex_count
+    vertex_index = np.repeat(np.arange(v_start, v_start + vertex_count),
+                             ends - starts)
+
+    influences = np.empty(len(records), dtype=INFLUENCE_DTYPE)
+    influences['vertex_index'] = vertex_index
+    influences['bone_index'] = bone_index
+    influences['weight'] = records['weight']
+
+    # Transform each influence by its bone matrix with the weight as the W
+    # component, then sum the influences of each vertex.
+    vtx_local = np.empty((len(records), 4))
+    vtx_local[:, :3] = records['pos']
+    vtx_local[:, 3] = records['weight']
+    bone_matrices = self.armature.bone_matrices
+    vtx = np.einsum('nij,nj->ni', bone_matrices[bone_index], vtx_local)
+    vtx = np.add.reduceat(vtx, starts)[:, :3]
+
+    # Remaining attributes are taken from the last influence of each vertex.
+    vn = vcol = uv = None
+    if vertex_format.has_vnormal:
+      vn = records['vn'][last].astype(np.float64)
+    if vertex_format.has_vcol:
+      vcol = records['vcol'][last] / _VCOL_SCALE
+    if vertex_format.has_uv:
+      uv = records['uv'][last].astype(np.float64)
+      uv[:, 1] = 1.0 - uv[:, 1]
+
+    # Each vertex after the first two completes a triangle in the strip, with
+    # the flag determining its winding order.
+    flag = records['flag'][last][2:]
+    v = np.arange(2, vertex_count)
+    tri = np.stack((v, v - 1, v - 2), axis=-1)
+    tri[flag == 0x20] = tri[flag == 0x20, ::-1]
+    tri = tri[(flag == 0x00) | (flag == 0x20)]
+
+    submesh.add_vertices(vtx, tri + v_start, influences, vn, vcol, uv)
+
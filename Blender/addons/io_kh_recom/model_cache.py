@@ -0,0 +1,83 @@
+import collections
+import os
+import threading
+
+from . import decode_mdl
+
+DEFAULT_MAX_CACHE_SIZE = 256 * 1024 * 1024
+
+
+# Returns the approximate number of bytes held by the arrays of a decoded MDL
+# file.
+def get_mdl_size(mdl):
+  size = 0
+  if mdl.armature:
+    size += mdl.armature.bone_matrices.nbytes
+  for model in mdl.models:
+    for submesh in model.submeshes:
+      for array in (submesh.vtx, submesh.vn, submesh.uv, submesh.vcol,
+                    submesh.tri, submesh.influences):
+        if array is not None:
+          size += array.nbytes
+  return size
+
+
+# In-memory cache of decoded MDL files. Entries are keyed by the path, size and
+# modification time of the file, so modified files are decoded again. Least
+# recently used entries are evicted once the cache exceeds max_size bytes.
+#
+# Cached data is shared between imports and must not be modified.
+class ModelCache:
+  def __init__(self, max_size=DEFAULT_MAX_CACHE_SIZE):
+    self.max_size = max_size
+    self.size = 0
+    # {key -> (MdlData, size)}
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.size = 0
+
+  # Returns the decoded MDL file, decoding it on a cache miss. Arguments are
+  # the same as decode_mdl.decode_mdl(). If a SceneCache is given, misses are
+  # loaded from it before decoding the file.
+  def decode_mdl(self,
+                 filepath,
+                 import_shadow_model=False,
+                 model_indices=None,
+                 weld_vertices=False,
+                 scene_cache=None):
+    if model_indices is not None:
+      model_indices = tuple(sorted(set(model_indices)))
+    stat = os.stat(filepath)
+    key = (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns,
+           import_shadow_model, model_indices, weld_vertices)
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry:
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    decode = scene_cache.decode_mdl if scene_cache else decode_mdl.decode_mdl
+    mdl = decode(filepath, import_shadow_model, model_indices, weld_vertices)
+    mdl_size = get_mdl_size(mdl)
+    with self._lock:
+      if key not in self._entries:
+        self._entries[key] = (mdl, mdl_size)
+        self.size += mdl_size
+      self._evict()
+    return mdl
+
+  def _evict(self):
+    while self.size > self.max_size and self._entries:
+      _, (_, mdl_size) = self._entries.popitem(last=False)
+      self.size -= mdl_size
+
+
+# Shared by all imports in this process.
+default_cache = ModelCache()
@@ -0,0 +1,868 @@
+# pylint: disable=import-error
+
+if "bpy" in locals():
+  # pylint: disable=undefined-variable
+  import importlib
+  if "import_azf" in locals():
+    importlib.reload(import_azf)
+  if "import_batch" in locals():
+    importlib.reload(import_batch)
+  if "import_gsd" in locals():
+    importlib.reload(import_gsd)
+  if "import_mdl" in locals():
+    importlib.reload(import_mdl)
+  if "mesh_parser" in locals():
+    importlib.reload(mesh_parser)
+  if "profiling" in locals():
+    importlib.reload(profiling)
+
+import bpy
+import concurrent.futures
+import contextlib
+import os
+import time
+from bpy.props import (
+    BoolProperty,
+    CollectionProperty,
+    EnumProperty,
+    FloatProperty,
+    FloatVectorProperty,
+    IntProperty,
+    StringProperty,
+)
+from bpy_extras.io_utils import (
+    ImportHelper,)
+
+from . import mesh_parser
+from . import profiling
+
+
+# Operator properties that are not passed to importers.
+_IGNORED_PROPERTIES = ("filter_glob", "profile_import", "show_progress")
+# Seconds of main-thread work per timer event during modal imports.
+BUILD_SLICE_SECONDS = 0.05
+# Blender data that is removed again when a modal import is cancelled, in
+# removal order.
+_IMPORTED_DATA = ('objects', 'collections', 'meshes', 'armatures', 'materials',
+                  'node_groups', 'images')
+
+
+def _report_profile(operator, profiler, report_path):
+  summary = f'{profiler.summary()}. Report written to {report_path}'
+  print(summary)
+  operator.report({'INFO'}, summary)
+
+
+# Runs an importer's load function with the operator's properties, optionally
+# inside a profiling session.
+def _execute_import(operator, context, load):
+  keywords = operator.get_import_keywords()
+  profile_filepath = operator.get_profile_filepath()
+  report_path = profiling.get_report_path(profile_filepath)
+  with profiling.session(operator.profile_import,
+                         os.path.basename(profile_filepath),
+                         report_path) as profiler:
+    status, msg = load(context, **keywords)
+  if msg:
+    operator.report({'ERROR'}, msg)
+  if profiler:
+    _report_profile(operator, profiler, report_path)
+  return {status}
+
+
+# Tracks the Blender data that an import creates. Walking every item of
+# bpy.data is slow in large .blend files, so each update only scans the data
+# types whose item count changed since the previous update.
+class _DataTracker:
+  def __init__(self):
+    # {data name -> item count at the last update}
+    self._counts = dict()
+    # {data name -> pointers to all items at the last update}
+    self._pointers = dict()
+    # {data name -> pointers to data created by the import}
+    self.created = {data_name: set() for data_name in _IMPORTED_DATA}
+    for data_name in _IMPORTED_DATA:
+      data = getattr(bpy.data, data_name)
+      self._counts[data_name] = len(data)
+      self._pointers[data_name] = {item.as_pointer() for item in data}
+
+  # Scans the data types that changed. New items are recorded as created by the
+  # import if record is True, and otherwise treated as user data.
+  def update(self, record=True):
+    for data_name in _IMPORTED_DATA:
+      data = getattr(bpy.data, data_name)
+      if len(data) == self._counts[data_name]:
+        continue
+      pointers = {item.as_pointer() for item in data}
+      if record:
+        self.created[data_name].update(pointers - self._pointers[data_name])
+      self._counts[data_name] = len(data)
+      self._pointers[data_name] = pointers
+
+  # Removes the data created by the import.
+  def remove_created(self):
+    for data_name in _IMPORTED_DATA:
+      created = self.created[data_name]
+      if not created:
+        continue
+      data = getattr(bpy.data, data_name)
+      for item in [item for item in data if item.as_pointer() in created]:
+        data.remove(item)
+
+
+# Mixin for import operators that runs an importer's job modally: files are
+# decoded on a worker thread, and Blender data is created in short slices on
+# timer events, so the UI stays responsive and shows progress. Esc cancels the
+# import and removes the data it created. Undo and redo are blocked until the
+# import ends, since they would invalidate data that the import still uses.
+class _ModalImportMixin:
+  # Returns the keyword arguments for the importer's make_job() and load().
+  def get_import_keywords(self):
+    return self.as_keywords(ignore=_IGNORED_PROPERTIES)
+
+  # Returns the path that names profiling sessions and reports.
+  def get_profile_filepath(self):
+    return self.filepath
+
+  def execute_job(self, context, importer):
+    if not self.show_progress or bpy.app.background or not context.window:
+      return _execute_import(self, context, importer.load)
+
+    keywords = self.get_import_keywords()
+    profile_filepath = self.get_profile_filepath()
+    try:
+      self._job = importer.make_job(**keywords)
+    except importer.IMPORT_ERRORS as err:
+      self.report({'ERROR'}, str(err))
+      return {'CANCELLED'}
+
+    self._exit_stack = contextlib.ExitStack()
+    self._report_path = profiling.get_report_path(profile_filepath)
+    self._profiler = self._exit_stack.enter_context(
+        profiling.session(self.profile_import,
+                          os.path.basename(profile_filepath),
+                          self._report_path))
+    self._tracker = _DataTracker()
+    self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    self._decoding = self._executor.submit(self._job.decode)
+    self._build = None
+
+    wm = context.window_manager
+    self._timer = wm.event_timer_add(BUILD_SLICE_SECONDS, window=context.window)
+    wm.progress_begin(0, 100)
+    wm.modal_handler_add(self)
+    context.workspace.status_text_set(
+        f'Decoding {os.path.basename(profile_filepath)}')
+    return {'RUNNING_MODAL'}
+
+  def modal(self, context, event):
+    if event.type == 'ESC':
+      self._cancel(context)
+      self.report({'WARNING'}, 'Import cancelled')
+      return {'CANCELLED'}
+    if event.type == 'Z' and (event.ctrl or event.oskey):
+      # Swallow undo and redo shortcuts.
+      return {'RUNNING_MODAL'}
+    if event.type != 'TIMER':
+      return {'PASS_THROUGH'}
+
+    try:
+      if not self._build:
+        if not self._decoding.done():
+          return {'RUNNING_MODAL'}
+        self._decoding.result()
+        self._build = self._job.iter_build()
+      if self._build_slice(context):
+        return {'RUNNING_MODAL'}
+    except self._job.errors as err:
+      self._cancel(context)
+      self.report({'ERROR'}, str(err))
+      return {'CANCELLED'}
+    except Exception:
+      self._finish(context)
+      raise
+
+    self._finish(context)
+    if self._profiler:
+      _report_profile(self, self._profiler, self._report_path)
+    return {'FINISHED'}
+
+  # Builds for up to BUILD_SLICE_SECONDS. Returns True if there is more to
+  # build.
+  def _build_slice(self, context):
+    # The user cannot change Blender data while a slice runs, so everything
+    # created in the meantime belongs to the import. Changes made by the user
+    # between slices are not.
+    self._tracker.update(record=False)
+    # Profiling phases stay open across slices, so only the time spent in
+    # slices is counted.
+    if self._profiler:
+      self._profiler.resume()
+    try:
+      slice_end_time = time.perf_counter() + BUILD_SLICE_SECONDS
+      for label, done, total in self._build:
+        if time.perf_counter() >= slice_end_time:
+          context.workspace.status_text_set(f'{label} {done}/{total}')
+          context.window_manager.progress_update(done * 100 // max(total, 1))
+          return True
+      return False
+    finally:
+      if self._profiler:
+        self._profiler.pause()
+      self._tracker.update()
+
+  # Ends the import and removes the data it created.
+  def _cancel(self, context):
+    self._finish(context)
+    self._tracker.remove_created()
+
+  def _finish(self, context):
+    # A running decode stops before its next file; its result is discarded.
+    self._job.cancel()
+    if self._profiler:
+      self._profiler.resume()
+    if self._build:
+      self._build.close()
+    self._executor.shutdown(wait=False)
+    self._exit_stack.close()
+    wm = context.window_manager
+    wm.event_timer_remove(self._timer)
+    wm.progress_end()
+    context.workspace.status_text_set(None)
+
+
+class ImportKhReComAzf(_ModalImportMixin, bpy.types.Operator, ImportHelper):
+  """Load a Kingdom Hearts Re:Chain of Memories AZF file"""
+  bl_idname = "import_khrecom.azf"
+  bl_label = "Import Kingdom Hearts Re:COM (PS2) Stage (AZF)"
+  bl_options = {'PRESET', 'UNDO'}
+
+  filename_ext = ".azf"
+  filter_glob: StringProperty(default="*.azf", options={'HIDDEN'})
+
+  import_skybox: BoolProperty(
+      name="Import Skybox",
+      description="Import skybox objects and textures.",
+      default=True,
+  )
+
+  ignore_placeholders: BoolProperty(
+      name="Ignore Placeholders",
+      description=
+      "Skip importing placeholder meshes used to mark particle effects.",
+      default=True,
+  )
+
+  use_vertex_color_materials: BoolProperty(
+      name="Use Vertex Color in Materials",
+      description=
+      "Automatically connect baked vertex colors in Blender materials if present. If unchecked, vertex color layers will still be imported for objects.",
+      default=True,
+  )
+
+  use_texture_cache: BoolProperty(
+      name="Use Texture Cache",
+      description=
+      "Store decoded textures in a disk cache and reuse them in later imports of the same texture archives.",
+      default=False,
+  )
+
+  use_scene_cache: BoolProperty(
+      name="Use Scene Cache",
+      description=
+      "Store decoded meshes, bones and placements in a disk cache and load them from there in later imports of the same unchanged files.",
+      default=False,
+  )
+
+  use_asset_catalog: BoolProperty(
+      name="Use Asset Catalog",
+      description=
+      "Look up texture archives and gimmick models in a catalog of the extracted files instead of listing directories and reading archive headers. Directories are added to the catalog on first use and updated when their files change.",
+      default=False,
+  )
+
+  weld_vertices: BoolProperty(
+      name="Weld Vertices",
+      description=
+      "Merge vertices with identical positions, normals, colors, UVs and bone weights, such as those shared by adjacent triangle strips.",
+      default=False,
+  )
+
+  use_collection_instances: BoolProperty(
+      name="Use Collection Instances",
+      description=
+      "Create one collection per unique mesh and instance it for each placement, instead of copying its objects.",
+      default=False,
+  )
+
+  skybox_only: BoolProperty(
+      name="Skybox Only",
+      description="Import only skybox objects.",
+      default=False,
+  )
+
+  mesh_indices: StringProperty(
+      name="Mesh Indices",
+      description=
+      "Import only instances of these meshes, e.g. \"0-3, 7\". Leave empty to import all meshes.",
+      default="",
+  )
+
+  use_bounds: BoolProperty(
+      name="Limit to Bounds",
+      description=
+      "Import only instances whose origin lies within a world-space bounding box.",
+      default=False,
+  )
+
+  bounds_min: FloatVectorProperty(
+      name="Bounds Min",
+      description="Minimum corner of the bounding box.",
+      subtype='XYZ',
+      default=(-10.0, -10.0, -10.0),
+  )
+
+  bounds_max: FloatVectorProperty(
+      name="Bounds Max",
+      description="Maximum corner of the bounding box.",
+      subtype='XYZ',
+      default=(10.0, 10.0, 10.0),
+  )
+
+  use_lod_proxies: BoolProperty(
+      name="Use LOD Proxies",
+      description=
+      "Display decimated proxies of the meshes with the most triangles until the stage fits in the triangle budget. Use \"Set Re:COM Level of Detail\" to switch selected objects to full resolution.",
+      default=False,
+  )
+
+  lod_ratio: FloatProperty(
+      name="Proxy Ratio",
+      description="Approximate fraction of vertices kept in proxies.",
+      default=0.25,
+      min=0.01,
+      max=1.0,
+  )
+
+  lod_triangle_budget: IntProperty(
+      name="Triangle Budget",
+      description=
+      "Total number of displayed stage triangles to aim for when choosing meshes to replace with proxies.",
+      default=1000000,
+      min=0,
+  )
+
+  show_progress: BoolProperty(
+      name="Show Progress",
+      description=
+      "Decode files in the background and build Blender data in small steps, showing progress in the status bar. Press Esc to cancel the import.",
+      default=True,
+  )
+
+  profile_import: BoolProperty(
+      name="Profile Import",
+      description=
+      "Record the time spent in each import phase, bytes read, element counts and peak memory. A JSON report is written to the temporary directory and a summary is shown after import.",
+      default=False,
+  )
+
+  def execute(self, context):
+    from . import import_azf
+
+    return self.execute_job(context, import_azf)
+
+  def draw(self, context):
+    pass
+
+
+class AZF_PT_import_options(bpy.types.Panel):
+  bl_space_type = 'FILE_BROWSER'
+  bl_region_type = 'TOOL_PROPS'
+  bl_label = "Import AZF"
+  bl_parent_id = "FILE_PT_operator"
+
+  @classmethod
+  def poll(cls, context):
+    sfile = context.space_data
+    operator = sfile.active_operator
+
+    return operator.bl_idname == "IMPORT_KHRECOM_OT_azf"
+
+  def draw(self, context):
+    layout = self.layout
+    layout.use_property_split = True
+    layout.use_property_decorate = False
+
+    sfile = context.space_data
+    operator = sfile.active_operator
+
+    layout.prop(operator, 'import_skybox')
+    layout.prop(operator, 'ignore_placeholders')
+    layout.prop(operator, 'use_vertex_color_materials')
+    layout.prop(operator, 'use_texture_cache')
+    layout.prop(operator, 'use_scene_cache')
+    layout.prop(operator, 'use_asset_catalog')
+    layout.prop(operator, 'weld_vertices')
+    layout.prop(operator, 'use_collection_instances')
+    layout.prop(operator, 'show_progress')
+    layout.prop(operator, 'profile_import')
+
+    layout.separator()
+    layout.label(text="Selective Import")
+    layout.prop(operator, 'skybox_only')
+    layout.prop(operator, 'mesh_indices')
+    layout.prop(operator, 'use_bounds')
+    col = layout.column()
+    col.enabled = operator.use_bounds
+    col.prop(operator, 'bounds_min')
+    col.prop(operator, 'bounds_max')
+
+    layout.separator()
+    layout.label(text="Level of Detail")
+    layout.prop(operator, 'use_lod_proxies')
+    col = layout.column()
+    col.enabled = operator.use_lod_proxies
+    col.prop(operator, 'lod_ratio')
+    col.prop(operator, 'lod_triangle_budget')
+
+
+class ImportKhReComGsd(_ModalImportMixin, bpy.types.Operator, ImportHelper):
+  """Load a Kingdom Hearts Re:Chain of Memories GSD file"""
+  bl_idname = "import_khrecom.gsd"
+  bl_label = "Import Kingdom Hearts Re:COM (PS2) Stage Gimmicks (GSD)"
+  bl_options = {'PRESET', 'UNDO'}
+
+  filename_ext = ".gsd"
+  filter_glob: StringProperty(default="*.gsd", options={'HIDDEN'})
+
+  import_shadow_model: BoolProperty(
+      name="Import Shadow Models",
+      description="Import models used for shadows.",
+      default=False,
+  )
+
+  use_vertex_color_materials: BoolProperty(
+      name="Use Vertex Color in Materials",
+      description=
+      "Automatically connect baked vertex colors in Blender materials if present. If unchecked, vertex color layers will still be imported for objects.",
+      default=True,
+  )
+
+  use_texture_cache: BoolProperty(
+      name="Use Texture Cache",
+      description=
+      "Store decoded textures in a disk cache and reuse them in later imports of the same texture archives.",
+      default=False,
+  )
+
+  use_scene_cache: BoolProperty(
+      name="Use Scene Cache",
+      description=
+      "Store decoded meshes, bones and placements in a disk cache and load them from there in later imports of the same unchanged files.",
+      default=False,
+  )
+
+  use_asset_catalog: BoolProperty(
+      name="Use Asset Catalog",
+      description=
+      "Look up texture archives and gimmick models in a catalog of the extracted files instead of listing directories and reading archive headers. Directories are added to the catalog on first use and updated when their files change.",
+      default=False,
+  )
+
+  weld_vertices: BoolProperty(
+      name="Weld Vertices",
+      description=
+      "Merge vertices with identical positions, normals, colors, UVs and bone weights, such as those shared by adjacent triangle strips.",
+      default=False,
+  )
+
+  use_collection_instances: BoolProperty(
+      name="Use Collection Instances",
+      description=
+      "Create one collection per unique gimmick and instance it for each placement, instead of copying its objects.",
+      default=False,
+  )
+
+  show_progress: BoolProperty(
+      name="Show Progress",
+      description=
+      "Decode files in the background and build Blender data in small steps, showing progress in the status bar. Press Esc to cancel the import.",
+      default=True,
+  )
+
+  profile_import: BoolProperty(
+      name="Profile Import",
+      description=
+      "Record the time spent in each import phase, bytes read, element counts and peak memory. A JSON report is written to the temporary directory and a summary is shown after import.",
+      default=False,
+  )
+
+  def execute(self, context):
+    from . import import_gsd
+
+    return self.execute_job(context, import_gsd)
+
+  def draw(self, context):
+    pass
+
+
+class GSD_PT_import_options(bpy.types.Panel):
+  bl_space_type = 'FILE_BROWSER'
+  bl_region_type = 'TOOL_PROPS'
+  bl_label = "Import GSD"
+  bl_parent_id = "FILE_PT_operator"
+
+  @classmethod
+  def poll(cls, context):
+    sfile = context.space_data
+    operator = sfile.active_operator
+
+    return operator.bl_idname == "IMPORT_KHRECOM_OT_gsd"
+
+  def draw(self, context):
+    layout = self.layout
+    layout.use_property_split = True
+    layout.use_property_decorate = False
+
+    sfile = context.space_data
+    operator = sfile.active_operator
+
+    layout.prop(operator, 'import_shadow_model')
+    layout.prop(operator, 'use_vertex_color_materials')
+    layout.prop(operator, 'use_texture_cache')
+    layout.prop(operator, 'use_scene_cache')
+    layout.prop(operator, 'use_asset_catalog')
+    layout.prop(operator, 'weld_vertices')
+    layout.prop(operator, 'use_collection_instances')
+    layout.prop(operator, 'show_progress')
+    layout.prop(operator, 'profile_import')
+
+
+class ImportKhReComMdl(_ModalImportMixin, bpy.types.Operator, ImportHelper):
+  """Load a Kingdom Hearts Re:Chain of Memories MDL file"""
+  bl_idname = "import_khrecom.mdl"
+  bl_label = "Import Kingdom Hearts Re:COM (PS2) Model (MDL)"
+  bl_options = {'PRESET', 'UNDO'}
+
+  filename_ext = ".mdl"
+  filter_glob: StringProperty(default="*.mdl", options={'HIDDEN'})
+
+  import_shadow_model: BoolProperty(
+      name="Import Shadow Models",
+      description="Import models used for shadows.",
+      default=False,
+  )
+
+  use_vertex_color_materials: BoolProperty(
+      name="Use Vertex Color in Materials",
+      description=
+      "Automatically connect baked vertex colors in Blender materials if present. If unchecked, vertex color layers will still be imported for objects.",
+      default=True,
+  )
+
+  use_texture_cache: BoolProperty(
+      name="Use Texture Cache",
+      description=
+      "Store decoded textures in a disk cache and reuse them in later imports of the same texture archives.",
+      default=False,
+  )
+
+  use_scene_cache: BoolProperty(
+      name="Use Scene Cache",
+      description=
+      "Store decoded meshes, bones and placements in a disk cache and load them from there in later imports of the same unchanged files.",
+      default=False,
+  )
+
+  use_asset_catalog: BoolProperty(
+      name="Use Asset Catalog",
+      description=
+      "Look up texture archives and gimmick models in a catalog of the extracted files instead of listing directories and reading archive headers. Directories are added to the catalog on first use and updated when their files change.",
+      default=False,
+  )
+
+  weld_vertices: BoolProperty(
+      name="Weld Vertices",
+      description=
+      "Merge vertices with identical positions, normals, colors, UVs and bone weights, such as those shared by adjacent triangle strips.",
+      default=False,
+  )
+
+  show_progress: BoolProperty(
+      name="Show Progress",
+      description=
+      "Decode files in the background and build Blender data in small steps, showing progress in the status bar. Press Esc to cancel the import.",
+      default=True,
+  )
+
+  profile_import: BoolProperty(
+      name="Profile Import",
+      description=
+      "Record the time spent in each import phase, bytes read, element counts and peak memory. A JSON report is written to the temporary directory and a summary is shown after import.",
+      default=False,
+  )
+
+  def execute(self, context):
+    from . import import_mdl
+
+    return self.execute_job(context, import_mdl)
+
+  def draw(self, context):
+    pass
+
+
+class MDL_PT_import_options(bpy.types.Panel):
+  bl_space_type = 'FILE_BROWSER'
+  bl_region_type = 'TOOL_PROPS'
+  bl_label = "Import MDL"
+  bl_parent_id = "FILE_PT_operator"
+
+  @classmethod
+  def poll(cls, context):
+    sfile = context.space_data
+    operator = sfile.active_operator
+
+    return operator.bl_idname == "IMPORT_KHRECOM_OT_mdl"
+
+  def draw(self, context):
+    layout = self.layout
+    layout.use_property_split = True
+    layout.use_property_decorate = False
+
+    sfile = context.space_data
+    operator = sfile.active_operator
+
+    layout.prop(operator, 'import_shadow_model')
+    layout.prop(operator, 'use_vertex_color_materials')
+    layout.prop(operator, 'use_texture_cache')
+    layout.prop(operator, 'use_scene_cache')
+    layout.prop(operator, 'use_asset_catalog')
+    layout.prop(operator, 'weld_vertices')
+    layout.prop(operator, 'show_progress')
+    layout.prop(operator, 'profile_import')
+
+
+class ImportKhReComBatch(_ModalImportMixin, bpy.types.Operator,
+                         ImportHelper):
+  """Load several Kingdom Hearts Re:Chain of Memories AZF, GSD and MDL files, or all of them in a directory"""
+  bl_idname = "import_khrecom.batch"
+  bl_label = "Import Kingdom Hearts Re:COM (PS2) Files"
+  bl_options = {'PRESET', 'UNDO'}
+
+  filter_glob: StringProperty(default="*.azf;*.gsd;*.mdl", options={'HIDDEN'})
+
+  files: CollectionProperty(
+      type=bpy.types.OperatorFileListElement,
+      options={'HIDDEN', 'SKIP_SAVE'},
+  )
+
+  directory: StringProperty(
+      subtype='DIR_PATH',
+      options={'HIDDEN', 'SKIP_SAVE'},
+  )
+
+  import_skybox: BoolProperty(
+      name="Import Skybox",
+      description="Import skybox objects and textures of stages.",
+      default=True,
+  )
+
+  ignore_placeholders: BoolProperty(
+      name="Ignore Placeholders",
+      description=
+      "Skip importing placeholder meshes used to mark particle effects.",
+      default=True,
+  )
+
+  import_shadow_model: BoolProperty(
+      name="Import Shadow Models",
+      description="Import models used for shadows.",
+      default=False,
+  )
+
+  use_vertex_color_materials: BoolProperty(
+      name="Use Vertex Color in Materials",
+      description=
+      "Automatically connect baked vertex colors in Blender materials if present. If unchecked, vertex color layers will still be imported for objects.",
+      default=True,
+  )
+
+  use_texture_cache: BoolProperty(
+      name="Use Texture Cache",
+      description=
+      "Store decoded textures in a disk cache and reuse them in later imports of the same texture archives.",
+      default=False,
+  )
+
+  use_scene_cache: BoolProperty(
+      name="Use Scene Cache",
+      description=
+      "Store decoded meshes, bones and placements in a disk cache and load them from there in later imports of the same unchanged files.",
+      default=False,
+  )
+
+  use_asset_catalog: BoolProperty(
+      name="Use Asset Catalog",
+      description=
+      "Look up texture archives and gimmick models in a catalog of the extracted files instead of listing directories and reading archive headers. Directories are added to the catalog on first use and updated when their files change.",
+      default=False,
+  )
+
+  weld_vertices: BoolProperty(
+      name="Weld Vertices",
+      description=
+      "Merge vertices with identical positions, normals, colors, UVs and bone weights, such as those shared by adjacent triangle strips.",
+      default=False,
+  )
+
+  use_collection_instances: BoolProperty(
+      name="Use Collection Instances",
+      description=
+      "Create one collection per unique stage mesh or gimmick and instance it for each placement, instead of copying its objects.",
+      default=False,
+  )
+
+  show_progress: BoolProperty(
+      name="Show Progress",
+      description=
+      "Decode files in the background and build Blender data in small steps, showing progress in the status bar. Press Esc to cancel the import.",
+      default=True,
+  )
+
+  profile_import: BoolProperty(
+      name="Profile Import",
+      description=
+      "Record the time spent in each import phase, bytes read, element counts and peak memory. A JSON report is written to the temporary directory and a summary is shown after import.",
+      default=False,
+  )
+
+  def get_import_keywords(self):
+    from . import import_batch
+
+    keywords = self.as_keywords(ignore=_IGNORED_PROPERTIES +
+                                ("filepath", "files", "directory"))
+    filenames = [file.name for file in self.files if file.name]
+    if filenames:
+      keywords['filepaths'] = [
+          os.path.join(self.directory, filename) for filename in filenames
+      ]
+    else:
+      # No files were selected, so import the whole directory.
+      keywords['filepaths'] = import_batch.find_import_files(self.directory)
+    return keywords
+
+  def get_profile_filepath(self):
+    return os.path.normpath(self.directory)
+
+  def execute(self, context):
+    from . import import_batch
+
+    return self.execute_job(context, import_batch)
+
+  def draw(self, context):
+    pass
+
+
+class BATCH_PT_import_options(bpy.types.Panel):
+  bl_space_type = 'FILE_BROWSER'
+  bl_region_type = 'TOOL_PROPS'
+  bl_label = "Import Files"
+  bl_parent_id = "FILE_PT_operator"
+
+  @classmethod
+  def poll(cls, context):
+    sfile = context.space_data
+    operator = sfile.active_operator
+
+    return operator.bl_idname == "IMPORT_KHRECOM_OT_batch"
+
+  def draw(self, context):
+    layout = self.layout
+    layout.use_property_split = True
+    layout.use_property_decorate = False
+
+    sfile = context.space_data
+    operator = sfile.active_operator
+
+    layout.prop(operator, 'import_skybox')
+    layout.prop(operator, 'ignore_placeholders')
+    layout.prop(operator, 'import_shadow_model')
+    layout.prop(operator, 'use_vertex_color_materials')
+    layout.prop(operator, 'use_texture_cache')
+    layout.prop(operator, 'use_scene_cache')
+    layout.prop(operator, 'use_asset_catalog')
+    layout.prop(operator, 'weld_vertices')
+    layout.prop(operator, 'use_collection_instances')
+    layout.prop(operator, 'show_progress')
+    layout.prop(operator, 'profile_import')
+
+
+class KhReComSetLevelOfDetail(bpy.types.Operator):
+  """Switch selected Re:COM stage objects between proxy and full resolution meshes"""
+  bl_idname = "object.khrecom_set_lod"
+  bl_label = "Set Re:COM Level of Detail"
+  bl_options = {'REGISTER', 'UNDO'}
+
+  level: EnumProperty(
+      name="Level",
+      items=(
+          ('FULL', "Full Resolution", "Display the imported mesh data."),
+          ('PROXY', "Proxy", "Display the decimated proxy mesh data."),
+      ),
+      default='FULL',
+  )
+
+  def execute(self, context):
+    objects = set()
+    for obj in context.selected_objects:
+      # Switch the source objects of collection instances.
+      if obj.instance_type == 'COLLECTION' and obj.instance_collection:
+        objects.update(obj.instance_collection.all_objects)
+      else:
+        objects.add(obj)
+
+    count = sum(
+        mesh_parser.set_level_of_detail(obj, self.level == 'PROXY')
+        for obj in objects)
+    self.report({'INFO'}, f'Switched {count} objects')
+    return {'FINISHED'}
+
+
+def menu_func_import(self, context):
+  self.layout.operator(ImportKhReComAzf.bl_idname,
+                       text="Kingdom Hearts Re:COM Stage (.azf)")
+  self.layout.operator(ImportKhReComGsd.bl_idname,
+                       text="Kingdom Hearts Re:COM Stage Gimmicks (.gsd)")
+  self.layout.operator(ImportKhReComMdl.bl_idname,
+                       text="Kingdom Hearts Re:COM Model (.mdl)")
+  self.layout.operator(ImportKhReComBatch.bl_idname,
+                       text="Kingdom Hearts Re:COM Files (.azf/.gsd/.mdl)")
+
+
+classes = (
+    ImportKhReComAzf,
+    ImportKhReComGsd,
+    ImportKhReComMdl,
+    ImportKhReComBatch,
+    AZF_PT_import_options,
+    GSD_PT_import_options,
+    MDL_PT_import_options,
+    BATCH_PT_import_options,
+    KhReComSetLevelOfDetail,
+)
+
+
+def register():
+  for cls in classes:
+    bpy.utils.register_class(cls)
+  mesh_parser.register_properties()
+
+  bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
+
+
+def unregister():
+  mesh_parser.unregister_properties()
+  for cls in classes:
+    bpy.utils.unregister_class(cls)
+
+  bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
@@ -0,0 +1,165 @@
+import collections
+import contextlib
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+try:
+  import resource
+except ImportError:
+  # Not available on Windows.
+  resource = None
+
+DEFAULT_REPORT_DIRECTORY = os.path.join(tempfile.gettempdir(), 'io_kh_recom',
+                                        'profiles')
+
+# Set while a profiling session is running.
+_active_profiler = None
+
+
+# Records wall time per phase and counters such as bytes read or vertex counts
+# for a single import. Phases may be nested; nested phases are reported with
+# their full path, e.g. "decode/vif".
+class Profiler:
+  def __init__(self, name=''):
+    self.name = name
+    # {phase path -> [seconds, calls]}
+    self.phases = collections.OrderedDict()
+    # {counter name -> value}
+    self.counters = collections.OrderedDict()
+    self.total_seconds = 0.0
+    self.peak_memory = None
+    self.max_rss = None
+    self._phase_stack = []
+    self._start_time = None
+    # Seconds spent paused, and the time of the current pause.
+    self._paused_seconds = 0.0
+    self._pause_time = None
+    self._owns_tracemalloc = False
+
+  def start(self):
+    self._start_time = time.perf_counter()
+    # Peak memory is measured with tracemalloc, which slows down allocations
+    # while it is running.
+    if not tracemalloc.is_tracing():
+      tracemalloc.start()
+      self._owns_tracemalloc = True
+    elif hasattr(tracemalloc, 'reset_peak'):
+      tracemalloc.reset_peak()
+
+  def stop(self):
+    self.resume()
+    self.total_seconds = (time.perf_counter() - self._start_time -
+                          self._paused_seconds)
+    self.peak_memory = tracemalloc.get_traced_memory()[1]
+    if self._owns_tracemalloc:
+      tracemalloc.stop()
+      self._owns_tracemalloc = False
+    # Kilobytes on Linux, bytes on macOS.
+    if resource:
+      self.max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+  # Stops the clock of the session and of all open phases until resume() is
+  # called, e.g. while a modal import waits for its next timer event.
+  def pause(self):
+    if self._pause_time is None:
+      self._pause_time = time.perf_counter()
+
+  def resume(self):
+    if self._pause_time is not None:
+      self._paused_seconds += time.perf_counter() - self._pause_time
+      self._pause_time = None
+
+  @contextlib.contextmanager
+  def phase(self, name):
+    self._phase_stack.append(name)
+    path = '/'.join(self._phase_stack)
+    start_time = time.perf_counter()
+    start_paused_seconds = self._paused_seconds
+    try:
+      yield
+    finally:
+      entry = self.phases.setdefault(path, [0.0, 0])
+      entry[0] += (time.perf_counter() - start_time -
+                   (self._paused_seconds - start_paused_seconds))
+      entry[1] += 1
+      self._phase_stack.pop()
+
+  def count(self, name, n=1):
+    self.counters[name] = self.counters.get(name, 0) + n
+
+  def report(self):
+    return {
+        'name': self.name,
+        'total_seconds': self.total_seconds,
+        'peak_memory_bytes': self.peak_memory,
+        'max_rss': self.max_rss,
+        'phases': [{
+            'phase': path,
+            'seconds': seconds,
+            'calls': calls,
+        } for path, (seconds, calls) in self.phases.items()],
+        'counters': dict(self.counters),
+    }
+
+  def write_report(self, filepath):
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    with open(filepath, 'w') as f:
+      json.dump(self.report(), f, indent=2)
+
+  # Returns a short, single-line summary of top-level phases and counters.
+  def summary(self):
+    parts = [f'{self.total_seconds:.2f}s total']
+    parts += [
+        f'{path} {seconds:.2f}s'
+        for path, (seconds, _) in self.phases.items()
+        if '/' not in path
+    ]
+    parts += [f'{value} {name}' for name, value in self.counters.items()]
+    if self.peak_memory is not None:
+      parts.append(f'peak {self.peak_memory / (1024 * 1024):.1f} MiB')
+    return ', '.join(parts)
+
+
+# Returns the default report path for an import of filepath.
+def get_report_path(filepath, directory=DEFAULT_REPORT_DIRECTORY):
+  basename = os.path.basename(filepath)
+  timestamp = time.strftime('%Y%m%d-%H%M%S')
+  return os.path.join(directory, f'{basename}-{timestamp}.json')
+
+
+# Profiles everything run inside the context. Yields the Profiler, or None if
+# enabled is False. The JSON report is written to report_path if given.
+@contextlib.contextmanager
+def session(enabled=True, name='', report_path=None):
+  global _active_profiler
+  if not enabled or _active_profiler:
+    yield None
+    return
+
+  profiler = Profiler(name)
+  _active_profiler = profiler
+  profiler.start()
+  try:
+    yield profiler
+  finally:
+    profiler.stop()
+    _active_profiler = None
+    if report_path:
+      profiler.write_report(report_path)
+
+
+# Times a phase of the active session. Does nothing if profiling is disabled.
+def phase(name):
+  if _active_profiler:
+    return _active_profiler.phase(name)
+  return contextlib.nullcontext()
+
+
+# Adds to a counter of the active session. Does nothing if profiling is
+# disabled.
+def count(name, n=1):
+  if _active_profiler:
+    _active_profiler.count(name, n)
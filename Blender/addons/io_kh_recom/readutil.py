@@ -1,92 +1,232 @@
+import mmap
+import numpy as np
 import os
 import struct
 
+from . import profiling
+
+_INT16 = struct.Struct('<h')
+_UINT16 = struct.Struct('<H')
+_INT32 = struct.Struct('<i')
+_UINT32 = struct.Struct('<I')
+_FLOAT32 = struct.Struct('<f')
+
+# {format string -> struct.Struct}
+_struct_cache = dict()
+
+
+def get_struct(fmt):
+  s = _struct_cache.get(fmt)
+  if s is None:
+    s = _struct_cache[fmt] = struct.Struct(fmt)
+  return s
+
 
 class BinaryFileReader:
   def __init__(self, filepath):
-    self.f = open(filepath, 'rb')
-    self.filesize = os.path.getsize(filepath)
+    self.filepath = filepath
+    with open(filepath, 'rb') as f:
+      self.filesize = os.fstat(f.fileno()).st_size
+      # mmap cannot map empty files.
+      if self.filesize:
+        self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      else:
+        self.buffer = b''
     self.base_offset = 0
+    self._pos = 0
+    # Statistics reported to the active profiling session on close().
+    self.bytes_read = 0
+    self.seek_count = 0
+
+  def close(self):
+    profiling.count('files_opened')
+    profiling.count('bytes_read', self.bytes_read)
+    profiling.count('seeks', self.seek_count)
+    if isinstance(self.buffer, mmap.mmap):
+      try:
+        self.buffer.close()
+      except BufferError:
+        # Arrays created with np.frombuffer() still reference the mapping. It
+        # will be released once they are garbage collected.
+        pass
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
 
   def seek(self, offs):
-    self.f.seek(offs + self.base_offset)
+    self._pos = offs + self.base_offset
+    self.seek_count += 1
 
   def tell(self):
-    return self.f.tell()
+    return self._pos
 
   def set_base_offset(self, offs):
     self.base_offset = offs
 
+  def _unpack(self, s):
+    value = s.unpack_from(self.buffer, self._pos)
+    self._pos += s.size
+    self.bytes_read += s.size
+    return value
+
+  def _unpack_n(self, fmt, n):
+    return self._unpack(get_struct(f'<{n}{fmt}'))
+
+  def read_bytes(self, n):
+    buf = self.buffer[self._pos:self._pos + n]
+    self._pos += len(buf)
+    self.bytes_read += len(buf)
+    return buf
+
+  # Reads n records of a NumPy dtype without copying from the mapped file.
+  def read_array(self, dtype, n):
+    dtype = np.dtype(dtype)
+    arr = np.frombuffer(self.buffer, dtype=dtype, count=n, offset=self._pos)
+    self._pos += arr.nbytes
+    self.bytes_read += arr.nbytes
+    return arr
+
   def read_nuint8(self, n):
-    return list(self.f.read(n))
+    return list(self.read_bytes(n))
 
   def read_int16(self):
-    return struct.unpack('<h', self.f.read(2))[0]
+    return self._unpack(_INT16)[0]
 
   def read_nint16(self, n):
-    return struct.unpack('<' + 'h' * n, self.f.read(n * 2))
+    return self._unpack_n('h', n)
 
   def read_uint16(self):
-    return struct.unpack('<H', self.f.read(2))[0]
+    return self._unpack(_UINT16)[0]
 
   def read_nuint16(self, n):
-    return struct.unpack('<' + 'H' * n, self.f.read(n * 2))
+    return self._unpack_n('H', n)
 
   def read_int32(self):
-    return struct.unpack('<i', self.f.read(4))[0]
+    return self._unpack(_INT32)[0]
 
   def read_nint32(self, n):
-    return struct.unpack('<' + 'i' * n, self.f.read(n * 4))
+    return self._unpack_n('i', n)
 
   def read_uint32(self):
-    return struct.unpack('<I', self.f.read(4))[0]
+    return self._unpack(_UINT32)[0]
 
   def read_nuint32(self, n):
-    return struct.unpack('<' + 'I' * n, self.f.read(n * 4))
+    return self._unpack_n('I', n)
 
   def read_float32(self):
-    return struct.unpack('<f', self.f.read(4))[0]
+    return self._unpack(_FLOAT32)[0]
 
   def read_nfloat32(self, n):
-    return struct.unpack('<' + 'f' * n, self.f.read(n * 4))
+    return self._unpack_n('f', n)
 
   # Reads max_len bytes and returns the first zero-terminated string.
   def read_string(self, max_len):
-    buf = self.f.read(max_len)
-    offs = 0
-    while offs < len(buf) and buf[offs] != 0:
-      offs += 1
-    return buf[:offs].decode('ascii')
+    buf = self.read_bytes(max_len)
+    offs = buf.find(b'\0')
+    if offs >= 0:
+      buf = buf[:offs]
+    return buf.decode('ascii')
 
   def skip(self, length):
-    self.f.read(length)
+    self._pos = max(self._pos, min(self._pos + length, self.filesize))
+
+
+# Layout of a 0x20 byte rsrc header entry. Entries with a negative size store
+# the offset first, followed by a longer filename.
+_RSRC_ENTRY_DTYPE = np.dtype({
+    'names': ['short_name', 'short_offset', 'long_offset', 'long_name', 'size'],
+    'formats': ['S16', '<u4', '<u4', 'S20', '<i4'],
+    'offsets': [0x0, 0x10, 0x0, 0x4, 0x1C],
+    'itemsize': 0x20
+})
+
+# Number of entries to scan at a time for the terminating entry.
+_RSRC_SCAN_COUNT = 0x100
+
+_MAX_RSRC_INDEX_CACHE_SIZE = 0x100
+
+# {(filepath, file size, mtime, base offset) -> RsrcIndex}
+_rsrc_index_cache = dict()
+
+
+# Array-backed index of the files in an rsrc header.
+class RsrcIndex:
+  def __init__(self, names, offsets, sizes):
+    self.names = names
+    self.offsets = offsets
+    self.sizes = sizes
+    # {filename -> entry index}, built on first lookup.
+    self._name_map = None
+
+  def __len__(self):
+    return len(self.names)
+
+  # Returns a tuple of the form (filename, byte_offs, byte_size).
+  def __getitem__(self, index):
+    return (self.names[index].decode('ascii'), int(self.offsets[index]),
+            int(self.sizes[index]))
+
+  def __iter__(self):
+    for i in range(len(self.names)):
+      yield self[i]
+
+  # Returns the entry index of a filename, or -1 if it does not exist. If a
+  # filename appears more than once, the first entry is returned.
+  def find(self, filename):
+    if self._name_map is None:
+      names = np.char.decode(self.names, 'ascii').tolist()
+      self._name_map = dict(zip(reversed(names), range(len(names) - 1, -1, -1)))
+    return self._name_map.get(filename, -1)
+
+
+# Reads the rsrc header at the base offset of a file in one bulk read. Indexes
+# are cached for as long as the file is unchanged.
+def read_rsrc_index(f):
+  stat = os.stat(f.filepath)
+  key = (os.path.abspath(f.filepath), stat.st_size, stat.st_mtime_ns,
+         f.base_offset)
+  rsrc_index = _rsrc_index_cache.get(key)
+  if rsrc_index is not None:
+    return rsrc_index
+
+  f.seek(0)
+  max_count = max(0, f.filesize - f.tell()) // _RSRC_ENTRY_DTYPE.itemsize
+  entries = f.read_array(_RSRC_ENTRY_DTYPE, max_count)
+
+  # The header ends at the first entry with a size of zero.
+  count = max_count
+  for scan_offs in range(0, max_count, _RSRC_SCAN_COUNT):
+    zero_sizes = np.flatnonzero(
+        entries['size'][scan_offs:scan_offs + _RSRC_SCAN_COUNT] == 0)
+    if len(zero_sizes):
+      count = scan_offs + zero_sizes[0]
+      break
+  # Copy entries so that the index does not keep the file mapped.
+  entries = entries[:count].copy()
+
+  is_long = entries['size'] < 0
+  names = np.where(is_long, entries['long_name'], entries['short_name'])
+  # Clear everything after the first zero byte of each name.
+  name_bytes = names.view(np.uint8).reshape(len(names), names.dtype.itemsize)
+  is_name_byte = np.cumprod(name_bytes != 0, axis=1).astype(bool)
+  names = np.where(is_name_byte, name_bytes, 0).astype(np.uint8)
+  names = names.view(entries['long_name'].dtype).ravel()
+  offsets = np.where(is_long, entries['long_offset'], entries['short_offset'])
+  sizes = entries['size'].astype(np.int64) & 0x7FFFFFFF
+  rsrc_index = RsrcIndex(names, offsets, sizes)
+
+  if len(_rsrc_index_cache) >= _MAX_RSRC_INDEX_CACHE_SIZE:
+    del _rsrc_index_cache[next(iter(_rsrc_index_cache))]
+  _rsrc_index_cache[key] = rsrc_index
+  return rsrc_index
 
 
 # Returns a list of tuples of the form (filename, byte_offs, byte_size).
 def read_rsrc_header(f):
-  files = []
-
-  index = 0
-  f.seek(0)
-  while True:
-    base_offs = index * 0x20
-    f.seek(base_offs + 0x1C)
-    byte_size = f.read_int32()
-    if not byte_size:
-      break
-    elif byte_size < 0:
-      byte_size &= 0x7FFFFFFF
-      f.seek(base_offs)
-      byte_offs = f.read_uint32()
-      filename = f.read_string(0x14)
-    else:
-      f.seek(base_offs)
-      filename = f.read_string(0x10)
-      byte_offs = f.read_uint32()
-    files.append((filename, byte_offs, byte_size))
-    index += 1
-
-  return files
+  return list(read_rsrc_index(f))
 
 
 # Skip PS4 header if it exists.
@@ -0,0 +1,336 @@
+import hashlib
+import json
+import numpy as np
+import os
+import struct
+import tempfile
+
+from . import cacheutil
+from . import decode_azf
+from . import decode_mdl
+from . import mesh_decoder
+from . import profiling
+from . import texture_cache
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(tempfile.gettempdir(), 'io_kh_recom',
+                                       'scenes')
+DEFAULT_MAX_CACHE_SIZE = 1024 * 1024 * 1024
+
+# Incremented whenever the file layout or the decoded data changes, so that
+# entries written by older versions are never loaded.
+FORMAT_VERSION = 1
+
+# Magic, format version and metadata size.
+_HEADER = struct.Struct('<4sII')
+_MAGIC = b'KHSC'
+_ALIGNMENT = 0x10
+
+
+def _align(offs):
+  return (offs + _ALIGNMENT - 1) & ~(_ALIGNMENT - 1)
+
+
+def _dtype_to_json(dtype):
+  if dtype.names is None:
+    return dtype.str
+  return [[name, dtype.fields[name][0].str] for name in dtype.names]
+
+
+def _dtype_from_json(descr):
+  if isinstance(descr, str):
+    return np.dtype(descr)
+  return np.dtype([(name, fmt) for name, fmt in descr])
+
+
+# Collects arrays for a cache file. Each array is stored once, aligned, and
+# referenced from the metadata by its index.
+class _ArrayWriter:
+  def __init__(self):
+    # [(offset, array)]
+    self.arrays = []
+    # [[offset, dtype, shape]]
+    self.descs = []
+    self.size = 0
+
+  def add(self, array):
+    if array is None:
+      return None
+    array = np.ascontiguousarray(array)
+    offs = _align(self.size)
+    self.arrays.append((offs, array))
+    self.descs.append([offs, _dtype_to_json(array.dtype), list(array.shape)])
+    self.size = offs + array.nbytes
+    return len(self.descs) - 1
+
+
+class _Encoder:
+  def __init__(self):
+    self.writer = _ArrayWriter()
+    # {id(ArmatureData) -> armature index}
+    self._armature_map = dict()
+    self.armatures = []
+
+  def add_armature(self, armature):
+    if armature is None:
+      return None
+    if id(armature) not in self._armature_map:
+      self._armature_map[id(armature)] = len(self.armatures)
+      self.armatures.append({
+          'bone_names': armature.bone_names,
+          'parent_indices': armature.parent_indices,
+          'bone_matrices': self.writer.add(armature.bone_matrices),
+      })
+    return self._armature_map[id(armature)]
+
+  def encode_submesh(self, submesh):
+    add = self.writer.add
+    return {
+        'name': submesh.name,
+        'texture_index': submesh.texture_index,
+        'is_translucent': submesh.is_translucent,
+        'invert_normals': submesh.invert_normals,
+        'has_uv': submesh.has_uv,
+        'has_vcol': submesh.has_vcol,
+        'vertex_count': submesh.vertex_count,
+        'vtx': add(submesh.vtx),
+        'vn': add(submesh.vn),
+        'uv': add(submesh.uv),
+        'vcol': add(submesh.vcol),
+        'tri': add(submesh.tri),
+        'influences': add(submesh.influences),
+    }
+
+  def encode_model(self, model):
+    if model is None:
+      return None
+    return {
+        'basename': model.basename,
+        'armature': self.add_armature(model.armature),
+        'texture_names': model.texture_names,
+        'submeshes': [
+            self.encode_submesh(submesh) for submesh in model.submeshes
+        ],
+    }
+
+  def encode(self, data):
+    if isinstance(data, decode_azf.StageData):
+      transforms = self.writer.add(
+          np.array([instance.transform for instance in data.instances
+                   ]).reshape(-1, 4, 4))
+      return {
+          'type': 'stage',
+          'basename': data.basename,
+          'meshes': [[mesh_index, self.encode_model(model)]
+                     for mesh_index, model in data.meshes.items()],
+          'instances': [[instance.name, instance.mesh_index, instance.is_skybox]
+                        for instance in data.instances],
+          'transforms': transforms,
+      }
+    if isinstance(data, decode_mdl.MdlData):
+      return {
+          'type': 'mdl',
+          'basename': data.basename,
+          'armature': self.add_armature(data.armature),
+          'models': [self.encode_model(model) for model in data.models],
+      }
+    raise TypeError(f'Cannot cache {type(data).__name__}')
+
+
+class _Decoder:
+  def __init__(self, arrays, armatures):
+    self.arrays = arrays
+    self.armatures = []
+    for armature_meta in armatures:
+      armature = mesh_decoder.ArmatureData()
+      armature.bone_names = armature_meta['bone_names']
+      armature.parent_indices = armature_meta['parent_indices']
+      armature.bone_matrices = self.get_array(armature_meta['bone_matrices'])
+      self.armatures.append(armature)
+
+  def get_array(self, index):
+    if index is None:
+      return None
+    return self.arrays[index]
+
+  def get_armature(self, index):
+    if index is None:
+      return None
+    return self.armatures[index]
+
+  def decode_submesh(self, meta):
+    submesh = mesh_decoder.SubmeshData(meta['name'], meta['texture_index'],
+                                       meta['is_translucent'],
+                                       meta['invert_normals'])
+    submesh.has_uv = meta['has_uv']
+    submesh.has_vcol = meta['has_vcol']
+    submesh.vertex_count = meta['vertex_count']
+    for name in ('vtx', 'vn', 'uv', 'vcol', 'tri', 'influences'):
+      setattr(submesh, name, self.get_array(meta[name]))
+    return submesh
+
+  def decode_model(self, meta):
+    if meta is None:
+      return None
+    model = mesh_decoder.ModelData(meta['basename'],
+                                   self.get_armature(meta['armature']),
+                                   meta['texture_names'])
+    model.submeshes = [
+        self.decode_submesh(submesh_meta) for submesh_meta in meta['submeshes']
+    ]
+    return model
+
+  def decode(self, meta):
+    if meta['type'] == 'stage':
+      stage = decode_azf.StageData(meta['basename'])
+      for mesh_index, model_meta in meta['meshes']:
+        stage.meshes[mesh_index] = self.decode_model(model_meta)
+      transforms = self.get_array(meta['transforms'])
+      stage.instances = [
+          decode_azf.InstanceData(name, mesh_index, transform, is_skybox)
+          for (name, mesh_index,
+               is_skybox), transform in zip(meta['instances'], transforms)
+      ]
+      return stage
+
+    mdl = decode_mdl.MdlData(meta['basename'])
+    mdl.armature = self.get_armature(meta['armature'])
+    mdl.models = [self.decode_model(model_meta) for model_meta in meta['models']]
+    return mdl
+
+
+# Writes decoded StageData or MdlData to a file object. The file starts with a
+# header and JSON metadata that describes the objects, followed by the flat
+# vertex, index, UV, color, weight and transform arrays they reference.
+def write_scene(f, data):
+  encoder = _Encoder()
+  meta = encoder.encode(data)
+  meta_bytes = json.dumps({
+      'scene': meta,
+      'armatures': encoder.armatures,
+      'arrays': encoder.writer.descs,
+  }).encode('utf-8')
+
+  f.write(_HEADER.pack(_MAGIC, FORMAT_VERSION, len(meta_bytes)))
+  f.write(meta_bytes)
+  data_offs = _align(_HEADER.size + len(meta_bytes))
+  pos = _HEADER.size + len(meta_bytes)
+  for offs, array in encoder.writer.arrays:
+    f.write(bytes(data_offs + offs - pos))
+    f.write(array.reshape(-1).view(np.uint8))
+    pos = data_offs + offs + array.nbytes
+
+
+# Reads a file written by write_scene(). Arrays are copy-on-write views of a
+# memory mapping of the file, so only the pages that are used are read.
+# Returns None if the file was written by a different format version.
+def read_scene(filepath):
+  buffer = np.memmap(filepath, mode='c')
+  magic, version, meta_size = _HEADER.unpack_from(buffer)
+  if magic != _MAGIC or version != FORMAT_VERSION:
+    return None
+  meta = json.loads(bytes(buffer[_HEADER.size:_HEADER.size + meta_size]))
+
+  data_offs = _align(_HEADER.size + meta_size)
+  arrays = [
+      np.ndarray(shape,
+                 dtype=_dtype_from_json(descr),
+                 buffer=buffer,
+                 offset=data_offs + offs)
+      for offs, descr, shape in meta['arrays']
+  ]
+  return _Decoder(arrays, meta['armatures']).decode(meta['scene'])
+
+
+# Disk cache of decoded stages and MDL files. Each entry is keyed by the content
+# hash of its source file and the decoding options, so modified files never hit
+# stale entries. Least recently used entries are evicted once the cache exceeds
+# max_size bytes.
+#
+# Cached data may be shared between imports and must not be modified.
+class SceneCache:
+  def __init__(self,
+               directory=DEFAULT_CACHE_DIRECTORY,
+               max_size=DEFAULT_MAX_CACHE_SIZE):
+    self.directory = directory
+    self.max_size = max_size
+    os.makedirs(directory, exist_ok=True)
+
+  def make_key(self, filepath, *options):
+    key = json.dumps([
+        FORMAT_VERSION,
+        texture_cache.get_archive_hash(filepath),
+        os.path.basename(filepath), options
+    ])
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=20).hexdigest()
+
+  def _get_path(self, key):
+    return os.path.join(self.directory, f'{key}.khsc')
+
+  # Returns the cached StageData or MdlData, or None on a miss.
+  def get(self, key):
+    path = self._get_path(key)
+    try:
+      data = read_scene(path)
+      # Mark the entry as recently used.
+      os.utime(path)
+    except (OSError, ValueError, KeyError, TypeError, struct.error):
+      return None
+    return data
+
+  def put(self, key, data):
+    cacheutil.write_atomic(self._get_path(key), lambda f: write_scene(f, data))
+
+  # Same as decode_azf.decode_azf(), but loads the stage from the cache if the
+  # file was decoded with the same options before.
+  def decode_azf(self,
+                 filepath,
+                 import_skybox=True,
+                 ignore_placeholders=False,
+                 instance_filter=None,
+                 weld_vertices=False):
+    filter_key = None
+    if instance_filter:
+      filter_key = [
+          instance_filter.skybox_only,
+          sorted(instance_filter.mesh_indices)
+          if instance_filter.mesh_indices is not None else None,
+          [list(corner) for corner in instance_filter.bounds]
+          if instance_filter.bounds else None
+      ]
+    key = self.make_key(filepath, 'azf', import_skybox, ignore_placeholders,
+                        filter_key, weld_vertices)
+    stage = self.get(key)
+    if stage is not None:
+      profiling.count('scenes_cached')
+    else:
+      stage = decode_azf.decode_azf(filepath, import_skybox,
+                                    ignore_placeholders, instance_filter,
+                                    weld_vertices)
+      self.put(key, stage)
+      self.evict()
+    return stage
+
+  # Same as decode_mdl.decode_mdl(), but loads the file from the cache if it was
+  # decoded with the same options before.
+  def decode_mdl(self,
+                 filepath,
+                 import_shadow_model=False,
+                 model_indices=None,
+                 weld_vertices=False):
+    if model_indices is not None:
+      model_indices = sorted(set(model_indices))
+    key = self.make_key(filepath, 'mdl', import_shadow_model, model_indices,
+                        weld_vertices)
+    mdl = self.get(key)
+    if mdl is not None:
+      profiling.count('scenes_cached')
+    else:
+      mdl = decode_mdl.decode_mdl(filepath, import_shadow_model, model_indices,
+                                  weld_vertices)
+      self.put(key, mdl)
+      self.evict()
+    return mdl
+
+  # Removes least recently used entries until the cache fits in max_size.
+  def evict(self):
+    cacheutil.evict_lru(self.directory, '.khsc', self.max_size)
@@ -0,0 +1,68 @@
+import hashlib
+import numpy as np
+import os
+import tempfile
+
+from . import cacheutil
+from . import readutil
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(tempfile.gettempdir(), 'io_kh_recom',
+                                       'textures')
+DEFAULT_MAX_CACHE_SIZE = 512 * 1024 * 1024
+
+# {(filepath, file size, mtime) -> content hash}
+_archive_hash_map = dict()
+
+
+# Returns a hash of the full contents of a file. Hashes are remembered for as
+# long as the file is unchanged.
+def get_archive_hash(filepath):
+  stat = os.stat(filepath)
+  key = (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+  archive_hash = _archive_hash_map.get(key)
+  if archive_hash is None:
+    with readutil.BinaryFileReader(filepath) as f:
+      archive_hash = hashlib.blake2b(f.buffer, digest_size=20).hexdigest()
+    _archive_hash_map[key] = archive_hash
+  return archive_hash
+
+
+# Disk cache of decoded RGBA pixel buffers. Each entry is keyed by the content
+# hash of its source archive, so modified archives never hit stale entries.
+# Least recently used entries are evicted once the cache exceeds max_size bytes.
+class TextureCache:
+  def __init__(self,
+               directory=DEFAULT_CACHE_DIRECTORY,
+               max_size=DEFAULT_MAX_CACHE_SIZE):
+    self.directory = directory
+    self.max_size = max_size
+    os.makedirs(directory, exist_ok=True)
+
+  def make_key(self, filepath, texture_name, offs):
+    key = f'{get_archive_hash(filepath)}:{texture_name}:{offs}'
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=20).hexdigest()
+
+  def _get_path(self, key):
+    return os.path.join(self.directory, f'{key}.npy')
+
+  # Returns a tuple of the form (width, height, pixels), or None on a miss.
+  def get(self, key):
+    path = self._get_path(key)
+    try:
+      pixels = np.load(path)
+      # Mark the entry as recently used.
+      os.utime(path)
+    except (OSError, ValueError):
+      return None
+    if pixels.ndim != 3:
+      return None
+    height, width, _ = pixels.shape
+    return width, height, pixels.reshape(-1)
+
+  def put(self, key, width, height, pixels):
+    pixels = np.asarray(pixels, dtype=np.float32).reshape(height, width, 4)
+    cacheutil.write_atomic(self._get_path(key), lambda f: np.save(f, pixels))
+
+  # Removes least recently used entries until the cache fits in max_size.
+  def evict(self):
+    cacheutil.evict_lru(self.directory, '.npy', self.max_size)
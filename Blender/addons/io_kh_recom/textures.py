@@ -0,0 +1,233 @@
+import collections
+import concurrent.futures
+import multiprocessing
+import numpy as np
+import os
+import sys
+
+from . import readutil
+
+# Minimum total byte size of textures to decode before starting worker
+# processes. Starting workers takes about 0.3 s before the first result, while
+# 8-bit textures decode at about 24 ms/MiB in-process. Each MiB decodes to
+# 16 MiB of float32 pixels that workers send back, which costs the importing
+# process at least 4 ms/MiB to unpickle. With 4 to 8 workers, this puts the
+# break-even at roughly 25 to 30 MiB. test_decode_textures compares both paths.
+MIN_PARALLEL_DECODE_SIZE = 0x2000000
+
+
+class ImageImportError(Exception):
+  pass
+
+
+# Maps 8-bit pixel indices to CLUT indices by swapping bits 4 and 5.
+_CLUT_SWIZZLE = np.array(
+    [((p >> 1) & 0x8) | ((p << 1) & 0x10) | (p & 0xE7) for p in range(256)],
+    dtype=np.uint8)
+
+_CLUT_SCALE = np.array((0xFF, 0xFF, 0xFF, 0x80), dtype=np.float32)
+
+
+# Decodes the first image of a TIM2 file. Returns a tuple of the form
+# (width, height, pixels), where pixels is a flat float32 RGBA array stored
+# bottom row first, or None if the file is not a TIM2 image.
+def decode_tim2(f, offs, texture_name):
+  f.seek(offs)
+  if f.read_uint32() != 0x324D4954:  # "TIM2"
+    return None
+  f.skip(2)
+  image_count = f.read_uint16()
+
+  # Parse first image header
+  f.seek(offs + 0x18)
+  image_data_size = f.read_uint32()
+  _, color_count = f.read_nuint16(2)
+  _, mipmap_count, _, image_format = f.read_nuint8(4)
+  width, height = f.read_nuint16(2)
+
+  image_data_offs = offs + 0x10 + image_count * 0x30
+  image_data_offs += (mipmap_count - 1) * 0x10
+  f.seek(image_data_offs)
+  image = f.read_array(np.uint8, image_data_size)
+  clut = f.read_array(np.uint8, color_count * 4).reshape(-1, 4) / _CLUT_SCALE
+
+  if image_format == 0x5:  # 8-bit indexed
+    indices = _CLUT_SWIZZLE[image[:width * height]]
+  elif image_format == 0x4:  # 4-bit indexed
+    indices = np.stack((image & 0xF, image >> 4), axis=-1).ravel()
+    indices = indices[:width * height]
+  else:
+    raise ImageImportError(
+        f'Unhandled image pixel format {image_format} for texture {texture_name}'
+    )
+
+  # Pre-flip the image for it to export correctly.
+  pixels = clut[indices].reshape(height, width, 4)[::-1]
+  return width, height, np.ascontiguousarray(pixels, dtype=np.float32).ravel()
+
+
+TextureEntry = collections.namedtuple('TextureEntry',
+                                      ['filepath', 'offset', 'size'])
+
+
+# Returns .RTM/.VTM archives in a directory that are named basename or start
+# with one of the given lowercase prefixes. If filenames is given, it is used
+# instead of listing the directory.
+def find_texture_archives(directory,
+                          basename=None,
+                          prefixes=(),
+                          filenames=None):
+  if filenames is None:
+    filenames = os.listdir(directory)
+  texture_files = []
+  for filename in filenames:
+    name, ext = os.path.splitext(filename)
+    if ext.lower() not in ('.rtm', '.vtm'):
+      continue
+    if ((basename and name.lower() == basename.lower()) or
+        name.lower().startswith(prefixes)):
+      texture_files.append(os.path.join(directory, filename))
+  return texture_files
+
+
+def open_texture_archive(filepath):
+  f = readutil.BinaryFileReader(filepath)
+  readutil.maybe_skip_ps4_header(f)
+  return f
+
+
+# Maps texture names to their location in .RTM/.VTM archives. If an
+# AssetCatalog is given, directory listings and archive headers are looked up
+# in the catalog instead of being read from disk.
+class TextureIndex:
+  def __init__(self, catalog=None):
+    self.catalog = catalog
+    # [(archive filepath, RsrcIndex)] in the order they were added.
+    self._archives = []
+    # {texture name -> TextureEntry, or None if not found}
+    self._entries = dict()
+    # {directory -> [filenames]}
+    self._listings = dict()
+
+  # Looks up a texture in each archive. If a texture name appears in several
+  # archives, the first one added wins.
+  def get(self, texture_name):
+    if texture_name in self._entries:
+      return self._entries[texture_name]
+
+    entry = None
+    for filepath, rsrc_index in self._archives:
+      # Filenames in archives may omit the extension.
+      indices = [rsrc_index.find(f'{texture_name}.tm2')]
+      if texture_name[-4:] != '.tm2':
+        indices.append(rsrc_index.find(texture_name))
+      indices = [i for i in indices if i >= 0]
+      if indices:
+        _, byte_offs, byte_size = rsrc_index[min(indices)]
+        entry = TextureEntry(filepath, byte_offs, byte_size)
+        break
+
+    self._entries[texture_name] = entry
+    return entry
+
+  # Same as find_texture_archives(), but lists each directory only once, so
+  # that imports sharing this index do not rescan the same directory.
+  def find_archives(self, directory, basename=None, prefixes=()):
+    filenames = self._listings.get(directory)
+    if filenames is None:
+      if self.catalog:
+        filenames = self.catalog.list_directory(directory)
+      else:
+        filenames = os.listdir(directory)
+      self._listings[directory] = filenames
+    return find_texture_archives(directory, basename, prefixes, filenames)
+
+  def add_archives(self, filepaths):
+    for filepath in filepaths:
+      self.add_archive(filepath)
+
+  # Reads the rsrc header of an archive without decoding any textures.
+  def add_archive(self, filepath):
+    if any(filepath == archive_path for archive_path, _ in self._archives):
+      return
+
+    rsrc_index = self.catalog.get_rsrc_index(filepath) if self.catalog else None
+    if rsrc_index is None:
+      with open_texture_archive(filepath) as f:
+        rsrc_index = readutil.read_rsrc_index(f)
+    self._archives.append((filepath, rsrc_index))
+    # Textures that were not found before may exist in the new archive.
+    self._entries = {
+        texture_name: entry
+        for texture_name, entry in self._entries.items()
+        if entry
+    }
+
+
+# Opens an archive and decodes a single texture. Runs in worker processes.
+def decode_texture_file(filepath, offs, size, texture_name):
+  with open_texture_archive(filepath) as f:
+    return decode_tim2(f, offs, texture_name)
+
+
+def _make_executor(max_workers, executable=None):
+  ctx = multiprocessing.get_context('spawn')
+  if executable:
+    ctx.set_executable(executable)
+  return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                mp_context=ctx)
+
+
+# Shuts down an executor without waiting for pending or running futures.
+def _shutdown_executor(executor, futures):
+  for future in futures:
+    future.cancel()
+  if sys.version_info >= (3, 9):
+    executor.shutdown(wait=False, cancel_futures=True)
+  else:
+    executor.shutdown(wait=False)
+
+
+# Decodes a list of (filepath, offset, size, texture name) jobs. Yields a tuple of
+# the form (texture name, decoded) for each job, where decoded is the result of
+# decode_tim2(). Jobs are spread across worker processes when there are enough
+# of them; the Python executable for workers can be given with executable.
+def decode_textures(jobs, executable=None, max_workers=None):
+  jobs = list(jobs)
+  if not max_workers:
+    max_workers = os.cpu_count() or 1
+  max_workers = min(max_workers, len(jobs))
+
+  done_count = 0
+  decode_size = sum(job[2] for job in jobs)
+  if max_workers > 1 and decode_size >= MIN_PARALLEL_DECODE_SIZE:
+    executor = None
+    futures = []
+    try:
+      executor = _make_executor(max_workers, executable)
+      futures = [executor.submit(decode_texture_file, *job) for job in jobs]
+      for job, future in zip(jobs, futures):
+        yield job[3], future.result()
+        done_count += 1
+      return
+    except (OSError, ValueError,
+            concurrent.futures.BrokenExecutor) as err:
+      # Decode any remaining textures in this process.
+      print(f'Texture decoding workers failed: {err}')
+    finally:
+      # Do not wait for queued textures if the caller stopped early, e.g.
+      # because the import was cancelled.
+      if executor:
+        _shutdown_executor(executor, futures)
+
+  # {archive filepath -> BinaryFileReader}
+  archives = dict()
+  try:
+    for filepath, offs, _, texture_name in jobs[done_count:]:
+      f = archives.get(filepath)
+      if not f:
+        f = archives[filepath] = open_texture_archive(filepath)
+      yield texture_name, decode_tim2(f, offs, texture_name)
+  finally:
+    for f in archives.values():
+      f.close()
@@ -0,0 +1,46 @@
+import math
+import numpy as np
+
+
+def rotation_matrix_x(angle):
+  c, s = math.cos(angle), math.sin(angle)
+  return np.array([[1, 0, 0, 0], [0, c, -s, 0], [0, s, c, 0], [0, 0, 0, 1]])
+
+
+# Rotates the game's Y-up coordinate system into Blender's Z-up system.
+WORLD_TRANSFORM = rotation_matrix_x(math.radians(90.0))
+
+
+# Returns (n, 3, 3) rotation matrices for (n, 3) XYZ Euler angles, matching
+# mathutils.Euler.to_matrix().
+def euler_to_matrices(rot):
+  rot = np.asarray(rot, dtype=np.float64).reshape(-1, 3)
+  cx, cy, cz = np.cos(rot).T
+  sx, sy, sz = np.sin(rot).T
+
+  matrices = np.empty((len(rot), 3, 3))
+  matrices[:, 0, 0] = cy * cz
+  matrices[:, 0, 1] = sy * sx * cz - cx * sz
+  matrices[:, 0, 2] = sy * cx * cz + sx * sz
+  matrices[:, 1, 0] = cy * sz
+  matrices[:, 1, 1] = sy * sx * sz + cx * cz
+  matrices[:, 1, 2] = sy * cx * sz - sx * cz
+  matrices[:, 2, 0] = -sy
+  matrices[:, 2, 1] = cy * sx
+  matrices[:, 2, 2] = cy * cx
+  return matrices
+
+
+# Computes WORLD_TRANSFORM @ T @ R @ S for (n, 3) arrays of positions, XYZ
+# Euler angles and optional scales. Returns an (n, 4, 4) array.
+def compose_transforms(pos, rot, scale=None):
+  pos = np.asarray(pos, dtype=np.float64).reshape(-1, 3)
+  matrices = np.zeros((len(pos), 4, 4))
+  matrices[:, :3, :3] = euler_to_matrices(rot)
+  if scale is not None:
+    # Scaling the columns of R is equivalent to R @ S.
+    matrices[:, :3, :3] *= np.asarray(scale,
+                                      dtype=np.float64).reshape(-1, 1, 3)
+  matrices[:, :3, 3] = pos
+  matrices[:, 3, 3] = 1.0
+  return WORLD_TRANSFORM @ matrices
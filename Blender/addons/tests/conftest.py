@@ -0,0 +1,45 @@
+# Shared fixtures for the decoding tests and benchmarks.
+#
+# Run from the repository root or the Blender/addons directory with a Python 3
+# installation that has NumPy, pytest and pytest-benchmark:
+#
+#   python -m pytest Blender/addons/tests
+#   python -m pytest Blender/addons/tests --benchmark-autosave
+#   python -m pytest Blender/addons/tests --benchmark-compare
+#
+# Benchmarks are skipped if pytest-benchmark is not installed.
+
+import os
+import pytest
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+import synthetic
+
+VERTEX_COUNT = 20000
+INSTANCE_COUNT = 256
+TEXTURE_SIZE = 256
+TEXTURE_COUNT = 4
+PLACEMENT_COUNT = 32
+
+
+def pytest_collection_modifyitems(config, items):
+  if config.pluginmanager.hasplugin('benchmark'):
+    return
+  skip = pytest.mark.skip(reason='pytest-benchmark is not installed')
+  for item in items:
+    if 'benchmark' in getattr(item, 'fixturenames', ()):
+      item.add_marker(skip)
+
+
+# Paths written by synthetic.write_fixtures(), shared by all tests.
+@pytest.fixture(scope='session')
+def fixture_paths(tmp_path_factory):
+  return synthetic.write_fixtures(str(tmp_path_factory.mktemp('stage')),
+                                  vertex_count=VERTEX_COUNT,
+                                  instance_count=INSTANCE_COUNT,
+                                  texture_size=TEXTURE_SIZE,
+                                  texture_count=TEXTURE_COUNT,
+                                  placement_count=PLACEMENT_COUNT)
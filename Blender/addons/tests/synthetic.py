@@ -0,0 +1,485 @@
+# Generates synthetic but structurally valid .AZF, .MDL, .GSD and .RTM files
+# for the tests and benchmarks, without relying on game data.
+#
+# Record layouts are written out by hand from the file formats instead of
+# being shared with the decoders, so that a layout error in a decoder is not
+# repeated here.
+#
+# Sample usage (from the Blender/addons/tests directory):
+#
+#   python synthetic.py C:\\path\\to\\output --vertices 20000
+#
+# The output directory mimics an extracted stage folder: a stage with its own
+# texture archive, gimmick placements, and the gimmick models and textures
+# they reference.
+
+import argparse
+import collections
+import numpy as np
+import os
+import struct
+
+# Vertex layouts of the generated render modes, as tuples of the form
+# (has normal, color format, has UV). Colors are stored as 4 floats ('f') or 4
+# unsigned ints ('I'), or not at all (None).
+VERTEX_LAYOUTS = {
+    0x10: (False, None, False),
+    0x6: (False, None, True),
+    0x2: (True, None, False),
+    0x4009: (False, 'f', False),
+    0x0: (False, 'I', True),
+    0x406: (False, 'f', True),
+    0x406E: (True, 'f', True),
+    0x4205: (False, None, True),
+}
+# One render mode per vertex layout.
+RENDER_MODES = (0x10, 0x6, 0x2, 0x4009, 0x0, 0x406, 0x406E)
+TEXTURED_RENDER_MODES = tuple(
+    mode for mode in RENDER_MODES if VERTEX_LAYOUTS[mode][2])
+MAX_VERTEX_INFLUENCES = 9
+
+# Flag (0x0), weight (0x4), split index (0x8), position (0x10) and bone index
+# (0x1E) of a vertex record, followed by one quadword for each of the normal,
+# color and UV. The last 4 bytes of the UV quadword hold the texture index.
+_VERTEX_RECORD = struct.Struct('<h2xfh6x3f2xh')
+_VERTEX_NORMAL = struct.Struct('<3f4x')
+_VERTEX_COLOR = {'f': struct.Struct('<4f'), 'I': struct.Struct('<4I')}
+_VERTEX_UV = struct.Struct('<2f4xH2x')
+# DMA tag, then vertex record count, vertex count and render mode at 0x14.
+_VIF_HEADER = struct.Struct('<I16xH2xH2xH18x')
+_VIF_END = struct.Struct('<I12x').pack(0x60000000)
+
+# Packets are limited by the 8-bit quadword count of their DMA tag.
+_MAX_PACKET_SIZE = 0x100 * 0x10
+
+# Name (0x0) and parent index (0x10).
+_BONE = struct.Struct('<16sh2x')
+# Bone count, then offsets of the bone table, the bone transforms, the texture
+# table (with its entry count first) and the opaque and translucent VIF
+# packets.
+_MODEL_HEADER = struct.Struct('<7I4x')
+# Mesh index (0x0), rotation in tenths of a degree (0x8), position (0x10) and
+# scale (0x20).
+_INSTANCE = struct.Struct('<H6x3h2x3f4x3f20x')
+# Name (0x0), offset (0x10) and size (0x1C). Entries with filenames longer than
+# 16 bytes store the offset (0x0) before the name (0x4) and set the highest bit
+# of the size.
+_RSRC_ENTRY = struct.Struct('<16sI8xI')
+_RSRC_LONG_ENTRY = struct.Struct('<I20s4xI')
+_RSRC_LONG_SIZE_FLAG = 0x80000000
+
+# Generated attributes of a triangle strip. influence_counts and positions have
+# one entry per vertex; the other attributes have one entry per vertex record.
+Strip = collections.namedtuple('Strip', [
+    'influence_counts', 'positions', 'weights', 'bone_indices', 'normals',
+    'colors', 'uvs'
+])
+
+
+def _align(data, alignment=0x10):
+  return data + bytes(-len(data) % alignment)
+
+
+# Returns the index of the vertex of each record of a strip.
+def get_record_vertices(strip):
+  return np.repeat(np.arange(len(strip.influence_counts)),
+                   strip.influence_counts)
+
+
+# Returns random attributes for a strip of vertex_count vertices. Each vertex
+# has between 1 and max_influences bone influences with weights that add up to
+# 1.
+def make_strip(vertex_count, bone_count=1, max_influences=1, seed=0):
+  if not 1 <= max_influences <= MAX_VERTEX_INFLUENCES:
+    raise ValueError(f'Unsupported influence count: {max_influences}')
+  rng = np.random.default_rng(seed)
+  if max_influences > 1:
+    influence_counts = rng.integers(1, max_influences + 1, vertex_count)
+  else:
+    influence_counts = np.ones(vertex_count, dtype=np.int64)
+  record_count = int(influence_counts.sum())
+  record_vertex = np.repeat(np.arange(vertex_count), influence_counts)
+
+  weights = rng.uniform(0.1, 1.0, record_count)
+  weights /= np.bincount(record_vertex, weights)[record_vertex]
+  weights = weights.astype(np.float32)
+  normals = rng.normal(size=(record_count, 3))
+  normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+  return Strip(
+      influence_counts=influence_counts,
+      positions=rng.uniform(-100.0, 100.0,
+                            (vertex_count, 3)).astype(np.float32),
+      weights=weights,
+      bone_indices=rng.integers(0, bone_count, record_count),
+      normals=normals.astype(np.float32),
+      colors=rng.integers(0, 0x100, (record_count, 4)),
+      uvs=rng.uniform(0.0, 1.0, (record_count, 2)).astype(np.float32))
+
+
+# Returns VIF packets for a strip in the given render mode. The strip is split
+# into packets of whole vertices, each of which is drawn as its own triangle
+# strip. Vertices with several influences are stored as consecutive records
+# with split indices 1, 2, ... and positions premultiplied by their weight.
+def pack_vif_packets(strip, mode, texture_index=0):
+  has_vnormal, vcol_format, has_uv = VERTEX_LAYOUTS[mode]
+  record_size = (_VERTEX_RECORD.size + has_vnormal * 0x10 +
+                 bool(vcol_format) * 0x10 + has_uv * 0x10)
+  max_packet_records = (_MAX_PACKET_SIZE - _VIF_HEADER.size) // record_size
+
+  record_vertex = get_record_vertices(strip)
+  record_starts = np.cumsum(strip.influence_counts) - strip.influence_counts
+  packets = []
+  start = 0
+  while start < len(strip.influence_counts):
+    # Take as many whole vertices as fit in the packet.
+    counts = strip.influence_counts[start:]
+    n = max(
+        1,
+        np.searchsorted(np.cumsum(counts), max_packet_records, side='right'))
+    first_record = record_starts[start]
+    record_count = int(counts[:n].sum())
+
+    vertex_data = []
+    for r in range(first_record, first_record + record_count):
+      v = record_vertex[r]
+      i = v - start
+      # The first two vertices of a strip do not complete a triangle.
+      flag = 0x80 if i < 2 else 0x20 if i % 2 else 0x00
+      influence_count = strip.influence_counts[v]
+      split_index = r - record_starts[v] + 1 if influence_count > 1 else 0
+      weight = float(strip.weights[r])
+      vertex_data.append(
+          _VERTEX_RECORD.pack(flag, weight, split_index,
+                              *(strip.positions[v] * weight),
+                              strip.bone_indices[r]))
+      if has_vnormal:
+        vertex_data.append(_VERTEX_NORMAL.pack(*strip.normals[r]))
+      if vcol_format:
+        vertex_data.append(_VERTEX_COLOR[vcol_format].pack(*strip.colors[r]))
+      if has_uv:
+        # Mode 0x4205 stores other data in place of the texture index, which
+        # the decoder ignores.
+        vertex_data.append(_VERTEX_UV.pack(*strip.uvs[r], texture_index))
+    start += n
+
+    body = _align(b''.join(vertex_data))
+    qwc = (_VIF_HEADER.size + len(body)) // 0x10 - 1
+    packets.append(
+        _VIF_HEADER.pack(0x10000000 | qwc, record_count, n, mode) + body)
+
+  return b''.join(packets)
+
+
+# Returns VIF packets for a random strip. See make_strip() and
+# pack_vif_packets().
+def make_vif_packets(vertex_count,
+                     mode,
+                     texture_index=0,
+                     bone_count=1,
+                     max_influences=1,
+                     seed=0):
+  strip = make_strip(vertex_count, bone_count, max_influences, seed)
+  return pack_vif_packets(strip, mode, texture_index)
+
+
+# Returns a single model with a bone table, bone transforms, a texture table
+# and opaque VIF packets in each of the given render modes. The nth mode uses
+# the nth texture and a strip generated with seed + n. Submeshes are split by
+# texture, so modes without UVs should not be mixed with other modes.
+def make_model(vertex_count,
+               modes=TEXTURED_RENDER_MODES,
+               texture_names=('tex0',),
+               bone_count=4,
+               max_influences=1,
+               seed=0):
+  bone_table = _align(b''.join(
+      _BONE.pack(f'bone{i}'.encode('ascii'), i - 1) for i in range(bone_count)))
+
+  # Matrices are stored column-major.
+  transforms = np.tile(np.eye(4, dtype='<f4'), (bone_count, 1, 1))
+  transforms[1:, 3, 1] = 10.0
+  texture_table = b''.join(
+      name.encode('ascii').ljust(0x20, b'\0') for name in texture_names)
+
+  vif = b''
+  for i, mode in enumerate(modes):
+    mode_vertex_count = vertex_count // len(modes)
+    if i < vertex_count % len(modes):
+      mode_vertex_count += 1
+    vif += make_vif_packets(mode_vertex_count,
+                            mode,
+                            texture_index=i % max(1, len(texture_names)),
+                            bone_count=bone_count,
+                            max_influences=max_influences,
+                            seed=seed + i)
+  vif += _VIF_END
+
+  bone_table_offs = _MODEL_HEADER.size
+  transform_table_offs = bone_table_offs + len(bone_table)
+  texture_table_offs = transform_table_offs + transforms.nbytes
+  vif_offs = texture_table_offs + len(texture_table)
+
+  header = _MODEL_HEADER.pack(bone_count, bone_table_offs, transform_table_offs,
+                              len(texture_names), texture_table_offs, vif_offs,
+                              0)
+  return header + bone_table + transforms.tobytes() + texture_table + vif
+
+
+# Returns an MDL file with the given models.
+def make_mdl(models):
+  table_size = max(0x40, (len(models) + 1) * 4)
+  offsets = []
+  data = b''
+  for model in models:
+    offsets.append(table_size + len(data))
+    data += _align(model)
+  offsets += [0] * (table_size // 4 - len(offsets))
+  return struct.pack(f'<{len(offsets)}I', *offsets) + data
+
+
+# Returns a stage with mesh_count meshes placed by instance_count instances.
+# Each mesh uses a single render mode, cycling through RENDER_MODES.
+def make_azf(mesh_count,
+             instance_count,
+             vertex_count,
+             skybox_count=0,
+             texture_names=('tex0',),
+             seed=0):
+  meshes = [
+      make_model(vertex_count,
+                 modes=(RENDER_MODES[i % len(RENDER_MODES)],),
+                 texture_names=texture_names,
+                 bone_count=1,
+                 seed=seed + i) for i in range(mesh_count)
+  ]
+
+  rng = np.random.default_rng(seed)
+  rotations = rng.integers(-1800, 1800, (instance_count, 3))
+  positions = rng.uniform(-1000.0, 1000.0, (instance_count, 3))
+  instances = b''.join(
+      _INSTANCE.pack(i % mesh_count, *rotations[i], *positions[i], 1.0, 1.0,
+                     1.0) for i in range(instance_count))
+
+  # The mesh count is implied by the offset of the instance table header.
+  instance_table_header_offs = 4 + mesh_count * 4
+  instance_table_offs = len(_align(bytes(instance_table_header_offs + 8)))
+  mesh_data_offs = instance_table_offs + len(instances)
+
+  mesh_offsets = []
+  mesh_data = b''
+  for mesh in meshes:
+    mesh_offsets.append(mesh_data_offs + len(mesh_data))
+    mesh_data += _align(mesh)
+
+  mesh_table = struct.pack(f'<{mesh_count + 1}I', instance_table_header_offs,
+                           *mesh_offsets)
+  instance_table_header = struct.pack(
+      '<2HI', instance_count, skybox_count,
+      instance_table_offs - instance_table_header_offs)
+  return (_align(mesh_table + instance_table_header) + instances + mesh_data)
+
+
+# Returns a single-image TIM2 file with an indexed pixel format of 4 or 8
+# bits per pixel.
+def make_tim2(width, height, bpp=8, seed=0):
+  rng = np.random.default_rng(seed)
+  color_count = 1 << bpp
+  indices = rng.integers(0, color_count, width * height, dtype=np.uint8)
+  if bpp == 4:
+    image = (indices[0::2] | (indices[1::2] << 4)).astype(np.uint8)
+    image_format = 0x4
+  elif bpp == 8:
+    image = indices
+    image_format = 0x5
+  else:
+    raise ValueError(f'Unsupported bits per pixel: {bpp}')
+  clut = rng.integers(0, 0x100, (color_count, 4), dtype=np.uint8)
+  clut[:, 3] = 0x80
+
+  header = np.zeros(0x40, dtype=np.uint8)
+  header[:4] = np.frombuffer(b'TIM2', dtype=np.uint8)
+  header[0x4:0x6] = (4, 0)
+  header[0x6:0x8] = (1, 0)  # Image count
+  image_header = header[0x10:].view('<u4')
+  image_header[:3] = (0x30 + image.nbytes + clut.nbytes, clut.nbytes,
+                      image.nbytes)
+  header[0x1C:0x20] = np.frombuffer(
+      np.array((0x30, color_count), dtype='<u2').tobytes(), dtype=np.uint8)
+  header[0x20:0x24] = (0, 1, 0x3, image_format)
+  header[0x24:0x28] = np.frombuffer(
+      np.array((width, height), dtype='<u2').tobytes(), dtype=np.uint8)
+  return header.tobytes() + image.tobytes() + clut.tobytes()
+
+
+# Returns an rsrc archive of the given (filename, data) tuples. Filenames of up
+# to 20 bytes are supported.
+def make_rsrc(files):
+  # The entry table ends with an empty entry.
+  header_size = (len(files) + 1) * _RSRC_ENTRY.size
+  entries = []
+  data = b''
+  for filename, file_data in files:
+    name = filename.encode('ascii')
+    offs = header_size + len(data)
+    if len(name) <= 0x10:
+      entries.append(_RSRC_ENTRY.pack(name, offs, len(file_data)))
+    elif len(name) <= 0x14:
+      entries.append(
+          _RSRC_LONG_ENTRY.pack(offs, name,
+                                len(file_data) | _RSRC_LONG_SIZE_FLAG))
+    else:
+      raise ValueError(f'Filename is too long: {filename}')
+    data += _align(file_data)
+  return b''.join(entries) + bytes(_RSRC_ENTRY.size) + data
+
+
+# Returns a texture archive of TIM2 images named {name}.tm2.
+def make_rtm(texture_names, width, height, bpp=8, seed=0):
+  return make_rsrc([(f'{name}.tm2', make_tim2(width, height, bpp, seed + i))
+                    for i, name in enumerate(texture_names)])
+
+
+# Returns a GSD file with placement_count placements of the given gimmick
+# resource ids, split into groups of at most group_size objects.
+def make_gsd(rsrc_ids, placement_count, group_size=0x40, seed=0):
+  rng = np.random.default_rng(seed)
+  objects = []
+  for i in range(placement_count):
+    flags = 0x2 if i % 2 else 0x0
+    obj = np.zeros(0x28 // 4, dtype='<u4')
+    obj[:5].view('<f4')[:] = (*rng.uniform(-1000.0, 1000.0, 3),
+                              rng.uniform(0.0, 10.0),
+                              rng.uniform(-np.pi, np.pi))
+    obj[5] = rsrc_ids[i % len(rsrc_ids)] << 16
+    obj[6] = flags
+    obj[9] = i
+    if flags & 0x2:
+      obj = np.append(obj,
+                      rng.uniform(-np.pi, np.pi, 2).astype('<f4').view('<u4'))
+    objects.append(obj.tobytes())
+
+  groups = [
+      objects[i:i + group_size] for i in range(0, len(objects), group_size)
+  ][:0x10]
+
+  # The OSD header is followed by one formation with a single group table.
+  formation_offs = 0x88
+  group_table_offs = formation_offs + 0x80
+  group_offs = group_table_offs + 0x40
+  object_offs = group_offs + len(groups) * 0x10
+
+  osd_header = np.zeros(0x22, dtype='<u4')
+  osd_header[1] = 0x4
+  osd_header[2] = formation_offs
+  group_offsets = np.zeros(0x10, dtype='<u4')
+  group_headers = np.zeros((len(groups), 4), dtype='<u4')
+  object_data = b''
+  for i, group in enumerate(groups):
+    group_offsets[i] = group_offs + i * 0x10
+    group_headers[i, 1:3] = (len(group), object_offs + len(object_data))
+    object_data += b''.join(group)
+
+  osd = (b'@OSD' + osd_header[1:].tobytes() + bytes(0x80) +
+         group_offsets.tobytes() + group_headers.tobytes() + object_data)
+  return make_rsrc([('gsd.osd', osd)])
+
+
+# Writes a stage folder to directory. Returns a dict of the written paths by
+# type.
+def write_fixtures(directory,
+                   vertex_count=10000,
+                   mesh_count=8,
+                   instance_count=64,
+                   texture_size=256,
+                   texture_count=4,
+                   gimmick_count=4,
+                   placement_count=32,
+                   seed=0):
+  os.makedirs(directory, exist_ok=True)
+  texture_names = [f'tex{i}' for i in range(texture_count)]
+  if texture_count > 1:
+    # Stored with a long rsrc entry.
+    texture_names[-1] = f'tex{texture_count - 1}_long_name'
+  gimmick_ids = list(range(1, gimmick_count + 1))
+
+  files = {
+      'azf':
+          make_azf(mesh_count,
+                   instance_count,
+                   max(1, vertex_count // mesh_count),
+                   texture_names=texture_names,
+                   seed=seed),
+      'rtm':
+          make_rtm(texture_names, texture_size, texture_size, 8, seed),
+      'mdl':
+          make_mdl([
+              make_model(vertex_count,
+                         modes=TEXTURED_RENDER_MODES + (0x4205,),
+                         texture_names=texture_names,
+                         max_influences=4,
+                         seed=seed)
+          ]),
+      'gsd':
+          make_gsd(gimmick_ids, placement_count, seed=seed),
+  }
+  paths = {
+      'azf': os.path.join(directory, 'st01.azf'),
+      'rtm': os.path.join(directory, 'st01.rtm'),
+      'mdl': os.path.join(directory, 'pc01.mdl'),
+      'gsd': os.path.join(directory, 'st01.gsd'),
+  }
+  for key, data in files.items():
+    with open(paths[key], 'wb') as f:
+      f.write(data)
+
+  gimmick_textures = [f'gm{i}' for i in range(texture_count)]
+  paths['gimmicks'] = []
+  for rsrc_id in gimmick_ids:
+    path = os.path.join(directory, f'GM{rsrc_id:04d}.mdl')
+    with open(path, 'wb') as f:
+      f.write(
+          make_mdl([
+              make_model(max(1, vertex_count // gimmick_count // 4),
+                         texture_names=gimmick_textures,
+                         max_influences=2,
+                         seed=seed + rsrc_id)
+          ]))
+    paths['gimmicks'].append(path)
+
+  paths['gimmick_rtm'] = os.path.join(directory, 'gm01.rtm')
+  with open(paths['gimmick_rtm'], 'wb') as f:
+    f.write(make_rtm(gimmick_textures, texture_size // 2, texture_size // 2, 4,
+                     seed))
+  return paths
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+      description='Write synthetic KH Re:COM stage files for tests.')
+  parser.add_argument('output_directory')
+  parser.add_argument('--vertices',
+                      type=int,
+                      default=10000,
+                      help='Number of vertices per model.')
+  parser.add_argument('--instances',
+                      type=int,
+                      default=64,
+                      help='Number of stage instances.')
+  parser.add_argument('--texture-size',
+                      type=int,
+                      default=256,
+                      help='Width and height of each texture.')
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args(argv)
+
+  paths = write_fixtures(args.output_directory,
+                         vertex_count=args.vertices,
+                         instance_count=args.instances,
+                         texture_size=args.texture_size,
+                         seed=args.seed)
+  for key, path in paths.items():
+    print(f'{key}: {path}')
+
+
+if __name__ == '__main__':
+  main()
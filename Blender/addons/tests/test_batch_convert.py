@@ -0,0 +1,92 @@
+import json
+import os
+import pytest
+import sys
+import synthetic
+
+from io_kh_recom import batch_convert
+
+# Stands in for Blender: writes the output file and a successful result for
+# the arguments after "--".
+_FAKE_BLENDER = f'''#!{sys.executable}
+import json
+import os
+import sys
+input_path, output_path, result_path = sys.argv[sys.argv.index('--') + 1:][:3]
+os.makedirs(os.path.dirname(output_path), exist_ok=True)
+with open(output_path, 'w') as f:
+  f.write(' '.join(sys.argv[sys.argv.index('--') + 4:]))
+with open(result_path, 'w') as f:
+  json.dump({{'status': 'converted', 'message': '', 'import_seconds': 0}}, f)
+'''
+
+
+@pytest.fixture
+def extract(tmp_path):
+  input_directory = tmp_path / 'extract'
+  input_directory.mkdir()
+  model = synthetic.make_model(16, modes=(0x6,))
+  (input_directory / 'pc01.mdl').write_bytes(synthetic.make_mdl([model]))
+  return str(input_directory), str(tmp_path / 'output')
+
+
+def _set_mtime(path, mtime):
+  os.utime(path, (mtime, mtime))
+
+
+def test_is_up_to_date(extract):
+  input_directory, output_directory = extract
+  input_path = os.path.join(input_directory, 'pc01.mdl')
+  output_path = os.path.join(output_directory, 'pc01.mdl.blend')
+  options = {name: False for name in batch_convert.OUTPUT_OPTIONS}
+  assert not batch_convert.is_up_to_date(input_path, output_path)
+
+  os.makedirs(output_directory)
+  with open(output_path, 'w') as f:
+    f.write('blend')
+  _set_mtime(input_path, 1000)
+  _set_mtime(output_path, 2000)
+  assert batch_convert.is_up_to_date(input_path, output_path)
+  # Outputs without recorded options are converted again.
+  assert not batch_convert.is_up_to_date(input_path, output_path, options)
+
+  with open(batch_convert.get_options_path(output_path), 'w') as f:
+    json.dump(options, f)
+  assert batch_convert.is_up_to_date(input_path, output_path, options)
+  assert not batch_convert.is_up_to_date(input_path, output_path,
+                                         dict(options, weld_vertices=True))
+
+  # Texture archives read by the import are dependencies.
+  archive_path = os.path.join(input_directory, 'pc01.rtm')
+  with open(archive_path, 'wb') as f:
+    f.write(synthetic.make_rtm(['tex0'], 8, 8))
+  _set_mtime(archive_path, 3000)
+  assert not batch_convert.is_up_to_date(input_path, output_path, options)
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason='The fake Blender executable is a Python script')
+def test_main_reconverts_on_option_change(tmp_path, extract, capsys):
+  input_directory, output_directory = extract
+  blender_path = tmp_path / 'blender'
+  blender_path.write_text(_FAKE_BLENDER)
+  blender_path.chmod(0o755)
+
+  def convert(*flags):
+    assert batch_convert.main([
+        input_directory, output_directory, '--blender',
+        str(blender_path), *flags
+    ]) == 0
+    with open(os.path.join(output_directory, 'report.json')) as f:
+      report, = json.load(f)
+    return report['status']
+
+  assert convert('--weld-vertices') == 'converted'
+  with open(os.path.join(output_directory, 'pc01.mdl.blend')) as f:
+    assert f.read() == '--weld-vertices'
+  assert convert('--weld-vertices') == 'skipped'
+  # Caches do not change the output.
+  assert convert('--weld-vertices', '--scene-cache') == 'skipped'
+  assert convert() == 'converted'
+  assert convert('--force') == 'converted'
+  capsys.readouterr()
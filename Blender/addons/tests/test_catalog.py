@@ -0,0 +1,96 @@
+import os
+import pytest
+import synthetic
+
+from io_kh_recom import catalog
+from io_kh_recom import readutil
+
+
+# Writes a small extracted stage folder and returns its directory and the
+# written paths.
+@pytest.fixture
+def stage(tmp_path):
+  directory = str(tmp_path / 'extract' / 'st01')
+  paths = synthetic.write_fixtures(directory,
+                                   vertex_count=64,
+                                   mesh_count=2,
+                                   instance_count=2,
+                                   texture_size=8,
+                                   texture_count=2,
+                                   gimmick_count=2,
+                                   placement_count=2)
+  return directory, paths
+
+
+@pytest.fixture
+def asset_catalog(tmp_path):
+  with catalog.AssetCatalog(str(tmp_path / 'catalog.sqlite')) as c:
+    yield c
+
+
+def test_refresh_directory(asset_catalog, stage):
+  directory, _ = stage
+  assert asset_catalog.refresh_directory(directory)
+  # Unchanged directories are only checked once per session.
+  assert not asset_catalog.refresh_directory(directory)
+  assert asset_catalog.list_directory(directory) == [
+      'GM0001.mdl', 'GM0002.mdl', 'gm01.rtm', 'pc01.mdl', 'st01.azf',
+      'st01.gsd', 'st01.rtm'
+  ]
+
+  # Directories are indexed again once files are added or removed.
+  os.remove(os.path.join(directory, 'GM0002.mdl'))
+  with open(os.path.join(directory, 'notes.txt'), 'w') as f:
+    f.write('Not indexed')
+  assert asset_catalog.refresh_directory(directory)
+  assert 'GM0002.mdl' not in asset_catalog.list_directory(directory)
+  assert 'notes.txt' not in asset_catalog.list_directory(directory)
+
+
+def test_refresh_directory_reuses_stored_index(tmp_path, asset_catalog, stage):
+  directory, _ = stage
+  asset_catalog.refresh(str(tmp_path / 'extract'))
+
+  with catalog.AssetCatalog(asset_catalog.path) as other:
+    assert not other.refresh_directory(directory)
+    assert other.list_directory(directory) == asset_catalog.list_directory(
+        directory)
+
+
+def test_find_gimmick(asset_catalog, stage):
+  directory, paths = stage
+  assert asset_catalog.find_gimmick(directory, 2) == paths['gimmicks'][1]
+  assert asset_catalog.find_gimmick(directory, 99) is None
+
+
+def test_find_textures(asset_catalog, stage):
+  directory, paths = stage
+  asset_catalog.refresh_directory(directory)
+  with readutil.BinaryFileReader(paths['rtm']) as f:
+    rsrc_index = readutil.read_rsrc_index(f)
+
+  # Names are found with or without their extension, including names stored
+  # in long rsrc entries.
+  for name in ('tex0', 'tex1_long_name.tm2'):
+    entry, = asset_catalog.find_textures(name)
+    assert os.path.samefile(entry.filepath, paths['rtm'])
+    filename = name if name.endswith('.tm2') else f'{name}.tm2'
+    i = rsrc_index.find(filename)
+    assert (entry.offset, entry.size) == (rsrc_index.offsets[i],
+                                          rsrc_index.sizes[i])
+  assert asset_catalog.find_textures('missing') == []
+
+
+def test_get_rsrc_index_after_rewrite(asset_catalog, stage):
+  directory, paths = stage
+  assert len(asset_catalog.get_rsrc_index(paths['gimmick_rtm'])) == 2
+
+  # Archives rewritten in place are indexed again.
+  with open(paths['gimmick_rtm'], 'wb') as f:
+    f.write(synthetic.make_rtm(['gm0', 'gm1', 'gm2'], 8, 8))
+  rsrc_index = asset_catalog.get_rsrc_index(paths['gimmick_rtm'])
+  assert len(rsrc_index) == 3
+  entry, = asset_catalog.find_textures('gm2')
+  assert os.path.samefile(entry.filepath, paths['gimmick_rtm'])
+  assert asset_catalog.get_rsrc_index(os.path.join(directory,
+                                                   'missing.rtm')) is None
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+import synthetic
+
+from io_kh_recom import decode_azf
+
+
+def test_parse_index_list():
+  assert decode_azf.parse_index_list('0-3, 7') == {0, 1, 2, 3, 7}
+  assert decode_azf.parse_index_list(' 5 ,,2-2,') == {2, 5}
+  assert decode_azf.parse_index_list('') == set()
+
+
+@pytest.mark.parametrize('text', ['a', '1-', '-1-2', '1.5'])
+def test_parse_index_list_rejects_invalid_text(text):
+  with pytest.raises(decode_azf.AzfImportError):
+    decode_azf.parse_index_list(text)
+
+
+def _make_transforms(origins):
+  transforms = np.tile(np.eye(4), (len(origins), 1, 1))
+  transforms[:, :3, 3] = origins
+  return transforms
+
+
+def test_instance_filter_select():
+  mesh_indices = np.array([0, 1, 2, 1])
+  transforms = _make_transforms([(0, 0, 0), (5, 5, 5), (-5, 0, 0), (1, 1, 1)])
+  is_skybox = np.array([True, False, False, False])
+
+  def select(**kwargs):
+    keep = decode_azf.InstanceFilter(**kwargs).select(mesh_indices, transforms,
+                                                      is_skybox)
+    return np.flatnonzero(keep).tolist()
+
+  assert select() == [0, 1, 2, 3]
+  assert select(skybox_only=True) == [0]
+  assert select(mesh_indices={1}) == [1, 3]
+  # Bounds are inclusive and apply to the instance origins.
+  assert select(bounds=((0, 0, 0), (1, 1, 1))) == [0, 3]
+  # Criteria are combined.
+  assert select(mesh_indices={0, 1}, bounds=((0, 0, 0), (2, 2, 2))) == [0, 3]
+
+
+def _write_azf(tmp_path, skybox_count):
+  path = tmp_path / 'stage.azf'
+  path.write_bytes(
+      synthetic.make_azf(mesh_count=4,
+                         instance_count=12,
+                         vertex_count=8,
+                         skybox_count=skybox_count))
+  return str(path)
+
+
+def test_decode_azf_filters_instances(tmp_path):
+  path = _write_azf(tmp_path, skybox_count=2)
+  stage = decode_azf.decode_azf(
+      path, instance_filter=decode_azf.InstanceFilter(mesh_indices={1, 3}))
+
+  # Instances cycle through the meshes.
+  mesh_indices = [instance.mesh_index for instance in stage.instances]
+  assert mesh_indices == [1, 3, 1, 3, 1, 3]
+  # Only the meshes of the selected instances are decoded.
+  assert sorted(stage.meshes) == [1, 3]
+  assert stage.instances[0].is_skybox
+  assert stage.instances[0].name == 'stage-sky_i1_m1'
+  assert stage.instances[1].name == 'stage_i1_m3'
+
+
+def test_decode_azf_skybox(tmp_path):
+  path = _write_azf(tmp_path, skybox_count=2)
+  without_skybox = decode_azf.decode_azf(path, import_skybox=False)
+  skybox_only = decode_azf.decode_azf(
+      path, instance_filter=decode_azf.InstanceFilter(skybox_only=True))
+
+  assert len(without_skybox.instances) == 10
+  assert not any(instance.is_skybox for instance in without_skybox.instances)
+  assert [instance.name for instance in skybox_only.instances
+         ] == ['stage-sky_i0_m0', 'stage-sky_i1_m1']
+  assert sorted(skybox_only.meshes) == [0, 1]
@@ -0,0 +1,87 @@
+import numpy as np
+
+from io_kh_recom import decode_azf
+from io_kh_recom import lod
+from io_kh_recom import mesh_decoder
+
+
+# Returns a flat n x n grid of vertices in the XY plane, with two triangles per
+# grid cell and one bone influence per vertex.
+def _make_grid_submesh(n):
+  submesh = mesh_decoder.SubmeshData('grid', 0, False)
+  x, y = np.meshgrid(np.arange(n, dtype=np.float64), np.arange(n))
+  submesh.vtx = np.stack((x.ravel(), y.ravel(), np.zeros(n * n)), axis=-1)
+  submesh.uv = submesh.vtx[:, :2] / (n - 1)
+  submesh.has_uv = True
+
+  corners = (np.arange(n - 1)[None, :] + n * np.arange(n - 1)[:, None]).ravel()
+  submesh.tri = np.concatenate(
+      (np.stack((corners, corners + 1, corners + n + 1), axis=-1),
+       np.stack((corners, corners + n + 1, corners + n), axis=-1))).astype(
+           np.int32)
+
+  influences = np.zeros(n * n, dtype=mesh_decoder.INFLUENCE_DTYPE)
+  influences['vertex_index'] = np.arange(n * n)
+  influences['bone_index'] = np.arange(n * n) % 3
+  influences['weight'] = 1.0
+  submesh.influences = influences
+  submesh.vertex_count = n * n
+  return submesh
+
+
+def test_decimate_submesh():
+  submesh = _make_grid_submesh(32)
+  proxy = lod.decimate_submesh(submesh, ratio=0.25)
+
+  vertex_count = len(proxy.vtx)
+  assert proxy.name == 'grid_proxy'
+  assert proxy.vertex_count == vertex_count
+  assert 0.15 * 32 * 32 <= vertex_count <= 0.35 * 32 * 32
+  assert len(proxy.uv) == vertex_count
+  # Cluster positions are averages of grid vertices.
+  assert np.all((proxy.vtx >= 0.0) & (proxy.vtx <= 31.0))
+  np.testing.assert_array_equal(proxy.vtx[:, 2], 0.0)
+
+  tri = proxy.tri
+  assert 0 < len(tri) < len(submesh.tri)
+  assert tri.min() >= 0 and tri.max() < vertex_count
+  assert np.all((tri[:, 0] != tri[:, 1]) & (tri[:, 1] != tri[:, 2]) &
+                (tri[:, 0] != tri[:, 2]))
+  assert len(np.unique(np.sort(tri, axis=1), axis=0)) == len(tri)
+
+  # Each proxy vertex keeps the influences and UVs of one of its vertices.
+  np.testing.assert_array_equal(np.sort(proxy.influences['vertex_index']),
+                                np.arange(vertex_count))
+  source_vertex = np.rint(proxy.uv * 31).astype(np.int64) @ (1, 32)
+  order = np.argsort(proxy.influences['vertex_index'])
+  np.testing.assert_array_equal(proxy.influences['bone_index'][order],
+                                source_vertex % 3)
+
+
+def test_decimate_submesh_keeps_meshes_within_target():
+  submesh = _make_grid_submesh(2)
+  proxy = lod.decimate_submesh(submesh, ratio=1.0)
+
+  assert proxy.vtx is submesh.vtx
+  assert proxy.tri is submesh.tri
+  assert proxy.vertex_count == 4
+
+
+def test_select_proxy_meshes():
+  stage = decode_azf.StageData('stage')
+  triangle_counts = {0: 100, 1: 10, 2: 50}
+  for mesh_index, triangle_count in triangle_counts.items():
+    model = mesh_decoder.ModelData('mesh', None, [])
+    submesh = mesh_decoder.SubmeshData('mesh', 0, False)
+    submesh.tri = np.zeros((triangle_count, 3), dtype=np.int32)
+    model.submeshes = [submesh]
+    stage.meshes[mesh_index] = model
+  for mesh_index in (0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 2, 2, 2):
+    stage.instances.append(
+        decode_azf.InstanceData('instance', mesh_index, np.eye(4), False))
+
+  # Costs are 100, 100 and 150 triangles.
+  assert lod.select_proxy_meshes(stage, 0.5, triangle_budget=350) == []
+  assert lod.select_proxy_meshes(stage, 0.5, triangle_budget=300) == [2]
+  assert lod.select_proxy_meshes(stage, 0.5, triangle_budget=250) == [2, 0]
+  assert lod.select_proxy_meshes(stage, 0.5, triangle_budget=200) == [2, 0, 1]
@@ -0,0 +1,207 @@
+import numpy as np
+import pytest
+import synthetic
+
+from conftest import INSTANCE_COUNT, PLACEMENT_COUNT, VERTEX_COUNT
+from io_kh_recom import decode_azf
+from io_kh_recom import decode_gsd
+from io_kh_recom import decode_mdl
+from io_kh_recom import mesh_decoder
+
+
+def _get_submeshes(models):
+  return [submesh for model in models if model for submesh in model.submeshes]
+
+
+# Checks that triangles reference existing vertices and that the weights of
+# each vertex add up to 1. Returns the number of influences of each vertex.
+def _check_submesh(submesh):
+  vertex_count = len(submesh.vtx)
+  assert submesh.vertex_count == vertex_count
+  assert len(submesh.tri)
+  assert submesh.tri.min() >= 0 and submesh.tri.max() < vertex_count
+  for name in ('vn', 'vcol', 'uv'):
+    arr = getattr(submesh, name)
+    assert arr is None or len(arr) == vertex_count
+
+  vertex_index = submesh.influences['vertex_index']
+  assert np.all(np.diff(vertex_index) >= 0)
+  weights = np.bincount(vertex_index,
+                        submesh.influences['weight'],
+                        minlength=vertex_count)
+  np.testing.assert_allclose(weights, 1.0, rtol=1e-5)
+  return np.bincount(vertex_index, minlength=vertex_count)
+
+
+def _write_mdl(tmp_path, model):
+  path = tmp_path / 'model.mdl'
+  path.write_bytes(synthetic.make_mdl([model]))
+  return str(path)
+
+
+def test_decode_azf(benchmark, fixture_paths):
+  stage = benchmark(decode_azf.decode_azf, fixture_paths['azf'])
+
+  assert len(stage.instances) == INSTANCE_COUNT
+  for model in stage.meshes.values():
+    for submesh in model.submeshes:
+      # Stage meshes have a single bone.
+      assert np.all(_check_submesh(submesh) == 1)
+  assert sum(len(submesh.vtx) for submesh in _get_submeshes(
+      stage.meshes.values())) == VERTEX_COUNT
+
+
+def test_decode_mdl(benchmark, fixture_paths):
+  mdl = benchmark(decode_mdl.decode_mdl, fixture_paths['mdl'])
+
+  submeshes = _get_submeshes(mdl.models)
+  influence_counts = np.concatenate(
+      [_check_submesh(submesh) for submesh in submeshes])
+  assert len(influence_counts) == VERTEX_COUNT
+  assert influence_counts.min() == 1 and influence_counts.max() == 4
+
+
+def test_decode_gsd(benchmark, fixture_paths):
+  gsd = benchmark(decode_gsd.decode_gsd, fixture_paths['gsd'])
+
+  assert len(gsd.placements) == PLACEMENT_COUNT
+  for placement in gsd.placements:
+    assert placement.transform.shape == (4, 4)
+
+
+def test_decode_gimmick_mdls(benchmark, fixture_paths):
+  mdls = benchmark(lambda: [
+      decode_mdl.decode_mdl(path) for path in fixture_paths['gimmicks']
+  ])
+
+  for mdl in mdls:
+    influence_counts = np.concatenate(
+        [_check_submesh(submesh) for submesh in _get_submeshes(mdl.models)])
+    assert influence_counts.max() <= 2
+
+
+def test_decode_single_strip(tmp_path):
+  model = synthetic.make_model(10, modes=(0x6,), max_influences=3, seed=1)
+  mdl = decode_mdl.decode_mdl(_write_mdl(tmp_path, model))
+
+  submesh, = _get_submeshes(mdl.models)
+  assert len(submesh.vtx) == 10
+  # The first two vertices of the strip do not complete a triangle.
+  assert len(submesh.tri) == 8
+  expected_counts = np.random.default_rng(1).integers(1, 4, 10)
+  np.testing.assert_array_equal(_check_submesh(submesh), expected_counts)
+
+
+def test_decode_single_bone_strip(tmp_path):
+  # With one bone at the origin, positions are the weighted sums of the
+  # premultiplied influence positions, which are the generated positions.
+  vertex_count = 12
+  model = synthetic.make_model(vertex_count,
+                               modes=(0x406E,),
+                               bone_count=1,
+                               max_influences=3,
+                               seed=2)
+  strip = synthetic.make_strip(vertex_count,
+                               bone_count=1,
+                               max_influences=3,
+                               seed=2)
+  mdl = decode_mdl.decode_mdl(_write_mdl(tmp_path, model))
+
+  submesh, = _get_submeshes(mdl.models)
+  np.testing.assert_allclose(submesh.vtx, strip.positions, rtol=1e-5, atol=1e-4)
+
+  record_vertex = synthetic.get_record_vertices(strip)
+  np.testing.assert_array_equal(submesh.influences['vertex_index'],
+                                record_vertex)
+  np.testing.assert_array_equal(submesh.influences['bone_index'], 0)
+  np.testing.assert_allclose(submesh.influences['weight'], strip.weights)
+
+  # Other attributes are taken from the last record of each vertex.
+  last = np.cumsum(strip.influence_counts) - 1
+  expected_uv = strip.uvs[last].astype(np.float64)
+  expected_uv[:, 1] = 1.0 - expected_uv[:, 1]
+  np.testing.assert_allclose(submesh.uv, expected_uv, rtol=1e-6)
+  np.testing.assert_allclose(submesh.vn, strip.normals[last], rtol=1e-6)
+  np.testing.assert_allclose(submesh.vcol,
+                             strip.colors[last] / (256.0, 256.0, 256.0, 128.0))
+
+  # Each vertex after the first two adds a triangle, with every other triangle
+  # reversed to keep the winding order of the strip.
+  expected_tri = [(v - 2, v - 1, v) if v % 2 else (v, v - 1, v - 2)
+                  for v in range(2, vertex_count)]
+  np.testing.assert_array_equal(submesh.tri, expected_tri)
+
+
+def test_decode_4205_ignores_texture_index(tmp_path):
+  # Packets of mode 0x4205 store other data where the texture index would be,
+  # so their vertices are added to the submesh of the first texture.
+  model = synthetic.make_model(10,
+                               modes=(0x6, 0x4205),
+                               texture_names=('tex0', 'tex1'))
+  mdl = decode_mdl.decode_mdl(_write_mdl(tmp_path, model))
+
+  submesh, = _get_submeshes(mdl.models)
+  assert submesh.texture_index == 0
+  assert len(submesh.vtx) == 10
+  assert len(submesh.tri) == 6
+  _check_submesh(submesh)
+
+
+def test_batch_vertex_weights():
+  vertex_indices = np.array([0, 0, 1, 2, 2, 2, 3])
+  weights = np.array([0.5, 0.5, 1.0, 0.2, 0.3, 0.5, 1.0], dtype=np.float32)
+  added = np.zeros(4)
+  for batch_indices, weight in mesh_decoder.batch_vertex_weights(
+      vertex_indices, weights):
+    # Each batch adds a single weight to distinct vertices.
+    assert len(set(batch_indices)) == len(batch_indices)
+    added[batch_indices] += weight
+  np.testing.assert_allclose(added, 1.0, rtol=1e-6)
+
+
+def test_weld_vertices():
+  submesh = mesh_decoder.SubmeshData('quad', 0, False)
+  # Vertices 3 and 4 repeat vertices 2 and 1. Vertex 5 shares the position of
+  # vertex 0 but not its UV, and vertex 6 shares the position and UV of vertex 1
+  # but not its weights.
+  submesh.vtx = np.array([(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 1, 0),
+                          (1, 0, 0), (0, 0, 0), (1, 0, 0)], dtype=np.float64)
+  submesh.uv = np.array([(0, 0), (1, 0), (0, 1), (0, 1), (1, 0), (0.5, 0.5),
+                         (1, 0)])
+  submesh.tri = np.array([(0, 1, 2), (3, 4, 5), (6, 4, 3), (1, 4, 2)],
+                         dtype=np.int32)
+  submesh.influences = np.array([(0, 0, 1.0), (1, 0, 1.0), (2, 1, 1.0),
+                                 (3, 1, 1.0), (4, 0, 1.0), (5, 0, 1.0),
+                                 (6, 0, 0.5), (6, 1, 0.5)],
+                                dtype=mesh_decoder.INFLUENCE_DTYPE)
+  submesh.vertex_count = 7
+
+  mesh_decoder.weld_vertices(submesh)
+
+  # Welded vertices keep the order of their first occurrence.
+  assert submesh.vertex_count == 5
+  np.testing.assert_array_equal(submesh.vtx, [(0, 0, 0), (1, 0, 0), (0, 1, 0),
+                                              (0, 0, 0), (1, 0, 0)])
+  np.testing.assert_array_equal(submesh.uv, [(0, 0), (1, 0), (0, 1),
+                                             (0.5, 0.5), (1, 0)])
+  # The last triangle collapsed onto an edge and is dropped.
+  np.testing.assert_array_equal(submesh.tri, [(0, 1, 2), (2, 1, 3), (4, 1, 2)])
+  np.testing.assert_array_equal(submesh.influences['vertex_index'],
+                                [0, 1, 2, 3, 4, 4])
+  np.testing.assert_array_equal(submesh.influences['bone_index'],
+                                [0, 0, 1, 0, 0, 1])
+  np.testing.assert_array_equal(submesh.influences['weight'],
+                                [1.0, 1.0, 1.0, 1.0, 0.5, 0.5])
+
+
+def test_weld_vertices_decoded_strip(tmp_path):
+  # Random strips have no identical vertices, so welding changes nothing.
+  model = synthetic.make_model(20, modes=(0x406E,), max_influences=3)
+  path = _write_mdl(tmp_path, model)
+  submesh, = _get_submeshes(decode_mdl.decode_mdl(path).models)
+  welded, = _get_submeshes(
+      decode_mdl.decode_mdl(path, weld_vertices=True).models)
+
+  for name in ('vtx', 'vn', 'vcol', 'uv', 'tri', 'influences'):
+    np.testing.assert_array_equal(getattr(welded, name),
+                                  getattr(submesh, name))
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import synthetic
+
+from io_kh_recom import readutil
+
+RSRC_ENTRY_COUNT = 0x1000
+
+
+# Alternates short and long rsrc entries.
+def _make_rsrc_files(count):
+  return [(f'file{i}.bin' if i % 2 else f'long_name_{i:04d}.bin',
+           bytes(0x10 + i % 0x20)) for i in range(count)]
+
+
+@pytest.fixture(scope='module')
+def rsrc_path(tmp_path_factory):
+  path = tmp_path_factory.mktemp('rsrc') / 'archive.rtm'
+  path.write_bytes(synthetic.make_rsrc(_make_rsrc_files(RSRC_ENTRY_COUNT)))
+  return str(path)
+
+
+def _read_uint32s(filepath):
+  with readutil.BinaryFileReader(filepath) as f:
+    return [f.read_uint32() for _ in range(f.filesize // 4)]
+
+
+def _read_rsrc_index(filepath):
+  # Bypass the index cache to measure header parsing.
+  readutil._rsrc_index_cache.clear()  # pylint: disable=protected-access
+  with readutil.BinaryFileReader(filepath) as f:
+    return readutil.read_rsrc_index(f)
+
+
+def test_read_uint32(benchmark, fixture_paths):
+  values = benchmark(_read_uint32s, fixture_paths['azf'])
+
+  with open(fixture_paths['azf'], 'rb') as f:
+    data = f.read()
+  expected = np.frombuffer(data[:len(data) // 4 * 4], dtype='<u4')
+  assert values == expected.tolist()
+
+
+def test_read_rsrc_index(benchmark, rsrc_path):
+  rsrc_index = benchmark(_read_rsrc_index, rsrc_path)
+
+  files = _make_rsrc_files(RSRC_ENTRY_COUNT)
+  assert len(rsrc_index) == len(files)
+  offs = (len(files) + 1) * 0x20
+  for (filename, data), entry in zip(files, rsrc_index):
+    assert entry == (filename, offs, len(data))
+    offs += -(-len(data) // 0x10) * 0x10
+
+
+def test_read_rsrc_index_finds_long_names(rsrc_path):
+  rsrc_index = _read_rsrc_index(rsrc_path)
+  assert rsrc_index.find('long_name_0002.bin') == 2
+  assert rsrc_index.find('file3.bin') == 3
+  assert rsrc_index.find('missing.bin') == -1
+
+
+def test_read_rsrc_index_caches_empty_index(tmp_path):
+  path = tmp_path / 'empty.rtm'
+  path.write_bytes(synthetic.make_rsrc([]))
+  with readutil.BinaryFileReader(str(path)) as f:
+    rsrc_index = readutil.read_rsrc_index(f)
+  with readutil.BinaryFileReader(str(path)) as f:
+    assert readutil.read_rsrc_index(f) is rsrc_index
+  assert len(rsrc_index) == 0
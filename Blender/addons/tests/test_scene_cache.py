@@ -0,0 +1,115 @@
+import numpy as np
+import os
+import pytest
+
+from io_kh_recom import decode_azf
+from io_kh_recom import decode_mdl
+from io_kh_recom import scene_cache
+
+
+# Touches every array so that all pages of the mapping are read.
+def _read_cached_scenes(cache, paths):
+  scenes = [cache.decode_azf(paths['azf']), cache.decode_mdl(paths['mdl'])]
+  vertex_count = 0
+  for models in (scenes[0].meshes.values(), scenes[1].models):
+    for model in models:
+      for submesh in model.submeshes if model else ():
+        submesh.vtx.sum()
+        vertex_count += len(submesh.vtx)
+  return vertex_count
+
+
+@pytest.fixture
+def cache(tmp_path):
+  return scene_cache.SceneCache(str(tmp_path / 'scenes'))
+
+
+def test_read_cached_scenes(benchmark, cache, fixture_paths):
+  expected = _read_cached_scenes(cache, fixture_paths)
+  assert benchmark(_read_cached_scenes, cache, fixture_paths) == expected
+
+
+def _write_and_read(tmp_path, data):
+  path = tmp_path / 'scene.khsc'
+  with open(path, 'wb') as f:
+    scene_cache.write_scene(f, data)
+  return scene_cache.read_scene(str(path))
+
+
+def _assert_models_equal(actual, expected):
+  assert actual.basename == expected.basename
+  assert actual.texture_names == expected.texture_names
+  assert len(actual.submeshes) == len(expected.submeshes)
+  for actual_submesh, expected_submesh in zip(actual.submeshes,
+                                              expected.submeshes):
+    for name in ('name', 'texture_index', 'is_translucent', 'invert_normals',
+                 'has_uv', 'has_vcol', 'vertex_count'):
+      assert getattr(actual_submesh, name) == getattr(expected_submesh, name)
+    for name in ('vtx', 'vn', 'uv', 'vcol', 'tri', 'influences'):
+      expected_array = getattr(expected_submesh, name)
+      if expected_array is None:
+        assert getattr(actual_submesh, name) is None
+      else:
+        np.testing.assert_array_equal(getattr(actual_submesh, name),
+                                      expected_array)
+
+
+def test_round_trip_mdl(tmp_path, fixture_paths):
+  mdl = decode_mdl.decode_mdl(fixture_paths['mdl'])
+  cached = _write_and_read(tmp_path, mdl)
+
+  assert cached.basename == mdl.basename
+  assert cached.armature.bone_names == mdl.armature.bone_names
+  assert cached.armature.parent_indices == mdl.armature.parent_indices
+  np.testing.assert_array_equal(cached.armature.bone_matrices,
+                                mdl.armature.bone_matrices)
+  assert len(cached.models) == len(mdl.models)
+  for cached_model, model in zip(cached.models, mdl.models):
+    # Models share the armature of their file.
+    assert cached_model.armature is cached.armature
+    _assert_models_equal(cached_model, model)
+
+
+def test_round_trip_azf(tmp_path, fixture_paths):
+  stage = decode_azf.decode_azf(fixture_paths['azf'])
+  cached = _write_and_read(tmp_path, stage)
+
+  assert sorted(cached.meshes) == sorted(stage.meshes)
+  for mesh_index, model in stage.meshes.items():
+    _assert_models_equal(cached.meshes[mesh_index], model)
+  assert len(cached.instances) == len(stage.instances)
+  for cached_instance, instance in zip(cached.instances, stage.instances):
+    assert cached_instance.name == instance.name
+    assert cached_instance.mesh_index == instance.mesh_index
+    assert cached_instance.is_skybox == instance.is_skybox
+    np.testing.assert_array_equal(cached_instance.transform,
+                                  instance.transform)
+
+
+def test_read_scene_rejects_other_versions(tmp_path, monkeypatch,
+                                           fixture_paths):
+  mdl = decode_mdl.decode_mdl(fixture_paths['mdl'])
+  path = tmp_path / 'scene.khsc'
+  with open(path, 'wb') as f:
+    scene_cache.write_scene(f, mdl)
+
+  monkeypatch.setattr(scene_cache, 'FORMAT_VERSION',
+                      scene_cache.FORMAT_VERSION + 1)
+  assert scene_cache.read_scene(str(path)) is None
+
+
+def test_evict_least_recently_used(cache, fixture_paths):
+  mdl = decode_mdl.decode_mdl(fixture_paths['gimmicks'][0])
+  keys = [f'{i:040x}' for i in range(3)]
+  for i, key in enumerate(keys):
+    cache.put(key, mdl)
+    path = os.path.join(cache.directory, f'{key}.khsc')
+    os.utime(path, (i, i))
+  # Reading an entry marks it as recently used.
+  assert cache.get(keys[0]) is not None
+
+  cache.max_size = os.path.getsize(path) * 2
+  cache.evict()
+  assert cache.get(keys[0]) is not None
+  assert cache.get(keys[1]) is None
+  assert cache.get(keys[2]) is not None
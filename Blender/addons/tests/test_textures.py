@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+import synthetic
+
+from conftest import TEXTURE_COUNT, TEXTURE_SIZE
+from io_kh_recom import readutil
+from io_kh_recom import textures
+
+
+# Returns the pixels that synthetic.make_tim2() encodes, as decode_tim2()
+# should return them.
+def _get_expected_pixels(width, height, bpp, seed):
+  rng = np.random.default_rng(seed)
+  color_count = 1 << bpp
+  indices = rng.integers(0, color_count, width * height, dtype=np.uint8)
+  clut = rng.integers(0, 0x100, (color_count, 4), dtype=np.uint8)
+  clut[:, 3] = 0x80
+  if bpp == 8:
+    # Bits 3 and 4 of 8-bit indices are swapped in the CLUT.
+    indices = ((indices >> 1) & 0x8) | ((indices << 1) & 0x10) | (indices &
+                                                                  0xE7)
+  colors = clut[indices] / np.array((0xFF, 0xFF, 0xFF, 0x80))
+  return colors.reshape(height, width, 4)[::-1].ravel()
+
+
+def _decode_tim2(filepath):
+  with readutil.BinaryFileReader(filepath) as f:
+    return textures.decode_tim2(f, 0, 'test')
+
+
+@pytest.mark.parametrize('bpp', [4, 8])
+def test_decode_tim2(benchmark, tmp_path, bpp):
+  path = tmp_path / f'tex{bpp}.tm2'
+  path.write_bytes(
+      synthetic.make_tim2(TEXTURE_SIZE, TEXTURE_SIZE, bpp, seed=bpp))
+
+  width, height, pixels = benchmark(_decode_tim2, str(path))
+
+  assert (width, height) == (TEXTURE_SIZE, TEXTURE_SIZE)
+  assert pixels.dtype == np.float32
+  np.testing.assert_allclose(pixels,
+                             _get_expected_pixels(width, height, bpp, bpp),
+                             rtol=1e-6)
+
+
+@pytest.mark.parametrize('bpp', [4, 8])
+def test_decode_non_square_tim2(tmp_path, bpp):
+  path = tmp_path / f'tex{bpp}.tm2'
+  path.write_bytes(synthetic.make_tim2(32, 8, bpp, seed=3))
+
+  width, height, pixels = _decode_tim2(str(path))
+
+  assert (width, height) == (32, 8)
+  np.testing.assert_allclose(pixels,
+                             _get_expected_pixels(32, 8, bpp, 3),
+                             rtol=1e-6)
+
+
+def test_texture_index(fixture_paths):
+  index = textures.TextureIndex()
+  index.add_archives([fixture_paths['rtm']])
+
+  for i in range(TEXTURE_COUNT - 1):
+    assert index.get(f'tex{i}')
+  # The last texture has a name that needs a long rsrc entry.
+  entry = index.get(f'tex{TEXTURE_COUNT - 1}_long_name')
+  assert entry
+  decoded = textures.decode_texture_file(entry.filepath, entry.offset,
+                                         entry.size, 'long')
+  assert decoded[:2] == (TEXTURE_SIZE, TEXTURE_SIZE)
+  assert not index.get('missing')
+
+
+def _get_texture_jobs(filepath):
+  with readutil.BinaryFileReader(filepath) as f:
+    rsrc_index = readutil.read_rsrc_index(f)
+  return [(filepath, offs, size, name[:-4])
+          for name, offs, size in rsrc_index]
+
+
+# Compares in-process decoding with worker processes, with the size threshold
+# for starting workers disabled. Run with --benchmark-enable to find the size
+# at which workers pay off on a given machine.
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_decode_textures(benchmark, monkeypatch, capsys, fixture_paths,
+                         max_workers):
+  monkeypatch.setattr(textures, 'MIN_PARALLEL_DECODE_SIZE', 0)
+  jobs = _get_texture_jobs(fixture_paths['rtm'])
+
+  decoded = benchmark.pedantic(
+      lambda: list(textures.decode_textures(jobs, max_workers=max_workers)),
+      rounds=3)
+
+  # Workers report failures before falling back to in-process decoding.
+  assert 'failed' not in capsys.readouterr().out
+  assert [name for name, _ in decoded] == [job[3] for job in jobs]
+  for (_, offs, size, name), (_, result) in zip(jobs, decoded):
+    expected = textures.decode_texture_file(fixture_paths['rtm'], offs, size,
+                                            name)
+    assert result[:2] == expected[:2]
+    np.testing.assert_array_equal(result[2], expected[2])
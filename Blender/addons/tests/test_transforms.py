@@ -0,0 +1,69 @@
+import math
+import numpy as np
+
+from io_kh_recom import transforms
+
+
+def _rotation_x(angle):
+  c, s = math.cos(angle), math.sin(angle)
+  return np.array([[1, 0, 0], [0, c, -s], [0, s, c]])
+
+
+def _rotation_y(angle):
+  c, s = math.cos(angle), math.sin(angle)
+  return np.array([[c, 0, s], [0, 1, 0], [-s, 0, c]])
+
+
+def _rotation_z(angle):
+  c, s = math.cos(angle), math.sin(angle)
+  return np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+
+# XYZ Euler angles rotate around X first, then Y, then Z.
+def _euler_to_matrix(rot):
+  x, y, z = rot
+  return _rotation_z(z) @ _rotation_y(y) @ _rotation_x(x)
+
+
+def _random_eulers(count, seed=0):
+  return np.random.default_rng(seed).uniform(-np.pi, np.pi, (count, 3))
+
+
+def test_euler_to_matrices():
+  rot = _random_eulers(16)
+  expected = np.array([_euler_to_matrix(r) for r in rot])
+  np.testing.assert_allclose(transforms.euler_to_matrices(rot),
+                             expected,
+                             atol=1e-12)
+
+
+def test_euler_to_matrices_single_axis():
+  angle = math.radians(90.0)
+  np.testing.assert_allclose(transforms.euler_to_matrices([(0.0, 0.0, angle)]),
+                             [[[0, -1, 0], [1, 0, 0], [0, 0, 1]]],
+                             atol=1e-12)
+
+
+def test_compose_transforms():
+  rng = np.random.default_rng(1)
+  pos = rng.uniform(-100.0, 100.0, (16, 3))
+  rot = _random_eulers(16, seed=2)
+  scale = rng.uniform(0.5, 2.0, (16, 3))
+
+  matrices = transforms.compose_transforms(pos, rot, scale)
+  assert matrices.shape == (16, 4, 4)
+  for matrix, p, r, s in zip(matrices, pos, rot, scale):
+    translation = np.eye(4)
+    translation[:3, 3] = p
+    rotation = np.eye(4)
+    rotation[:3, :3] = _euler_to_matrix(r)
+    scaling = np.diag([*s, 1.0])
+    expected = transforms.WORLD_TRANSFORM @ translation @ rotation @ scaling
+    np.testing.assert_allclose(matrix, expected, atol=1e-9)
+
+
+def test_compose_transforms_converts_to_z_up():
+  # The game's Y axis becomes Blender's Z axis.
+  matrix, = transforms.compose_transforms([(1.0, 2.0, 3.0)], [(0.0, 0.0, 0.0)])
+  np.testing.assert_allclose(matrix[:3, 3], (1.0, -3.0, 2.0), atol=1e-12)
+  np.testing.assert_allclose(matrix[3], (0.0, 0.0, 0.0, 1.0))